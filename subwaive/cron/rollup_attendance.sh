@@ -0,0 +1,4 @@
+#!/usr/bin/sh
+
+echo "Rolling up attendance"
+curl -s -H 'X-Refresh-Token: '$1 http://subwaive:8000/report/attendance/rollup/by-token/
\ No newline at end of file
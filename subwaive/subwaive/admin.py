@@ -1,9 +1,9 @@
 from django.contrib import admin
 
 from subwaive.models import DocusealField,DocusealFieldStore,DocusealSubmission,DocusealSubmitter,DocusealSubmitterSubmission,DocusealTemplate
-from subwaive.models import CalendarEvent,Event
-from subwaive.models import Log,QRCategory,QRCustom,NFC,NFCTerminal
-from subwaive.models import Person,PersonDocuseal,PersonEmail,PersonEvent,PersonStripe
+from subwaive.models import CalendarEvent,DailyMembership,Event,EventAttendance
+from subwaive.models import Log,QRCategory,QRCustom,NFC,NFCTerminal,WebhookEvent
+from subwaive.models import Person,PersonDocuseal,PersonEligibility,PersonEmail,PersonEvent,PersonSearchToken,PersonStripe,PersonWeekAttendance
 from subwaive.models import StripeCustomer,StripeOneTimePayment,StripePaymentLink,StripePaymentLinkPrice,StripePrice,StripeProduct,StripeSubscription,StripeSubscriptionItem
 
 
@@ -61,6 +61,10 @@ class PersonDocuseal_Admin(admin.ModelAdmin):
     list_display = ('person', 'submitter_id',)
 admin.site.register(PersonDocuseal, PersonDocuseal_Admin)
 
+class PersonEligibility_Admin(admin.ModelAdmin):
+    list_display = ('person', 'has_waiver', 'membership_status', 'is_staff', 'last_check_in_date', 'updated_at',)
+admin.site.register(PersonEligibility, PersonEligibility_Admin)
+
 class PersonEmail_Admin(admin.ModelAdmin):
     list_display = ('person', 'email',)
 admin.site.register(PersonEmail, PersonEmail_Admin)
@@ -69,10 +73,18 @@ class PersonEvent_Admin(admin.ModelAdmin):
     list_display = ('check_in_time', 'person', 'event',)
 admin.site.register(PersonEvent, PersonEvent_Admin)
 
+class PersonSearchToken_Admin(admin.ModelAdmin):
+    list_display = ('person', 'token', 'weight',)
+admin.site.register(PersonSearchToken, PersonSearchToken_Admin)
+
 class PersonStripe_Admin(admin.ModelAdmin):
     list_display = ('person', 'customer_id',)
 admin.site.register(PersonStripe, PersonStripe_Admin)
 
+class PersonWeekAttendance_Admin(admin.ModelAdmin):
+    list_display = ('week', 'person', 'check_ins',)
+admin.site.register(PersonWeekAttendance, PersonWeekAttendance_Admin)
+
 
 """
 Other
@@ -82,10 +94,18 @@ class CalendarEvent_Admin(admin.ModelAdmin):
     list_display = ('summary', 'start', 'end',)
 admin.site.register(CalendarEvent, CalendarEvent_Admin)
 
+class DailyMembership_Admin(admin.ModelAdmin):
+    list_display = ('date', 'active_members', 'inactive_members',)
+admin.site.register(DailyMembership, DailyMembership_Admin)
+
 class Event_Admin(admin.ModelAdmin):
     list_display = ('summary', 'start', 'end',)
 admin.site.register(Event, Event_Admin)
 
+class EventAttendance_Admin(admin.ModelAdmin):
+    list_display = ('date', 'event', 'check_ins', 'people',)
+admin.site.register(EventAttendance, EventAttendance_Admin)
+
 class Log_Admin(admin.ModelAdmin):
     list_display = ('timestamp', 'logging_level', 'description',)
 admin.site.register(Log, Log_Admin)
@@ -98,6 +118,10 @@ class QRCustom_Admin(admin.ModelAdmin):
     list_display = ('category__is_sensitive', 'category', 'name',)
 admin.site.register(QRCustom, QRCustom_Admin)
 
+class WebhookEvent_Admin(admin.ModelAdmin):
+    list_display = ('received_at', 'source', 'event_type', 'object_id', 'status', 'attempts',)
+admin.site.register(WebhookEvent, WebhookEvent_Admin)
+
 
 """
 Stripe
@@ -0,0 +1,113 @@
+import os
+import threading
+
+from django.core.cache import caches
+
+"""
+API response cache
+
+Refreshes ask the Stripe API for the same customer, price or product again and again. APICache puts
+a read-through cache in front of those calls: each object type has its own time to live, entries live
+in a Django cache backend (so a shared backend such as Redis or Memcached can be configured in CACHES),
+and webhooks invalidate the objects they name so a cached copy is never older than the last change
+Stripe told us about.
+"""
+
+# which Django cache backend holds API responses
+API_CACHE_ALIAS = os.environ.get("API_CACHE_ALIAS", "default")
+
+# seconds a Stripe object can be reused, by object type. 0 turns caching off for that type
+STRIPE_CACHE_SECONDS = int(os.environ.get("STRIPE_CACHE_SECONDS", 300))
+STRIPE_CACHE_TTLS = {
+    'customer': int(os.environ.get("STRIPE_CACHE_CUSTOMER_SECONDS", STRIPE_CACHE_SECONDS)),
+    'subscription': int(os.environ.get("STRIPE_CACHE_SUBSCRIPTION_SECONDS", STRIPE_CACHE_SECONDS)),
+    'subscription_name': int(os.environ.get("STRIPE_CACHE_SUBSCRIPTION_SECONDS", STRIPE_CACHE_SECONDS)),
+    'checkout_session': int(os.environ.get("STRIPE_CACHE_CHECKOUT_SESSION_SECONDS", STRIPE_CACHE_SECONDS)),
+    'payment_link': int(os.environ.get("STRIPE_CACHE_PAYMENT_LINK_SECONDS", STRIPE_CACHE_SECONDS)),
+    # Stripe sends no price or product webhooks we listen for, so these rely on their TTL alone
+    'price': int(os.environ.get("STRIPE_CACHE_PRICE_SECONDS", STRIPE_CACHE_SECONDS * 12)),
+    'product': int(os.environ.get("STRIPE_CACHE_PRODUCT_SECONDS", STRIPE_CACHE_SECONDS * 12)),
+}
+
+# a webhook about one object type also invalidates these derived entries
+STRIPE_CACHE_DEPENDENTS = {
+    'subscription': ('subscription_name',),
+}
+
+MISSING = object()
+
+
+class APICache:
+    """ A read-through cache of API responses keyed by (object type, id), with a TTL per object type """
+    def __init__(self, prefix, ttls, dependents=None, alias=API_CACHE_ALIAS):
+        self.prefix = prefix
+        self.ttls = ttls
+        self.dependents = dependents or {}
+        self.alias = alias
+        self.lock = threading.Lock()
+        self.counters = {}
+        # bumped by clear() so this process stops seeing earlier entries
+        self.version = 1
+
+    def get_backend(self):
+        """ return the Django cache backend holding entries """
+        return caches[self.alias]
+
+    def get_key(self, object_type, object_id):
+        """ return the backend key for an object """
+        return f"api:{ self.prefix }:{ object_type }:{ object_id }"
+
+    def count(self, object_type, counter):
+        """ add one to a hit, miss or invalidation counter """
+        with self.lock:
+            counters = self.counters.setdefault(object_type, {'hits': 0, 'misses': 0, 'invalidations': 0})
+            counters[counter] += 1
+
+    def get(self, object_type, object_id, fetch):
+        """ return a cached object, calling fetch() and caching its result if there is none """
+        ttl = self.ttls.get(object_type, 0)
+        if not ttl:
+            self.count(object_type, 'misses')
+            return fetch()
+
+        key = self.get_key(object_type, object_id)
+        value = self.get_backend().get(key, MISSING, version=self.version)
+        if value is not MISSING:
+            self.count(object_type, 'hits')
+            return value
+
+        self.count(object_type, 'misses')
+        value = fetch()
+        self.get_backend().set(key, value, ttl, version=self.version)
+        return value
+
+    def invalidate(self, object_type, object_id):
+        """ drop an object, and anything derived from it, so the next lookup calls the API """
+        object_types = (object_type,) + tuple(self.dependents.get(object_type, ()))
+        self.get_backend().delete_many([self.get_key(t, object_id) for t in object_types], version=self.version)
+        self.count(object_type, 'invalidations')
+
+    def clear(self):
+        """ forget every entry and reset the counters """
+        with self.lock:
+            self.counters = {}
+            self.version += 1
+
+    def get_stats(self):
+        """ return lookup counts and hit rates by object type """
+        with self.lock:
+            stats = {}
+            for object_type, counters in sorted(self.counters.items()):
+                lookups = counters['hits'] + counters['misses']
+                stats[object_type] = dict(counters, ttl=self.ttls.get(object_type, 0), hit_rate=counters['hits'] / lookups if lookups else None)
+            hits = sum(c['hits'] for c in self.counters.values())
+            lookups = hits + sum(c['misses'] for c in self.counters.values())
+            return {
+                'alias': self.alias,
+                'hits': hits,
+                'misses': lookups - hits,
+                'hit_rate': hits / lookups if lookups else None,
+                'object_types': stats,
+            }
+
+stripe_cache = APICache('stripe', STRIPE_CACHE_TTLS, STRIPE_CACHE_DEPENDENTS)
@@ -0,0 +1,206 @@
+import datetime
+import json
+import os
+import pytz
+import statistics
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from subwaive.models import DocusealField, DocusealFieldStore, DocusealSubmission, DocusealSubmitter, DocusealSubmitterSubmission, DocusealTemplate
+from subwaive.models import Event, NFC, NFCTerminal, QRCategory, QRCustom
+from subwaive.models import Person, PersonDocuseal, PersonEmail, PersonEvent, PersonSearchToken, PersonStripe
+from subwaive.models import StripeCustomer, StripeOneTimePayment, StripePaymentLink, StripePaymentLinkPrice, StripePrice, StripeProduct, StripeSubscription, StripeSubscriptionItem
+from subwaive.models import SyncState
+
+"""
+Benchmarks
+
+Seeds a synthetic dataset and requests each read-only view through the test client, recording query counts,
+wall time and peak Python memory. Views that change data or call Stripe, Docuseal or CalDAV are left out.
+Run it with `manage.py benchmark`, which works in a throwaway test database.
+"""
+
+TIME_ZONE = os.environ.get("TIME_ZONE")
+
+BENCHMARK_BASELINE = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+BENCHMARK_TERMINAL_TOKEN = 'benchmark-terminal'
+
+# rows seeded per unit of scale
+PEOPLE_PER_SCALE = 50
+EVENTS_PER_SCALE = 10
+CHECK_INS_PER_EVENT = 15
+
+def seed(scale=1):
+    """ fill an empty database with a synthetic dataset and return the ids the benchmarked views need """
+    now = datetime.datetime.now().astimezone(pytz.timezone(TIME_ZONE))
+    people_count = PEOPLE_PER_SCALE * scale
+
+    persons = Person.objects.bulk_create([Person(name=f"Person { i }") for i in range(people_count)])
+    emails = PersonEmail.objects.bulk_create([PersonEmail(person=p, email=f"person{ i }@example.com") for i, p in enumerate(persons)])
+    for person, email in zip(persons, emails):
+        person.preferred_email = email
+    Person.objects.bulk_update(persons, ['preferred_email'])
+
+    # Stripe: half the people are customers, half of those hold a membership (a fifth of which lapsed)
+    membership = StripeProduct.objects.create(stripe_id='prod_membership', name="Membership", description="Monthly membership")
+    day_pass = StripeProduct.objects.create(stripe_id='prod_day_pass', name="Day Pass", description="A day in the shop")
+    membership_price = StripePrice.objects.create(stripe_id='price_membership', name="Monthly", interval="month", price=5000, product=membership)
+    day_pass_price = StripePrice.objects.create(stripe_id='price_day_pass', name="Day", interval="one_time", price=1500, product=day_pass)
+    payment_link = StripePaymentLink.objects.create(stripe_id='plink_day_pass', url="https://buy.stripe.com/day-pass", date=now.date())
+    StripePaymentLinkPrice.objects.create(payment_link=payment_link, price=day_pass_price)
+
+    customer_people = persons[::2]
+    customers = StripeCustomer.objects.bulk_create([
+        StripeCustomer(stripe_id=f"cus_{ p.id }", name=p.name, email=f"person{ i*2 }@example.com") for i, p in enumerate(customer_people)])
+    PersonStripe.objects.bulk_create([PersonStripe(person=p, customer=c) for p, c in zip(customer_people, customers)])
+    subscriptions = StripeSubscription.objects.bulk_create([
+        StripeSubscription(stripe_id=f"sub_{ c.id }", customer=c, created=now-datetime.timedelta(days=90), current_period_end=now+datetime.timedelta(days=30),
+            status='past_due' if i % 5 == 0 else 'active', name="Membership")
+        for i, c in enumerate(customers[::2])])
+    StripeSubscriptionItem.objects.bulk_create([StripeSubscriptionItem(stripe_id=f"si_{ s.id }", subscription=s, price=membership_price) for s in subscriptions])
+    StripeOneTimePayment.objects.bulk_create([
+        StripeOneTimePayment(stripe_id=f"cs_{ c.id }", customer=c, date=now.date(), status='complete', payment_link=payment_link) for c in customers[1::2]])
+
+    # Docuseal: three quarters of the people signed a waiver
+    waiver = DocusealTemplate.objects.create(template_id=1, folder_name="Waivers", name="Waiver", slug="waiver")
+    name_field = DocusealField.objects.create(field="Full Name")
+    waiver_people = [p for i, p in enumerate(persons) if i % 4]
+    submitters = DocusealSubmitter.objects.bulk_create([DocusealSubmitter(submitter_id=p.id, email=f"{ p.id }@example.com", slug=f"submitter{ p.id }") for p in waiver_people])
+    submissions = DocusealSubmission.objects.bulk_create([
+        DocusealSubmission(submission_id=p.id, status='completed', slug=f"submission{ p.id }", template=waiver, created_at=now, completed_at=now) for p in waiver_people])
+    DocusealSubmitterSubmission.objects.bulk_create([DocusealSubmitterSubmission(submitter=s, submission=ds) for s, ds in zip(submitters, submissions)])
+    PersonDocuseal.objects.bulk_create([PersonDocuseal(person=p, submitter=s) for p, s in zip(waiver_people, submitters)])
+    DocusealFieldStore.objects.bulk_create([DocusealFieldStore(submission=ds, field=name_field, value=p.name) for p, ds in zip(waiver_people, submissions)])
+
+    # events: past ones spread over the last two months, one happening now and a few upcoming
+    events = Event.objects.bulk_create(
+        [Event(summary=f"Open Shop { i }", description="", start=now-datetime.timedelta(days=i*3+1), end=now-datetime.timedelta(days=i*3+1, hours=-3)) for i in range(EVENTS_PER_SCALE * scale)]
+        + [Event(summary="Open Shop Now", description="", start=now-datetime.timedelta(hours=1), end=now+datetime.timedelta(hours=2))]
+        + [Event(summary=f"Open Shop Next { i }", description="", start=now+datetime.timedelta(days=i+1), end=now+datetime.timedelta(days=i+1, hours=3)) for i in range(5)])
+    check_ins = []
+    for i, event in enumerate(events):
+        if event.start < now:
+            for j in range(CHECK_INS_PER_EVENT):
+                check_ins.append(PersonEvent(person=persons[(i*7 + j) % people_count], event=event))
+    PersonEvent.objects.bulk_create(check_ins)
+
+    NFCTerminal.objects.create(token=BENCHMARK_TERMINAL_TOKEN, location="Front desk")
+    NFC.objects.create(uid="benchmark-nfc", person=persons[2], registration_id="r", activation_id="a", is_active=True)
+
+    category = QRCategory.objects.create(name="Shop", is_sensitive=False)
+    QRCustom.objects.bulk_create([QRCustom(category=category, name=f"Link { i }", content=f"https://example.com/{ i }") for i in range(10)])
+
+    # the refresh pages show when each object type was last refreshed
+    SyncState.objects.bulk_create([
+        SyncState(source=source, object_type=object_type, last_run_at=now, duration=1.5, inserted=1)
+        for source, object_types in [('calendar', ['CalendarEvent']),
+                                     ('docuseal', ['DocusealTemplate', 'DocusealSubmitter', 'DocusealSubmission', 'DocusealFieldStore']),
+                                     ('stripe', ['StripeProduct', 'StripePrice', 'StripePaymentLink', 'StripePaymentLinkPrice', 'StripeCustomer', 'StripeSubscription', 'StripeOneTimePayment'])]
+        for object_type in object_types])
+
+    PersonSearchToken.rebuild_all()
+    PersonEvent.rebuild_rollups()
+
+    return {
+        'person_id': persons[2].id,
+        'event_id': events[-6].id,
+        'user': User.objects.create_superuser("benchmark"),
+    }
+
+def get_requests(ids):
+    """ return (name, method, url, data, headers) for each benchmarked view """
+    person_id = ids['person_id']
+    return [
+        ('person_list', 'get', reverse('person_list'), None, {}),
+        ('member_list', 'get', reverse('member_list'), None, {}),
+        ('member_email_list', 'get', reverse('member_email_list'), None, {}),
+        ('person_search', 'post', reverse('person_search'), {'search_term': "person"}, {}),
+        ('person_card', 'get', reverse('person_card', args=[person_id]), None, {}),
+        ('person_docuseal', 'get', reverse('person_docuseal', args=[person_id]), None, {}),
+        ('person_stripe', 'get', reverse('person_stripe', args=[person_id]), None, {}),
+        ('person_edit', 'get', reverse('person_edit', args=[person_id]), None, {}),
+        ('merge_people', 'get', reverse('merge_people', args=[person_id]), None, {}),
+        ('duplicate_people', 'get', reverse('duplicate_people'), None, {}),
+        ('event_list', 'get', reverse('event_list'), None, {}),
+        ('event_list_future', 'get', reverse('event_list', args=['future']), None, {}),
+        ('event_details', 'get', reverse('event_details', args=[ids['event_id']]), None, {}),
+        ('event_refresh', 'get', reverse('event_refresh'), None, {}),
+        ('recent_member_activity', 'get', reverse('recent_member_activity', args=[60]), None, {}),
+        ('attendance_by_event', 'get', reverse('attendance_by_event', args=[365]), None, {}),
+        ('attendance_by_week', 'get', reverse('attendance_by_week', args=[365]), None, {}),
+        ('membership_by_day', 'get', reverse('membership_by_day', args=[365]), None, {}),
+        ('nfc_self_serve', 'post', reverse('nfc_self_serve'), {'uid': "benchmark-nfc"}, {'HTTP_X_SELF_SERVE_TOKEN': BENCHMARK_TERMINAL_TOKEN}),
+        ('public_link_list', 'get', reverse('public_link_list'), None, {}),
+        ('docuseal_link_list', 'get', reverse('docuseal_link_list'), None, {}),
+        ('docuseal_refresh', 'get', reverse('docuseal_refresh'), None, {}),
+        ('payment_link_list', 'get', reverse('payment_link_list'), None, {}),
+        ('stripe_refresh', 'get', reverse('stripe_refresh'), None, {}),
+    ]
+
+def measure(client, method, url, data, headers, repeat):
+    """ request a URL once to warm caches, then repeat times, returning its status, queries, median seconds and peak KiB """
+    getattr(client, method)(url, data, **headers)
+
+    timings = []
+    peak = 0
+    for i in range(repeat):
+        tracemalloc.start()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(client, method)(url, data, **headers)
+            timings.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {
+        'status': response.status_code,
+        'queries': len(queries),
+        'seconds': round(statistics.median(timings), 4),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+def run(scale=1, repeat=3):
+    """ seed the current database and benchmark every view """
+    ids = seed(scale)
+    client = Client()
+    client.force_login(ids['user'])
+
+    return {name: measure(client, method, url, data, headers, repeat) for (name, method, url, data, headers) in get_requests(ids)}
+
+def compare(results, baseline, time_tolerance=1.0, memory_tolerance=0.5):
+    """ return a description of each way results are worse than baseline.
+    Any extra query is a regression; time and memory may grow by their tolerance (a fraction of the baseline) """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if result['status'] != base['status']:
+            regressions.append(f"{ name }: status { base['status'] } -> { result['status'] }")
+        if result['queries'] > base['queries']:
+            regressions.append(f"{ name }: queries { base['queries'] } -> { result['queries'] }")
+        # ignore a few milliseconds of noise on fast views
+        if result['seconds'] > base['seconds'] * (1 + time_tolerance) + 0.005:
+            regressions.append(f"{ name }: seconds { base['seconds'] } -> { result['seconds'] }")
+        if result['peak_kib'] > base['peak_kib'] * (1 + memory_tolerance) + 64:
+            regressions.append(f"{ name }: peak KiB { base['peak_kib'] } -> { result['peak_kib'] }")
+    return regressions
+
+def load_baseline(path=BENCHMARK_BASELINE):
+    """ return the stored baseline, keyed by scale """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_baseline(baseline, path=BENCHMARK_BASELINE):
+    """ store a baseline """
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write("\n")
@@ -21,6 +21,7 @@ docuseal.key = DOCUSEAL_API_KEY
 
 from subwaive.models import DocusealFieldStore, DocusealSubmission, DocusealSubmitter, DocusealTemplate
 from subwaive.models import Log
+from subwaive.models import WebhookEvent
 from subwaive.utils import generate_qr_svg, refresh, CONFIDENTIALITY_LEVEL_PUBLIC, QR_SMALL, QR_LARGE
 
 DOCUSEAL_API_ENDPOINT = os.environ.get("DOCUSEAL_API_ENDPOINT")
@@ -90,32 +91,16 @@ def receive_webhook(request):
                 if payload['event_type'] == 'form.completed':
                     # an individual has completed their portion of a form
                     # print(payload)
-                    template_id = payload['data']['template']['id']
-                    if not DocusealTemplate.objects.filter(template_id=template_id).exists():
-                        DocusealTemplate.create_or_update_by_id(template_id)
-
                     # email we take on faith, since having an email in the system gets you nothing
-                    email = payload['data']['email']
-                    DocusealSubmitter.create_if_needed(email)
-
+                    # the worker (manage.py process_webhooks) creates the template and submitter if needed
                     submission_id = payload['data']['submission_id']
-                    DocusealSubmission.create_or_update(submission_id)
-                    DocusealFieldStore.re_extract(submission_id)
+                    WebhookEvent.enqueue('docuseal', payload['event_type'], 'submission', submission_id, payload['data'])
 
                 elif payload['event_type'] == 'submission.created':
                     # a form has email addresses added for signatures
                     # print(payload)
-                    template_id = payload['data']['template']['id']
-                    if not DocusealTemplate.objects.filter(template_id=template_id).exists():
-                        DocusealTemplate.create_or_update_by_id(template_id)
-
-                    for submitter in payload['data']['submitters']:
-                        email = submitter['email']
-                        DocusealSubmitter.create_if_needed(email)
-
                     submission_id = payload['data']['id']
-                    DocusealSubmission.create_or_update(submission_id)
-                    DocusealFieldStore.re_extract(submission_id)
+                    WebhookEvent.enqueue('docuseal', payload['event_type'], 'submission', submission_id, payload['data'])
 
                 elif payload['event_type'] == 'form.declined':
                     # an individual has declined to sign a form?
@@ -125,13 +110,12 @@ def receive_webhook(request):
                 elif payload['event_type'] in ['template.created','template.updated']:
                     # a new form is created or an existing one is altered
                     template_id = payload['data']['id']
-                    DocusealTemplate.create_or_update_by_id(template_id)
+                    WebhookEvent.enqueue('docuseal', payload['event_type'], 'template', template_id, payload['data'])
 
                 elif payload['event_type'] == 'submission.archived':
                     # a submitted form is archived
                     submission_id = payload['data']['id']
-                    DocusealSubmission.create_or_update(submission_id)
-                    DocusealFieldStore.re_extract(submission_id)
+                    WebhookEvent.enqueue('docuseal', payload['event_type'], 'submission', submission_id, payload['data'])
 
                 elif payload['event_type'] == 'submission.completed':
                     # this might be the better webhook than form.completed, since this relies on all signature being done
@@ -142,7 +126,7 @@ def receive_webhook(request):
                     print("unhandled webhook event_type")
                     Log.new(logging_level=logging.WARN, description="Unhandled Docuseal webhook", json=payload, other_info=payload['event_type'])
 
-                Log.new(logging_level=logging.DEBUG, description="Docuseal webhook handling complete", json=payload, other_info=payload['event_type'])
+                Log.new(logging_level=logging.DEBUG, description="Docuseal webhook queued", json=payload, other_info=payload['event_type'])
                 return HttpResponse(status=200)
            
             except json.JSONDecodeError as e:
@@ -222,13 +206,8 @@ def refresh_all(new_only=False):
     """ refresh data sets in order """
     DocusealTemplate.refresh(new_only)
     DocusealSubmitter.refresh(new_only)
-
-    max_existing_submission_id = None
-    if new_only:
-        max_existing_submission_id = DocusealSubmission.objects.all().order_by('-submission_id').first().submission_id
-    
     DocusealSubmission.refresh(new_only)
-    DocusealFieldStore.refresh(max_existing_submission_id)
+    DocusealFieldStore.refresh(new_only)
 
 def send_waiver(email):
     """ send a waiver to an email address through Docuseal """
@@ -0,0 +1,130 @@
+from subwaive.models import DocusealFieldStore, Person, PersonEmail, PersonSearchToken
+
+"""
+Duplicate detection
+
+Docuseal and Stripe create a new Person whenever no stored email matches exactly, so the same member
+often ends up as several people. find_duplicates() reads every person, email and Docuseal name field once,
+gives each person a set of keys (normalized emails, and a name key from their name and the names they
+typed into Docuseal) and joins people who share a key into clusters. Each cluster becomes a merge plan
+that keeps one person and merges the rest into them with Person.merge_many(). Clusters joined by an
+email are safe to merge; clusters joined only by a name are listed for someone to review, since two
+members (or a parent and the minor they signed for) can share one.
+Run it with `manage.py find_duplicates` or from the duplicates page.
+"""
+
+# Docuseal fields holding someone else's name, such as an emergency contact or a minor signed for, are not name keys
+DOCUSEAL_NAME_FIELD_EXCLUDE = ['email', 'emergency', 'contact', 'parent', 'guardian', 'minor', 'participant', 'child']
+
+# mail providers that ignore dots in the local part
+DOTLESS_EMAIL_DOMAINS = {'gmail.com': 'gmail.com', 'googlemail.com': 'gmail.com'}
+
+def normalize_email(email):
+    """ lowercase an email and drop +tags (and dots, for providers that ignore them) from the local part """
+    local, _, domain = (email or '').strip().lower().rpartition('@')
+    if not local or not domain:
+        return None
+    local = local.split('+')[0]
+    if domain in DOTLESS_EMAIL_DOMAINS:
+        local = local.replace('.', '')
+        domain = DOTLESS_EMAIL_DOMAINS[domain]
+    return f"{ local }@{ domain }"
+
+def get_name_key(name):
+    """ return the first and last words of a name, normalized, or None for single words and email addresses """
+    if not name or '@' in name:
+        return None
+    tokens = PersonSearchToken.tokenize(name)
+    if len(tokens) < 2:
+        return None
+    return f"{ tokens[0] } { tokens[-1] }"
+
+def is_email_like(name):
+    """ return true for the placeholder names people are created with, which are email addresses """
+    return '@' in (name or '')
+
+def get_keys(use_names=True):
+    """ return a dict of keys (('email', ...), ('name', ...)) to the ids of the people holding them """
+    keys = {}
+    def add(key, person_id):
+        if key[1]:
+            keys.setdefault(key, set()).add(person_id)
+
+    for person_id, email in PersonEmail.objects.values_list('person_id', 'email'):
+        add(('email', normalize_email(email)), person_id)
+
+    if use_names:
+        for person_id, name in Person.objects.values_list('id', 'name'):
+            add(('name', get_name_key(name)), person_id)
+        fields = DocusealFieldStore.objects.filter(field__field__icontains='name')
+        for word in DOCUSEAL_NAME_FIELD_EXCLUDE:
+            fields = fields.exclude(field__field__icontains=word)
+        for person_id, value in fields.values_list('submission__docusealsubmittersubmission__submitter__persondocuseal__person', 'value'):
+            if person_id:
+                add(('name', get_name_key(value)), person_id)
+
+    return keys
+
+def join(groups):
+    """ union-find over ids: return a dict of every id in the groups to the root of the cluster joining it
+    to each group it shares """
+    parents = {}
+    def find(person_id):
+        root = person_id
+        while parents.get(root, root) != root:
+            root = parents[root]
+        while person_id != root:
+            parents[person_id], person_id = root, parents[person_id]
+        return root
+
+    groups = [set(group) for group in groups]
+    for group in groups:
+        roots = sorted(set(find(person_id) for person_id in group))
+        for root in roots[1:]:
+            parents[root] = roots[0]
+    return {person_id: find(person_id) for group in groups for person_id in group}
+
+def get_plans(kind, roots, reasons, persons):
+    """ return a merge plan for each cluster of roots with more than one person in it """
+    clusters = {}
+    for person_id, root in roots.items():
+        if person_id in persons:
+            clusters.setdefault(root, []).append(persons[person_id])
+    plans = []
+    for root, members in clusters.items():
+        # keep the oldest person with a real name, since the others were named after an email address
+        members.sort(key=lambda p: (is_email_like(p.name), p.id))
+        if len(members) > 1:
+            plans.append({'id': f"{ kind }-{ members[0].id }", 'kind': kind, 'keep': members[0], 'merge': members[1:], 'reasons': reasons.get(root, [])})
+    return plans
+
+def find_duplicates(use_names=True):
+    """ return merge plans for the people who share a key:
+    {'id': ..., 'kind': 'email' or 'name', 'keep': person, 'merge': [people], 'reasons': ['email ...']}.
+    People sharing a normalized email are one 'email' plan. A 'name' plan joins whoever those plans keep
+    (and anyone else) by a name key alone; distinct people share names, so these need a review before merging """
+    shared = {key: person_ids for key, person_ids in get_keys(use_names).items() if len(person_ids) > 1}
+    persons = Person.objects.in_bulk(set(person_id for person_ids in shared.values() for person_id in person_ids))
+
+    email_keys = {value: person_ids for (kind, value), person_ids in sorted(shared.items()) if kind == 'email'}
+    email_roots = join(email_keys.values())
+    reasons = {}
+    for value, person_ids in email_keys.items():
+        reasons.setdefault(email_roots[next(iter(person_ids))], []).append(f"email { value }")
+    plans = get_plans('email', email_roots, reasons, persons)
+
+    # a name key joins the people each email plan keeps rather than everyone in it
+    kept = {person.id: plan['keep'].id for plan in plans for person in plan['merge']}
+    name_keys = {value: set(kept.get(person_id, person_id) for person_id in person_ids) for (kind, value), person_ids in sorted(shared.items()) if kind == 'name'}
+    name_keys = {value: person_ids for value, person_ids in name_keys.items() if len(person_ids) > 1}
+    name_roots = join(name_keys.values())
+    reasons = {}
+    for value, person_ids in name_keys.items():
+        reasons.setdefault(name_roots[next(iter(person_ids))], []).append(f"name { value }")
+    plans.extend(get_plans('name', name_roots, reasons, persons))
+
+    return sorted(plans, key=lambda plan: (plan['keep'].name.lower(), plan['keep'].id, plan['kind']))
+
+def apply_plans(plans):
+    """ merge every plan in one batch and return the resolved merges """
+    return Person.merge_many({person.id: plan['keep'].id for plan in plans for person in plan['merge']})
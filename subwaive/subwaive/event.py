@@ -12,8 +12,7 @@ from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 
 from subwaive.models import CalendarEvent, Event
-from subwaive.models import Person, PersonEvent, PersonStripe
-from subwaive.models import StripeOneTimePayment
+from subwaive.models import Person, PersonEligibility, PersonEvent
 from subwaive.utils import refresh, CONFIDENTIALITY_LEVEL_PUBLIC, CONFIDENTIALITY_LEVEL_CONFIDENTIAL
 
 TIME_ZONE = os.environ.get("TIME_ZONE")
@@ -23,6 +22,7 @@ CALENDAR_WWW_ENDPOINT = os.environ.get("CALENDAR_WWW_ENDPOINT")
 DATA_REFRESH_TOKEN = os.environ.get("DATA_REFRESH_TOKEN")
 
 PAGINATOR_SHORT = 8
+EVENT_CANDIDATE_LIMIT = 200
 
 @login_required
 def member_check_in(request, person_id, event_id, override_checks=False, redirect_name='event_details'):
@@ -86,6 +86,8 @@ def delete_member_check_in(request, person_id, event_id):
     messages.success(request, f"Check-in for { check_in.person } to {check_in.event } removed")
 
     check_in.delete()
+    PersonEligibility.rebuild(check_in.person)
+    PersonEvent.update_rollups([person_id], [event_id])
 
     return redirect('event_details', event_id)
 
@@ -117,7 +119,7 @@ def event_refresh_page(request):
                     },
                 ], 'anchor': 'Refresh Upcoming'},
             ],
-            'log_descriptions': [{'description': 'Event'}],
+            'log_descriptions': [{'description': 'CalendarEvent'}],
         },
     ]
 
@@ -180,47 +182,53 @@ def event_details(request, event_id):
 
     if request.POST:
         person = Person.objects.get(id=request.POST.get("person_id"))
-        PersonEvent.objects.create(event=event, person=person)
+        person.check_in(event.id)
         return redirect('event_details', event_id)
 
-    persons = [p.person for p in PersonEvent.objects.filter(event=event).order_by('person__name')]
+    persons = list(Person.objects.filter(personevent__event=event)
+        .with_membership_status()
+        .with_waiver_status()
+        .select_related('preferred_email')
+        .order_by('name')
+        .distinct())
+    person_ids = [p.id for p in persons]
 
     check_in_issues = []
     for p in persons:
         issues = {}
-        membership_status = p.check_membership_status()
-        if not membership_status:
+        if not p.membership_status:
             issues['membership'] = 'missing'
-        elif membership_status!='active':
+        elif p.membership_status!='active':
             issues['membership'] = 'inactive'
-        if not p.check_waiver_status():
+        if not p.has_waiver:
             issues['waiver'] = True
         if issues.keys():
             issues['person'] = p
             check_in_issues.append(issues)
 
-    possible_check_ins = Person.objects.exclude(id__in=[p.id for p in persons])
-
-    # print(f"event.start.date(): {event.start.date()}")
-    for otp in StripeOneTimePayment.objects.all():
-        print (otp.date)
-    payees = [otp.customer for otp in StripeOneTimePayment.objects.filter(date=event.start.date())]
-    # print(f"payees: {payees}")
-    customers = PersonStripe.objects.filter(customer__in=payees).exclude(person__id__in=[p.id for p in persons])
-    # print(f"customers: {customers}")
-    event_customers = []
-    for customer in customers:
-        event_customers.append(
-            {
-                'is_attending': bool(customer in persons),
-                'person': customer.person
-            }
-        )
+    # the add form lists at most EVENT_CANDIDATE_LIMIT people, narrowed by a search term on busy nights
+    candidate_term = request.GET.get('candidate', '')
+    if candidate_term:
+        candidates = Person.search(candidate_term)
+    else:
+        candidates = Person.objects.order_by('name')
+    candidates = candidates.exclude(id__in=person_ids).values('id', 'name')
+    possible_check_ins = list(candidates[:EVENT_CANDIDATE_LIMIT + 1])
+    is_candidate_list_truncated = len(possible_check_ins) > EVENT_CANDIDATE_LIMIT
+    possible_check_ins = possible_check_ins[:EVENT_CANDIDATE_LIMIT]
+
+    payees = (Person.objects.filter(personstripe__customer__stripeonetimepayment__date=event.start.date())
+        .exclude(id__in=person_ids)
+        .order_by('name')
+        .distinct())
+    event_customers = [{'is_attending': False, 'person': p} for p in payees]
 
     context = {
         'event': event,
         'persons': persons,
         'possible_check_ins': possible_check_ins,
+        'candidate_term': candidate_term,
+        'is_candidate_list_truncated': is_candidate_list_truncated,
         'check_in_issues': check_in_issues,
         'event_customers': event_customers,
         'CONFIDENTIALITY_LEVEL': CONFIDENTIALITY_LEVEL_CONFIDENTIAL,
@@ -0,0 +1,48 @@
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Concurrent API fetching
+
+API clients block on one round trip at a time, so refreshes that need a detail call per record
+are bound by latency. fetch_all spreads those calls over a bounded pool of threads. Only the API
+calls run on the pool; callers should keep database writes on their own thread.
+"""
+
+class RateLimiter:
+    """ Space out calls shared by several threads to at most rate calls per second """
+    def __init__(self, rate=None):
+        self.interval = 1.0/rate if rate else 0
+        self.next_call = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """ block until the next call is allowed """
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def fetch_all(fetch, keys, concurrency=4, rate=None):
+    """ call fetch(key) for each unique key on a pool of at most concurrency threads, limited to
+    rate calls per second, and return a dict of results by key. The first exception raised by
+    fetch is re-raised here. """
+    keys = list(dict.fromkeys(keys))
+    limiter = RateLimiter(rate)
+
+    def limited_fetch(key):
+        limiter.wait()
+        return fetch(key)
+
+    if not keys:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(keys)))) as executor:
+        return dict(zip(keys, executor.map(limited_fetch, keys)))
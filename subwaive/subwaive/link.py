@@ -1,8 +1,9 @@
 from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
 from django.shortcuts import render
 
 from subwaive.models import QRCustom
-from subwaive.utils import generate_qr_svg, CONFIDENTIALITY_LEVEL_PUBLIC, CONFIDENTIALITY_LEVEL_SENSITIVE, QR_SMALL, QR_LARGE
+from subwaive.utils import generate_qr_svg, qr_cache, CONFIDENTIALITY_LEVEL_PUBLIC, CONFIDENTIALITY_LEVEL_SENSITIVE, QR_SMALL, QR_LARGE
 
 
 @login_required
@@ -52,3 +53,8 @@ def custom_link_list(request, is_sensitive=False):
     }
 
     return render(request, f'subwaive/qr-links.html', context)
+
+@login_required
+def qr_cache_stats(request):
+    """ Report QR code render counts and cache hit rates """
+    return JsonResponse(qr_cache.get_stats())
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from subwaive import benchmark
+
+class Command(BaseCommand):
+	help = "Benchmark query counts, time and memory for each view against a synthetic dataset, and compare them to a stored baseline"
+
+	def add_arguments(self, parser):
+		parser.add_argument('--scale', type=int, default=1, help="Multiply the size of the synthetic dataset")
+		parser.add_argument('--repeat', type=int, default=3, help="How many timed requests to make per view")
+		parser.add_argument('--baseline', default=benchmark.BENCHMARK_BASELINE, help="Path to the JSON baseline")
+		parser.add_argument('--update', action='store_true', help="Store these results as the baseline for this scale")
+		parser.add_argument('--time-tolerance', type=float, default=1.0, help="Allowed fractional slowdown before a view counts as regressed")
+		parser.add_argument('--memory-tolerance', type=float, default=0.5, help="Allowed fractional growth in peak memory before a view counts as regressed")
+
+	def handle(self, *args, **options):
+		# never seed the real database
+		setup_test_environment()
+		old_name = connection.settings_dict['NAME']
+		connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+		try:
+			results = benchmark.run(options['scale'], options['repeat'])
+		finally:
+			connection.creation.destroy_test_db(old_name, verbosity=0)
+			teardown_test_environment()
+
+		print(f"{'view':<24} {'status':>6} {'queries':>8} {'seconds':>8} {'peak KiB':>9}")
+		for name, result in results.items():
+			print(f"{name:<24} {result['status']:>6} {result['queries']:>8} {result['seconds']:>8} {result['peak_kib']:>9}")
+
+		baseline = benchmark.load_baseline(options['baseline'])
+		scale = str(options['scale'])
+		if options['update']:
+			baseline[scale] = results
+			benchmark.save_baseline(baseline, options['baseline'])
+			print(f"Saved baseline for scale {scale} to {options['baseline']}")
+		elif scale in baseline:
+			regressions = benchmark.compare(results, baseline[scale], options['time_tolerance'], options['memory_tolerance'])
+			if regressions:
+				raise CommandError("Benchmark regressions:\n" + "\n".join(regressions))
+			print(f"No regressions against the scale {scale} baseline")
+		else:
+			print(f"No baseline for scale {scale}; run with --update to store one")
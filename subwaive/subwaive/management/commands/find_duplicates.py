@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from subwaive import duplicates
+
+class Command(BaseCommand):
+	help = "Find people who are likely the same person by email, name and Docuseal name fields, and optionally merge those who share an email"
+
+	def add_arguments(self, parser):
+		parser.add_argument('--email-only', action='store_true', help="Only join people who share a normalized email address")
+		parser.add_argument('--apply', action='store_true', help="Merge every cluster joined by an email into the person it keeps. Clusters joined only by a name are left for review on the duplicates page")
+
+	def handle(self, *args, **options):
+		plans = duplicates.find_duplicates(use_names=not options['email_only'])
+		for plan in plans:
+			merged = ', '.join(f"{person.name} ({person.id})" for person in plan['merge'])
+			review = "  (review)" if plan['kind'] != 'email' else ""
+			print(f"{plan['keep'].name} ({plan['keep'].id}) <- {merged}  [{'; '.join(plan['reasons'])}]{review}")
+
+		email_plans = [plan for plan in plans if plan['kind'] == 'email']
+		if options['apply']:
+			merges = duplicates.apply_plans(email_plans)
+			print(f"Merged {len(merges)} people into {len(set(merges.values()))}; {len(plans) - len(email_plans)} clusters matched only by name are left for review")
+		else:
+			print(f"Found {len(plans)} clusters covering {sum(len(plan['merge']) + 1 for plan in plans)} people; run with --apply to merge the {len(email_plans)} joined by an email")
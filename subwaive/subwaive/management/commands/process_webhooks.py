@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+import time
+
+from subwaive.models import Log, WebhookEvent
+
+class Command(BaseCommand):
+	help = "Handle queued Stripe and Docuseal webhooks, refreshing each object once per batch"
+
+	def add_arguments(self, parser):
+		parser.add_argument('--once', action='store_true', help="Drain the queue and exit instead of polling")
+		parser.add_argument('--interval', type=float, default=5, help="Seconds to wait between polls when the queue is empty")
+
+	def handle(self, *args, **options):
+		while True:
+			with Log.buffered():
+				refreshed = WebhookEvent.process_pending()
+			if options['once'] and not refreshed:
+				break
+			if not refreshed:
+				time.sleep(options['interval'])
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from subwaive.models import PersonSearchToken
+
+class Command(BaseCommand):
+	help = "Rebuild the person search index from names, emails and Docuseal field values"
+
+	def handle(self, *args, **options):
+		PersonSearchToken.rebuild_all()
+		print(f"Indexed {PersonSearchToken.objects.count()} search tokens")
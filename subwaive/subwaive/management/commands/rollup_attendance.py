@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from subwaive.models import EventAttendance, PersonEvent, PersonWeekAttendance
+
+class Command(BaseCommand):
+	help = "Rebuild the attendance rollups from every check-in and record today's membership counts"
+
+	def handle(self, *args, **options):
+		daily_membership = PersonEvent.rebuild_rollups()
+		print(f"Rolled up {EventAttendance.objects.count()} events and {PersonWeekAttendance.objects.count()} person-weeks, {daily_membership.active_members} active members today")
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import json
+
+from subwaive import sync
+
+class Command(BaseCommand):
+	help = "Refresh the calendar, Docuseal and Stripe in parallel worker processes, following the dependencies between object types"
+
+	def add_arguments(self, parser):
+		parser.add_argument('--only', nargs='+', help=f"Limit the sync to these tasks or sources: {', '.join(sync.TASKS)}")
+		parser.add_argument('--new-only', action='store_true', help="Only fetch objects created since the last sync")
+		parser.add_argument('--workers', type=int, default=sync.SYNC_WORKERS, help="How many tasks may run at once; 0 runs them one after the other in this process")
+		parser.add_argument('--timeout', type=int, default=sync.SYNC_TIMEOUT, help="Seconds a task may run before it is stopped")
+		parser.add_argument('--task-timeout', action='append', default=[], metavar='NAME=SECONDS', help="Override the timeout for a task or a source, e.g. stripe=600")
+		parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+
+	def handle(self, *args, **options):
+		timeouts = {}
+		for task_timeout in options['task_timeout']:
+			name, _, seconds = task_timeout.partition('=')
+			if not seconds.isdigit():
+				raise CommandError(f"--task-timeout expects NAME=SECONDS, not {task_timeout}")
+			timeouts[name] = int(seconds)
+
+		try:
+			summary = sync.run(only=options['only'], new_only=options['new_only'], workers=options['workers'], timeouts=timeouts, default_timeout=options['timeout'])
+		except ValueError as e:
+			raise CommandError(e)
+
+		if options['json']:
+			print(json.dumps(summary, indent=2))
+		else:
+			print(f"{'task':<26} {'status':<8} {'seconds':>8} {'rows':>8}  counts")
+			for result in summary:
+				counts = ', '.join(f"{key} {value}" for key, value in (result['counts'] or {}).items() if key != 'type')
+				print(f"{result['task']:<26} {result['status']:<8} {result['seconds'] if result['seconds'] is not None else '-':>8} {result['rows'] if result['rows'] is not None else '-':>8}  {counts or result['error'] or ''}")
+
+		failed = [result['task'] for result in summary if result['status'] != sync.STATUS_OK]
+		if failed:
+			raise CommandError(f"Sync tasks did not finish: {', '.join(failed)}")
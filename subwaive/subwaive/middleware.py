@@ -0,0 +1,91 @@
+import logging
+import re
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from subwaive.models import Log
+
+
+class LogBufferMiddleware:
+    """ Write the log entries made while handling a request in one batch """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with Log.buffered():
+            return self.get_response(request)
+
+
+class SQLProfileMiddleware:
+    """ Capture the SQL run while handling a request, group it by template and flag templates repeated
+    at least SQL_PROFILE_THRESHOLD times (usually a query inside a loop). SQL_PROFILE lists where the
+    summary goes: 'log', 'header' (X-SQL-Profile) or both, comma separated. Left empty, the middleware is off. """
+    HEADER = 'X-SQL-Profile'
+    WORST_TEMPLATES = 5
+    TEMPLATE_LENGTH = 200
+
+    def __init__(self, get_response):
+        self.outputs = {o.strip() for o in getattr(settings, 'SQL_PROFILE', '').split(',') if o.strip()}
+        if not self.outputs:
+            raise MiddlewareNotUsed()
+        self.threshold = getattr(settings, 'SQL_PROFILE_THRESHOLD', 5)
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries.append((sql, time.perf_counter() - start))
+
+        with connection.execute_wrapper(record):
+            response = self.get_response(request)
+
+        summary = SQLProfileMiddleware.summarize(queries, self.threshold)
+        if 'header' in self.outputs:
+            response[self.HEADER] = f"queries={ summary['count'] }; db_ms={ summary['ms'] }; repeated={ len(summary['repeated']) }"
+        if 'log' in self.outputs:
+            Log.new(
+                logging_level=logging.WARNING if summary['repeated'] else logging.DEBUG,
+                description=f"SQL profile { request.method } { request.path }",
+                json=summary,
+                other_info=f"{ summary['count'] } queries in { summary['ms'] } ms, { len(summary['repeated']) } repeated templates",
+            )
+
+        return response
+
+    def normalize(sql):
+        """ reduce a statement to a template by replacing literals and collapsing IN lists and whitespace """
+        sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+        sql = re.sub(r'\b\d+(\.\d+)?\b', '?', sql)
+        sql = re.sub(r'%s', '?', sql)
+        sql = re.sub(r'\bIN \((?:\?, )*\?\)', 'IN (...)', sql, flags=re.IGNORECASE)
+        return re.sub(r'\s+', ' ', sql).strip()
+
+    def summarize(queries, threshold):
+        """ return the query count, total time and the worst repeated templates for a list of (sql, seconds) """
+        templates = {}
+        for sql, seconds in queries:
+            template = templates.setdefault(SQLProfileMiddleware.normalize(sql), {'count': 0, 'seconds': 0})
+            template['count'] += 1
+            template['seconds'] += seconds
+
+        repeated = sorted(
+            ((sql, t) for sql, t in templates.items() if t['count'] >= threshold),
+            key=lambda item: (item[1]['count'], item[1]['seconds']), reverse=True,
+        )
+        return {
+            'count': len(queries),
+            'ms': round(sum(seconds for sql, seconds in queries) * 1000, 1),
+            'templates': len(templates),
+            'repeated': [
+                {'sql': sql[:SQLProfileMiddleware.TEMPLATE_LENGTH], 'count': t['count'], 'ms': round(t['seconds'] * 1000, 1)}
+                for sql, t in repeated[:SQLProfileMiddleware.WORST_TEMPLATES]
+            ],
+        }
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-17 22:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subwaive', '0031_person_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersonEligibility',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('has_waiver', models.BooleanField(default=False, help_text='Has this person signed a waiver?')),
+                ('membership_status', models.CharField(blank=True, help_text="What is the status of this person's membership?", max_length=64, null=True)),
+                ('is_staff', models.BooleanField(default=False, help_text='Is this person a staff user?')),
+                ('event_dates', models.JSONField(blank=True, default=list, help_text='What event dates has this person purchased?')),
+                ('last_check_in_date', models.DateField(blank=True, help_text='What day did this person last check-in?', null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, help_text='When was this snapshot last rebuilt?')),
+                ('person', models.OneToOneField(help_text='Who is this snapshot for?', on_delete=django.db.models.deletion.CASCADE, related_name='eligibility', to='subwaive.person')),
+            ],
+            options={
+                'ordering': ('person',),
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-17 22:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subwaive', '0032_personeligibility'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(help_text='What external system is synced? (ex. stripe)', max_length=32)),
+                ('object_type', models.CharField(help_text='What kind of object is synced? (ex. StripeCustomer)', max_length=64)),
+                ('cursor', models.CharField(blank=True, help_text='Where should the next incremental sync resume from?', max_length=128, null=True)),
+                ('last_run_at', models.DateTimeField(blank=True, help_text='When did the last sync finish?', null=True)),
+                ('inserted', models.PositiveIntegerField(default=0, help_text='How many rows did the last sync insert?')),
+                ('updated', models.PositiveIntegerField(default=0, help_text='How many rows did the last sync update?')),
+                ('removed', models.PositiveIntegerField(default=0, help_text='How many rows did the last sync remove?')),
+            ],
+            options={
+                'ordering': ('source', 'object_type'),
+                'constraints': [models.UniqueConstraint(fields=('source', 'object_type'), name='unique_sync_state')],
+            },
+        ),
+    ]
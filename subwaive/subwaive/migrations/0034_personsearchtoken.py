@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-17 22:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subwaive', '0033_syncstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersonSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(db_index=True, help_text='What is the lowercase, accent-free word?', max_length=255)),
+                ('weight', models.IntegerField(help_text='How strongly does a match on this token rank the person?')),
+                ('person', models.ForeignKey(help_text='Who does this token belong to?', on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='subwaive.person')),
+            ],
+            options={
+                'ordering': ('person', 'token'),
+                'constraints': [models.UniqueConstraint(fields=('person', 'token'), name='unique_person_search_token')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-17 22:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subwaive', '0034_personsearchtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(help_text='What system sent the webhook? (ex. stripe)', max_length=32)),
+                ('event_type', models.CharField(help_text='What kind of event was it? (ex. invoice.paid)', max_length=64)),
+                ('object_type', models.CharField(help_text='What kind of object needs refreshing? (ex. subscription)', max_length=64)),
+                ('object_id', models.CharField(help_text='What is the id of the object that needs refreshing?', max_length=128)),
+                ('payload', models.JSONField(blank=True, help_text='What object did the webhook carry?', null=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='pending', help_text='Has the event been handled?', max_length=16)),
+                ('attempts', models.PositiveIntegerField(default=0, help_text='How many times has a worker tried to handle the event?')),
+                ('error', models.TextField(blank=True, help_text='What went wrong the last time the event was handled?', null=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True, help_text='When did the webhook arrive?')),
+                ('processed_at', models.DateTimeField(blank=True, help_text='When was the event handled?', null=True)),
+            ],
+            options={
+                'ordering': ('received_at',),
+                'indexes': [models.Index(fields=['status', 'received_at'], name='webhook_event_status')],
+            },
+        ),
+    ]
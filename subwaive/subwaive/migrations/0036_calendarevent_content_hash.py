@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 22:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subwaive', '0035_webhookevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calendarevent',
+            name='content_hash',
+            field=models.CharField(blank=True, help_text='What was the hash of the summary, description, start and end when last synced?', max_length=64, null=True),
+        ),
+    ]
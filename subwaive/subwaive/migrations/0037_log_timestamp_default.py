@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-17 22:56
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subwaive', '0036_calendarevent_content_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='log',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='When was the event logged?'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.1.7 on 2026-10-17 23:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subwaive', '0037_log_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(help_text='What day was counted?', unique=True)),
+                ('active_members', models.IntegerField(default=0, help_text='How many people had an active membership?')),
+                ('inactive_members', models.IntegerField(default=0, help_text='How many people had a membership that was not active?')),
+            ],
+            options={
+                'ordering': ('-date',),
+            },
+        ),
+        migrations.CreateModel(
+            name='EventAttendance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True, help_text='What local date did the event start?')),
+                ('check_ins', models.IntegerField(default=0, help_text='How many check-ins did the event have?')),
+                ('people', models.IntegerField(default=0, help_text='How many different people checked in?')),
+                ('event', models.OneToOneField(help_text='Which event are these check-ins for?', on_delete=django.db.models.deletion.CASCADE, related_name='attendance', to='subwaive.event')),
+            ],
+            options={
+                'ordering': ('-date', 'event'),
+            },
+        ),
+        migrations.CreateModel(
+            name='PersonWeekAttendance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('week', models.DateField(help_text='What Monday does the week start on?')),
+                ('check_ins', models.IntegerField(default=0, help_text='How many times did they check in that week?')),
+                ('person', models.ForeignKey(help_text='Who checked in?', on_delete=django.db.models.deletion.CASCADE, related_name='week_attendance', to='subwaive.person')),
+            ],
+            options={
+                'ordering': ('-week', 'person'),
+                'indexes': [models.Index(fields=['week'], name='person_week_attendance_week')],
+                'constraints': [models.UniqueConstraint(fields=('person', 'week'), name='unique_person_week_attendance')],
+            },
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.1.7 on 2026-10-17 23:09
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+# the columns 0040 makes unique. The oldest row of each duplicate group is kept, the next refresh corrects its values
+UNIQUE_FIELDS = [
+    ('CalendarEvent', ['UID', 'recurrence_order']),
+    ('DocusealSubmission', ['submission_id']),
+    ('DocusealSubmitter', ['submitter_id']),
+    ('DocusealSubmitterSubmission', ['submitter', 'submission']),
+    ('DocusealTemplate', ['template_id']),
+    ('NFC', ['uid']),
+    ('NFC', ['registration_id']),
+    ('NFC', ['activation_id']),
+    ('PersonEvent', ['person', 'event']),
+    ('Phone', ['registration_id']),
+    ('Phone', ['activation_id']),
+    ('StripeCustomer', ['stripe_id']),
+    ('StripeOneTimePayment', ['stripe_id']),
+    ('StripePaymentLink', ['stripe_id']),
+    ('StripePaymentLinkPrice', ['payment_link', 'price']),
+    ('StripePrice', ['stripe_id']),
+    ('StripeProduct', ['stripe_id']),
+    ('StripeSubscription', ['stripe_id']),
+    ('StripeSubscriptionItem', ['stripe_id']),
+]
+
+
+# maps without a constraint of their own, which repointing can leave holding the same pair twice
+MAP_FIELDS = [
+    ('PersonDocuseal', ['person', 'submitter']),
+    ('PersonStripe', ['person', 'customer']),
+]
+
+
+def get_duplicates(model, fields):
+    """ return (keep_id, [duplicate ids]) for each group of rows sharing the fields """
+    # NULLs never conflict, so rows with a NULL key are left alone
+    rows = model.objects.filter(**{f"{ field }__isnull": False for field in fields})
+    groups = rows.values(*fields).annotate(keep_id=Min('id'), count=Count('id')).filter(count__gt=1).order_by()
+    return [(group['keep_id'], list(rows.filter(**{field: group[field] for field in fields}).exclude(id=group['keep_id']).values_list('id', flat=True))) for group in groups]
+
+
+def remove_duplicates(apps, schema_editor):
+    # point everything referencing a duplicate at the row that is kept, so deleting the duplicates
+    # cascades to nothing. Maps that end up holding a pair twice are deduplicated below
+    for model_name, fields in UNIQUE_FIELDS:
+        model = apps.get_model('subwaive', model_name)
+        relations = [relation for relation in model._meta.related_objects if relation.one_to_many]
+        for keep_id, duplicate_ids in get_duplicates(model, fields):
+            for relation in relations:
+                relation.related_model.objects.filter(**{f"{ relation.field.name }__in": duplicate_ids}).update(**{relation.field.name: keep_id})
+
+    for model_name, fields in UNIQUE_FIELDS + MAP_FIELDS:
+        model = apps.get_model('subwaive', model_name)
+        for keep_id, duplicate_ids in get_duplicates(model, fields):
+            model.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subwaive', '0038_attendance_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,119 @@
+# Generated by Django 5.1.7 on 2026-10-17 23:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subwaive', '0039_remove_duplicate_external_ids'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='docusealsubmission',
+            name='submission_id',
+            field=models.PositiveIntegerField(help_text='What is the Docuseal ID of this submission?', unique=True),
+        ),
+        migrations.AlterField(
+            model_name='docusealsubmitter',
+            name='email',
+            field=models.EmailField(db_index=True, help_text='What is the email address of this submitter?', max_length=254),
+        ),
+        migrations.AlterField(
+            model_name='docusealsubmitter',
+            name='submitter_id',
+            field=models.PositiveIntegerField(help_text='What is the Docuseal ID of this submitter?', unique=True),
+        ),
+        migrations.AlterField(
+            model_name='docusealtemplate',
+            name='template_id',
+            field=models.PositiveIntegerField(help_text='What is the Docuseal ID of this template?', unique=True),
+        ),
+        migrations.AlterField(
+            model_name='nfc',
+            name='activation_id',
+            field=models.CharField(help_text='What is the URL secret used to activate this NFC token?', max_length=32, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='nfc',
+            name='registration_id',
+            field=models.CharField(help_text='What is the URL secret used to register this NFC token?', max_length=32, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='nfc',
+            name='uid',
+            field=models.CharField(help_text='UID identifying this NFC', max_length=32, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='personemail',
+            name='email',
+            field=models.EmailField(db_index=True, help_text="What is this person's email address?", max_length=254),
+        ),
+        migrations.AlterField(
+            model_name='phone',
+            name='activation_id',
+            field=models.CharField(help_text='What is the URL secret used to activate this phone number?', max_length=32, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='phone',
+            name='registration_id',
+            field=models.CharField(help_text='What is the URL secret for registering this phone number?', max_length=32, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='stripecustomer',
+            name='email',
+            field=models.EmailField(db_index=True, help_text='What is the email address of this customer?', max_length=254),
+        ),
+        migrations.AlterField(
+            model_name='stripecustomer',
+            name='stripe_id',
+            field=models.CharField(blank=True, help_text='What is the Stripe ID of this customer?', max_length=64, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='stripeonetimepayment',
+            name='stripe_id',
+            field=models.CharField(help_text='What is the Stripe ID of this checkout session?', max_length=128, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='stripepaymentlink',
+            name='stripe_id',
+            field=models.CharField(help_text='What is the Stripe ID of this payment link?', max_length=64, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='stripeprice',
+            name='stripe_id',
+            field=models.CharField(help_text='What is the Stripe ID of this price?', max_length=64, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='stripeproduct',
+            name='stripe_id',
+            field=models.CharField(help_text='What is the Stripe ID of this product?', max_length=64, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='stripesubscription',
+            name='stripe_id',
+            field=models.CharField(help_text='What is the Stripe ID of this subscription?', max_length=64, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='stripesubscriptionitem',
+            name='stripe_id',
+            field=models.CharField(help_text='What is the Stripe ID of this subscription item?', max_length=64, unique=True),
+        ),
+        migrations.AddConstraint(
+            model_name='calendarevent',
+            constraint=models.UniqueConstraint(fields=('UID', 'recurrence_order'), name='unique_calendar_event'),
+        ),
+        migrations.AddConstraint(
+            model_name='docusealsubmittersubmission',
+            constraint=models.UniqueConstraint(fields=('submitter', 'submission'), name='unique_docuseal_submitter_submission'),
+        ),
+        migrations.AddConstraint(
+            model_name='personevent',
+            constraint=models.UniqueConstraint(fields=('person', 'event'), name='unique_person_event'),
+        ),
+        migrations.AddConstraint(
+            model_name='stripepaymentlinkprice',
+            constraint=models.UniqueConstraint(fields=('payment_link', 'price'), name='unique_stripe_payment_link_price'),
+        ),
+    ]
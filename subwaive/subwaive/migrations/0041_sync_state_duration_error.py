@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-17 23:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subwaive', '0040_external_id_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncstate',
+            name='duration',
+            field=models.FloatField(blank=True, help_text='How many seconds did the last sync take?', null=True),
+        ),
+        migrations.AddField(
+            model_name='syncstate',
+            name='error',
+            field=models.TextField(blank=True, help_text='What went wrong in the last sync, if anything?', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='syncstate',
+            index=models.Index(fields=['object_type'], name='sync_state_object_type'),
+        ),
+    ]
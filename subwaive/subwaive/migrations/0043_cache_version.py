@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-17 23:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subwaive', '0042_person_roster_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Which cache does this counter belong to?', max_length=64, unique=True)),
+                ('version', models.BigIntegerField(default=0, help_text='How many times has this cache been invalidated?')),
+            ],
+            options={
+                'ordering': ('name',),
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-17 23:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subwaive', '0043_cache_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, help_text='When may a worker next try to handle the event? (empty for straight away)', null=True),
+        ),
+    ]
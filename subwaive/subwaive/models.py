@@ -1,17 +1,30 @@
 import datetime
+import hashlib
 import logging
 import os
+import re
+import threading
+import time
+import unicodedata
+import uuid
 import pytz #!!! your sometimes adding local and sometimes adding utc, if they are tz-aware does it mater?
 import caldav
 
 from django.contrib.auth.models import Permission, User
-from django.db import models
-from django.db.models import Q
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.db.models import Case, CharField, Count, Exists, ExpressionWrapper, F, IntegerField, Max, OuterRef, Prefetch, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, ExtractIsoWeekDay, TruncWeek
+from django.utils import timezone
 
 from docuseal import docuseal
 
 import stripe
 
+from subwaive.api_cache import stripe_cache
+from subwaive.fetch import fetch_all
 from subwaive.settings import BASE_DIR
 
 # https://www.docuseal.com/docs/api
@@ -22,6 +35,10 @@ DOCUSEAL_WWW_ENDPOINT = os.environ.get("DOCUSEAL_WWW_ENDPOINT")
 docuseal.url = DOCUSEAL_API_ENDPOINT
 docuseal.key = DOCUSEAL_API_KEY
 
+# detail calls made during refreshes run on a small pool of threads
+DOCUSEAL_API_CONCURRENCY = int(os.environ.get("DOCUSEAL_API_CONCURRENCY", 4))
+DOCUSEAL_API_RATE_LIMIT = float(os.environ.get("DOCUSEAL_API_RATE_LIMIT", 10))
+
 # https://docs.stripe.com/api
 STRIPE_API_KEY = os.environ.get("STRIPE_API_KEY")
 STRIPE_WWW_ENDPOINT = os.environ.get("STRIPE_WWW_ENDPOINT")
@@ -30,14 +47,163 @@ stripe.api_key = STRIPE_API_KEY
 
 TIME_ZONE = os.environ.get("TIME_ZONE")
 CALENDAR_URL = os.environ.get("CALENDAR_URL")
+# how long a downloaded calendar can be reused by single event refreshes
+CALENDAR_CACHE_SECONDS = int(os.environ.get("CALENDAR_CACHE_SECONDS", 300))
 
 LOGGING_LEVEL = int(os.environ.get("LOGGING_LEVEL", logging.DEBUG))
+# log entries made during a request or job are written together
+LOG_BUFFER_SIZE = int(os.environ.get("LOG_BUFFER_SIZE", 200))
+LOG_BUFFER_SECONDS = float(os.environ.get("LOG_BUFFER_SECONDS", 5))
+
+DOCUSEAL_PAGE_SIZE = 100
+STRIPE_SYNC_PAGE_SIZE = 100
+# how many eligibility snapshots are computed and written per batch of queries
+ELIGIBILITY_PAGE_SIZE = 500
+
+# a short prefix like "j" matches most people, so a search returns only the best PERSON_SEARCH_LIMIT
+PERSON_SEARCH_LIMIT = 200
+# related objects Stripe returns in place of their ids, so syncs need no follow-up retrieves
+STRIPE_SUBSCRIPTION_EXPAND = ['customer', 'items.data.price.product']
+STRIPE_LINE_ITEM_EXPAND = ['line_items.data.price.product']
+CHECKOUT_SESSION_MAX_SECONDS = 24 * 60 * 60
+
+WEBHOOK_BATCH_SIZE = 500
+WEBHOOK_MAX_ATTEMPTS = 5
+# a failed event waits this long before its next attempt, doubling with each failure up to the maximum
+WEBHOOK_RETRY_SECONDS = int(os.environ.get("WEBHOOK_RETRY_SECONDS", 60))
+WEBHOOK_RETRY_MAX_SECONDS = int(os.environ.get("WEBHOOK_RETRY_MAX_SECONDS", 60 * 60))
+# a worker claims a batch for this long, so a worker that dies part way through leaves its events to the next one
+WEBHOOK_CLAIM_SECONDS = 10 * 60
+
+# how often each process checks whether another one changed the NFC tokens or terminals it holds in memory
+NFC_CACHE_CHECK_SECONDS = float(os.environ.get("NFC_CACHE_CHECK_SECONDS", 2))
 
 def fromtimestamp(timestamp):
     """ transforms a timestamp to a datetime """
     return datetime.datetime.fromtimestamp(timestamp, tz=pytz.timezone(TIME_ZONE))
 
 
+def stripe_list_args(model, new_only=False):
+    """ return list() arguments limiting a Stripe listing to objects created since the last sync """
+    list_args = {}
+    cursor = SyncState.get_cursor('stripe', model.__name__)
+    if new_only and cursor:
+        list_args['created'] = {'gte': int(cursor)}
+    return list_args
+
+
+def docuseal_cursor(model, id_field):
+    """ return the id an incremental Docuseal sync resumes from: the highest id stored by the last sync,
+    else the highest id in the table, else None for an empty table """
+    return SyncState.get_int_cursor('docuseal', model.__name__) or model.objects.aggregate(Max(id_field))[f"{ id_field }__max"]
+
+def docuseal_counts(model, count_before, new_only):
+    """ return the counts of a Docuseal sync from how many rows the table held before it. A full sync replaces every row """
+    count_after = model.objects.count()
+    if new_only:
+        return {'inserted': max(count_after - count_before, 0)}
+    return {'inserted': count_after, 'removed': count_before}
+
+
+def stripe_id_of(value):
+    """ return the id of an API field whether or not it was expanded into an object """
+    return value if isinstance(value, str) else value.id
+
+def stripe_object_of(value):
+    """ return an API field's object if it was expanded, else None """
+    return None if isinstance(value, str) else value
+
+
+def reconcile_stripe(model, api_objects, to_values, new_only=False, removable=None, on_page=None, persons=None):
+    """ Reconcile local rows of a Stripe model with API objects, keyed by stripe_id.\n
+    API objects are consumed a page at a time. Each page is compared with the existing rows and
+    flushed with bulk_create/bulk_update. After a full listing, rows the API no longer returns are
+    deleted (narrowed by the removable Q, if provided). A partial listing (new_only) never deletes.\n
+    to_values maps an API object to a dict of field values, or None to skip it. on_page is called
+    with the page of API objects, a dict of local rows by stripe_id, and the rows that were inserted,
+    and may return the ids of further rows it changed.\n
+    persons lists the Person lookups that reach this model. The eligibility snapshots of the people
+    linked to inserted, updated or removed rows are rebuilt at the end. """
+    with SyncState.track('stripe', model.__name__) as sync_run:
+        counts = {'inserted': 0, 'updated': 0, 'removed': 0, 'skipped': 0}
+        seen = set()
+        cursor = None
+        person_ids = set()
+
+        def flush(page):
+            existing = {row.stripe_id: row for row in model.objects.filter(stripe_id__in=[values['stripe_id'] for _, values in page])}
+            inserts = []
+            insert_fields = set()
+            updates = []
+            update_fields = set()
+            for api_object, values in page:
+                if values['stripe_id'] in seen:
+                    continue
+                seen.add(values['stripe_id'])
+                row = existing.get(values['stripe_id'])
+                if row is None:
+                    row = model(**values)
+                    existing[row.stripe_id] = row
+                    inserts.append(row)
+                    insert_fields.update(values)
+                else:
+                    changed = [field for field, value in values.items() if getattr(row, field) != value]
+                    for field in changed:
+                        setattr(row, field, values[field])
+                    if changed:
+                        update_fields.update(changed)
+                        updates.append(row)
+
+            with transaction.atomic():
+                if inserts:
+                    # a row a webhook inserted since the lookup above is updated instead
+                    model.objects.bulk_create(inserts, update_conflicts=True, unique_fields=['stripe_id'], update_fields=[model._meta.get_field(field).name for field in insert_fields - {'stripe_id'}])
+                if updates:
+                    model.objects.bulk_update(updates, [model._meta.get_field(field).name for field in update_fields])
+            counts['inserted'] += len(inserts)
+            counts['updated'] += len(updates)
+
+            changed_ids = set(row.id for row in inserts + updates)
+            if on_page:
+                changed_ids.update(on_page([api_object for api_object, _ in page], existing, inserts) or [])
+            if persons:
+                person_ids.update(PersonEligibility.get_person_ids(persons, changed_ids))
+
+        page = []
+        for api_object in api_objects:
+            values = to_values(api_object)
+            if values is None:
+                counts['skipped'] += 1
+                continue
+            created = api_object.get('created')
+            if created and (cursor is None or created > cursor):
+                cursor = created
+            page.append((api_object, values))
+            if len(page) >= STRIPE_SYNC_PAGE_SIZE:
+                flush(page)
+                page = []
+        if page:
+            flush(page)
+
+        if not new_only:
+            stale = set(model.objects.filter(stripe_id__isnull=False).values_list('stripe_id', flat=True)) - seen
+            stale_qs = model.objects.filter(stripe_id__in=stale)
+            if removable:
+                stale_qs = stale_qs.filter(removable)
+            if persons:
+                person_ids.update(PersonEligibility.get_person_ids(persons, stale_qs.values_list('id', flat=True)))
+            counts['removed'] = stale_qs.delete()[1].get(model._meta.label, 0)
+
+        if person_ids:
+            PersonEligibility.rebuild_persons(Person.objects.filter(id__in=person_ids))
+
+        sync_run.cursor = cursor
+        sync_run.counts = counts
+        Log.new(logging_level=logging.INFO, description=f"Refresh { model.__name__ }", json=dict(counts, new_only=new_only))
+
+        return counts
+
+
 class DocusealField(models.Model):
     """ Fields titles flagged for  DocusealFieldStore """
     field = models.CharField(max_length=256)
@@ -61,50 +227,78 @@ class DocusealFieldStore(models.Model):
     def __str__(self):
         return f"""{ self.field }"""
 
+    def get_fields_by_name():
+        """ return lists of DocusealField keyed by normalized field title """
+        fields_by_name = {}
+        for field in DocusealField.objects.all():
+            fields_by_name.setdefault(field.field.lower().strip(), []).append(field)
+        return fields_by_name
+
+    def extract(submission, submission_api, fields_by_name):
+        """ return unsaved field store rows for a submission and any names found in them """
+        rows = []
+        names = []
+        for form_field in submission_api['submitters'][0]['values']:
+            if form_field['value']:
+                for field in fields_by_name.get(form_field['field'].lower().strip(), []):
+                    rows.append(DocusealFieldStore(submission=submission, field=field, value=form_field['value']))
+                    if 'name' in field.field.lower():
+                        names.append(form_field['value'])
+        return (rows, names)
+
     def re_extract(submission_id):
         """ re-extract field store values for a DocusealSubmission """
         Log.new(logging_level=logging.INFO, description="Refresh DocusealFieldStore", json={'submission_id': submission_id})
         submission = DocusealSubmission.objects.get(submission_id=submission_id)
-        DocusealFieldStore.objects.filter(submission=submission).delete()
-        important_fields = DocusealField.objects.all()
-
-        s = docuseal.get_submission(submission_id)
-        for field in important_fields:
-            for form_field in s['submitters'][0]['values']:
-                if form_field['field'].lower().strip() == field.field.lower().strip():
-                    if form_field['value']:
-                        DocusealFieldStore.objects.create(submission=submission, field=field, value=form_field['value'])
-                        if 'name' in field.field.lower():
-                            submission._auto_name(form_field['value'])
-
-    def refresh(max_existing_submission_id=None):
-        """ clear out existing records and repopulate them from the API """
+        (rows, names) = DocusealFieldStore.extract(submission, docuseal.get_submission(submission_id), DocusealFieldStore.get_fields_by_name())
+
+        with transaction.atomic():
+            DocusealFieldStore.objects.filter(submission=submission).delete()
+            DocusealFieldStore.objects.bulk_create(rows)
+        for name in names:
+            submission._auto_name(name)
+        PersonSearchToken.rebuild_persons(submission.get_persons())
+
+    def refresh(new_only=False):
+        """ clear out existing records and repopulate them from the API. new_only only extracts submissions newer than the last extracted """
         try:
-            if max_existing_submission_id:
-                submissions = DocusealSubmission.objects.filter(submission_id__gt=max_existing_submission_id)
-            else:
-                submissions = DocusealSubmission.objects.all()
-                Log.new(logging_level=logging.INFO, description="Refresh DocusealFieldStore")
-                DocusealFieldStore.objects.all().delete()
-
-            important_fields = DocusealField.objects.all()
-
-            for submission in submissions:
-                s = docuseal.get_submission(submission.submission_id)
-                for field in important_fields:
-                    for form_field in s['submitters'][0]['values']:
-                        if form_field['field'].lower().strip() == field.field.lower().strip():
-                            if form_field['value']:
-                                DocusealFieldStore.objects.create(submission=submission, field=field, value=form_field['value'])
-                                if 'name' in field.field.lower():
-                                    submission._auto_name(form_field['value'])
+            with SyncState.track('docuseal', 'DocusealFieldStore') as sync_run:
+                count_before = DocusealFieldStore.objects.count()
+                if new_only:
+                    submissions = DocusealSubmission.objects.filter(submission_id__gt=docuseal_cursor(DocusealFieldStore, 'submission__submission_id') or 0)
+                else:
+                    submissions = DocusealSubmission.objects.all()
+                    Log.new(logging_level=logging.INFO, description="Refresh DocusealFieldStore")
+                    DocusealFieldStore.objects.all().delete()
+
+                fields_by_name = DocusealFieldStore.get_fields_by_name()
+
+                submissions = list(submissions)
+                for i in range(0, len(submissions), DOCUSEAL_PAGE_SIZE):
+                    rows = []
+                    names = []
+                    page = submissions[i:i+DOCUSEAL_PAGE_SIZE]
+                    submissions_api = DocusealSubmission.fetch_all([submission.submission_id for submission in page])
+                    for submission in page:
+                        (submission_rows, submission_names) = DocusealFieldStore.extract(submission, submissions_api[submission.submission_id], fields_by_name)
+                        rows.extend(submission_rows)
+                        names.extend((submission, name) for name in submission_names)
+
+                    with transaction.atomic():
+                        DocusealFieldStore.objects.bulk_create(rows)
+                    for (submission, name) in names:
+                        submission._auto_name(name)
+                    PersonSearchToken.rebuild_persons(Person.objects.filter(persondocuseal__submitter__docusealsubmittersubmission__submission__in=page).distinct())
+                if submissions:
+                    sync_run.cursor = max(submission.submission_id for submission in submissions)
+                sync_run.counts = docuseal_counts(DocusealFieldStore, count_before, new_only)
         except Exception as e:
             Log.new(logging_level=logging.ERROR, description='Docuseal - FieldStore refresh error', other_info=e)
 
 
 class DocusealSubmission(models.Model):
     """ A Docuseal submission """
-    submission_id = models.PositiveIntegerField(help_text="What is the Docuseal ID of this submission?")
+    submission_id = models.PositiveIntegerField(unique=True, help_text="What is the Docuseal ID of this submission?")
     created_at = models.DateTimeField(null=True, blank=True, help_text="When was this submission created in Docuseal?")
     completed_at = models.DateTimeField(null=True, blank=True, help_text="When was this submission completed in Docuseal?")
     archived_at = models.DateTimeField(null=True, blank=True, help_text="When was this submission archived in Docuseal?")
@@ -129,87 +323,127 @@ class DocusealSubmission(models.Model):
                     Log.new(logging_level=logging.INFO, description="Auto-name by Docuseal", json={'old': person.name, 'new': name})
                     person.name = name
                     person.save()
+                    PersonSearchToken.rebuild(person)
 
-    def create_or_update(submission_id):
-        """ update a record if it exists, else create one """
+    def create_or_update(submission_id, submission_api=None):
+        """ update a record if it exists, else create one. submission_api can be passed if it was already fetched """
         json = {'submission_id': submission_id}
 
-        submission_api = docuseal.get_submission(submission_id)
-        submission_qs = DocusealSubmission.objects.filter(submission_id=submission_id)
+        if not submission_api:
+            submission_api = docuseal.get_submission(submission_id)
         submitters_api = [{'submitter_id': s['id'], 'email': s['email'], 'slug': s['slug'], 'status': s['status'], 'role': s['role']} for s in submission_api['submitters']]
         # print(f"submitters_api: {submitters_api}")
-        if submission_qs.exists():
-            submission = submission_qs.first()
-            # assuming slug can't change
-            submission.status = submission_api['status']
-            submission.created_at = submission_api['created_at']
-            submission.completed_at = submission_api['completed_at']
-            if submission_api['archived_at']:
-                submission.archived_at = submission_api['archived_at']
-            submission.save()
-            submitters_db = DocusealSubmitterSubmission.objects.filter(submission=submission).values_list('id')
-            # print(f"submitters_db: {submitters_db}")
-            submitters_new = [s for s in submitters_api if s['submitter_id'] not in submitters_db]
-            # print(f"submitters_new: {submitters_new}")
-            if submitters_new:
-                for s in submitters_new:
-                    DocusealSubmitter.create_if_needed_by_id(s['submitter_id'])
-                    submitter = DocusealSubmitter.objects.get(submitter_id=s['submitter_id'])
-                    DocusealSubmitterSubmission.objects.create(submission=submission, submitter=submitter)
-            Log.new(logging_level=logging.DEBUG, description="Update DocusealSubmission", json={'submission_id': submission_id})
+        # assuming slug can't change
+        values = {'status': submission_api['status'], 'created_at': submission_api['created_at'], 'completed_at': submission_api['completed_at']}
+        if submission_api['archived_at']:
+            values['archived_at'] = submission_api['archived_at']
+        submission = DocusealSubmission.objects.filter(submission_id=submission_id).first()
+        created = submission is None
+        if created:
+            # only a new submission needs its template, which may have been created since the last template refresh
+            template_id = submission_api['template']['id']
+            template = DocusealTemplate.objects.filter(template_id=template_id).first() or DocusealTemplate.create_or_update_by_id(template_id)
+            # a submission a refresh inserted since the lookup above is updated instead
+            submission, created = DocusealSubmission.objects.update_or_create(
+                submission_id=submission_id,
+                defaults=values,
+                create_defaults=dict(values, slug=submission_api['slug'], archived_at=submission_api['archived_at'], template=template),
+                )
         else:
-            DocusealSubmission.new(submission_id, submission_api['slug'], submission_api['status'], submission_api['created_at'], submission_api['completed_at'], submission_api['archived_at'], submission_api['template']['id'], submitters_api)
-            Log.new(logging_level=logging.DEBUG, description="Create DocusealSubmission", json=json)
-
-    def new(submission_id, slug, status, created_at, completed_at, archived_at, template_id, submitters=None):
-        """ Create a new instance """
-        template = DocusealTemplate.objects.get(template_id=template_id)
-        doc_sub = DocusealSubmission.objects.create(submission_id=submission_id, slug=slug, status=status, created_at=created_at, completed_at=completed_at, archived_at=archived_at, template=template)
-        Log.new(logging_level=logging.DEBUG, description="Create DocusealSubmission", json={'submission_id': submission_id})
-        for s in submitters:
-            DocusealSubmitter.create_if_needed_by_id(submitter_id=s['submitter_id'])
-            submitter = DocusealSubmitter.objects.get(submitter_id=s['submitter_id'])
-            DocusealSubmitterSubmission.objects.create(submission=doc_sub, submitter=submitter)
+            for field, value in values.items():
+                setattr(submission, field, value)
+            submission.save(update_fields=list(values))
+
+        submitters_db = DocusealSubmitterSubmission.objects.filter(submission=submission).values_list('submitter__submitter_id', flat=True)
+        # print(f"submitters_db: {submitters_db}")
+        submitters_new = [s for s in submitters_api if s['submitter_id'] not in submitters_db]
+        # print(f"submitters_new: {submitters_new}")
+        if submitters_new:
+            submitters = DocusealSubmitter.create_if_needed_by_id_list([s['submitter_id'] for s in submitters_new])
+            DocusealSubmitterSubmission.objects.bulk_create([
+                DocusealSubmitterSubmission(submission=submission, submitter=submitters[s['submitter_id']])
+                for s in submitters_new if s['submitter_id'] in submitters
+            ], ignore_conflicts=True)
+        Log.new(logging_level=logging.DEBUG, description="Create DocusealSubmission" if created else "Update DocusealSubmission", json=json)
+
+        PersonEligibility.rebuild_persons(submission.get_persons())
+
+    def bulk_new(submissions_api):
+        """ Create new instances for a page of API submissions using bulk writes. Returns the submissions """
+        templates = {t.template_id: t for t in DocusealTemplate.objects.filter(template_id__in=[s['template']['id'] for s in submissions_api])}
+        existing_ids = set(DocusealSubmission.objects.filter(submission_id__in=[s['id'] for s in submissions_api]).values_list('submission_id', flat=True))
+        submissions_api = [s for s in submissions_api if s['template']['id'] in templates and s['id'] not in existing_ids]
+
+        with transaction.atomic():
+            # a submission created by a webhook since the check above is updated instead
+            submissions = DocusealSubmission.objects.bulk_create([
+                DocusealSubmission(submission_id=s['id'], slug=s['slug'], status=s['status'], created_at=s['created_at'], completed_at=s['completed_at'], archived_at=s['archived_at'], template=templates[s['template']['id']])
+                for s in submissions_api
+            ], update_conflicts=True, unique_fields=['submission_id'], update_fields=['status', 'created_at', 'completed_at', 'archived_at'])
+            # submission listings include the submitter details, so no per-submitter API call is needed
+            submitters = DocusealSubmitter.bulk_create_if_needed([submitter for s in submissions_api for submitter in s['submitters']])
+            DocusealSubmitterSubmission.objects.bulk_create([
+                DocusealSubmitterSubmission(submission=submission, submitter=submitters[submitter['id']])
+                for (submission, s) in zip(submissions, submissions_api) for submitter in s['submitters']
+            ], ignore_conflicts=True)
+        Log.new(logging_level=logging.DEBUG, description="Create DocusealSubmission", json={'count': len(submissions)})
+        return submissions
 
     def refresh(new_only=True):
         """ clear out existing records and repopulate them from the API """
         try:
-            if new_only:
-                Log.new(logging_level=logging.INFO, description="Fetch New DocusealSubmission")
-                # capture changes to submission status/dates
-                for submission in DocusealSubmission.objects.filter(completed_at__isnull=True).order_by('-created_at')[:20]:
-                    DocusealSubmission.create_or_update(submission.submission_id)
-                last_submission_id = DocusealSubmission.objects.all().order_by('-submission_id').first().submission_id
-            else:
-                Log.new(logging_level=logging.INFO, description="Refresh DocusealSubmission")
-                DocusealSubmission.objects.all().delete()
-                last_submission_id = None
-
-            pagination_next = True
-            while pagination_next:
-                api_dict = {'limit': 100}
-                if last_submission_id:
-                    if new_only:
-                        sort_word = 'before'
-                    else:
-                        sort_word = 'after'
-                    api_dict[sort_word] = last_submission_id
+            with SyncState.track('docuseal', 'DocusealSubmission') as sync_run:
+                count_before = DocusealSubmission.objects.count()
+                # whoever signs a waiver (or loses one to a full refresh) gets their eligibility rebuilt at the end
+                person_lookups = ['persondocuseal__submitter__docusealsubmittersubmission__submission']
+                person_ids = set()
+                if new_only:
+                    Log.new(logging_level=logging.INFO, description="Fetch New DocusealSubmission")
+                    # capture changes to submission status/dates
+                    pending_ids = DocusealSubmission.objects.filter(completed_at__isnull=True).order_by('-created_at').values_list('submission_id', flat=True)[:20]
+                    for submission_id, submission_api in DocusealSubmission.fetch_all(pending_ids).items():
+                        DocusealSubmission.create_or_update(submission_id, submission_api)
+                    last_submission_id = docuseal_cursor(DocusealSubmission, 'submission_id')
+                else:
+                    Log.new(logging_level=logging.INFO, description="Refresh DocusealSubmission")
+                    person_ids.update(Person.objects.filter(persondocuseal__submitter__docusealsubmittersubmission__isnull=False).values_list('id', flat=True))
+                    DocusealSubmission.objects.all().delete()
+                    last_submission_id = None
+
+                pagination_next = True
+                while pagination_next:
+                    api_dict = {'limit': 100}
+                    if last_submission_id:
+                        if new_only:
+                            sort_word = 'before'
+                        else:
+                            sort_word = 'after'
+                        api_dict[sort_word] = last_submission_id
                 
-                submissions = docuseal.list_submissions(api_dict)
+                    submissions = docuseal.list_submissions(api_dict)
                 
-                last_submission_id = submissions['pagination']['next']
-                if not last_submission_id:
-                    pagination_next = False
-
-                for submission in submissions['data']:
-                    if submission['status'] == 'completed':
-                        submitters = [{'submitter_id': s['id'], 'status': s['status'], 'role': s['role']} for s in submission['submitters']]
-                        if DocusealTemplate.objects.filter(template_id=submission['template']['id']).exists():
-                            DocusealSubmission.new(submission['id'], submission['slug'], submission['status'], submission['created_at'], submission['completed_at'], submission['archived_at'], submission['template']['id'], submitters)
+                    last_submission_id = submissions['pagination']['next']
+                    if not last_submission_id:
+                        pagination_next = False
+
+                    new_submissions = DocusealSubmission.bulk_new([submission for submission in submissions['data'] if submission['status'] == 'completed'])
+                    person_ids.update(PersonEligibility.get_person_ids(person_lookups, [submission.id for submission in new_submissions]))
+                if person_ids:
+                    PersonEligibility.rebuild_persons(Person.objects.filter(id__in=person_ids))
+                sync_run.cursor = DocusealSubmission.objects.aggregate(Max('submission_id'))['submission_id__max']
+                sync_run.counts = docuseal_counts(DocusealSubmission, count_before, new_only)
         except Exception as e:
             Log.new(logging_level=logging.ERROR, description='Docuseal - Submission refresh error', other_info=e)
 
 
+    def fetch_all(submission_ids):
+        """ fetch API submissions concurrently, returning a dict by submission_id """
+        return fetch_all(docuseal.get_submission, submission_ids, DOCUSEAL_API_CONCURRENCY, DOCUSEAL_API_RATE_LIMIT)
+
+    def get_persons(self):
+        """ return the people associated with this submission's submitters """
+        return Person.objects.filter(persondocuseal__submitter__docusealsubmittersubmission__submission=self).distinct()
+
     def get_url(self):
         """ URL for a hyperlink """
         return f"{ DOCUSEAL_WWW_ENDPOINT }/submissions/{ self.submission_id }"
@@ -217,8 +451,8 @@ class DocusealSubmission(models.Model):
 
 class DocusealSubmitter(models.Model):
     """ A Docuseal submitter - often per documents """
-    submitter_id = models.PositiveIntegerField(help_text="What is the Docuseal ID of this submitter?")
-    email = models.EmailField(help_text="What is the email address of this submitter?")
+    submitter_id = models.PositiveIntegerField(unique=True, help_text="What is the Docuseal ID of this submitter?")
+    email = models.EmailField(db_index=True, help_text="What is the email address of this submitter?")
     slug = models.CharField(max_length=32, help_text="What is the URL slug for this submitter?")
 
     class Meta:
@@ -241,6 +475,7 @@ class DocusealSubmitter(models.Model):
                 # print(f"found person: {person}")
                 # print("creating docuseal-person")
                 PersonDocuseal.objects.create(person=person, submitter=self)
+                PersonSearchToken.rebuild(person)
             else:
                 # print(f"could not find person with email: {email}")
                 # print("creating person")
@@ -251,13 +486,55 @@ class DocusealSubmitter(models.Model):
                 person.save()
                 # print("creating docuseal-person")
                 PersonDocuseal.objects.create(person=person, submitter=self)
+                PersonSearchToken.rebuild(person)
+
+    def bulk_associate(submitters):
+        """ _auto_associate many submitters at once, creating any missing people in bulk """
+        linked = set(PersonDocuseal.objects.filter(submitter__in=submitters).values_list('submitter_id', flat=True))
+        submitters = [s for s in submitters if s.id not in linked]
+
+        person_id_by_email = {}
+        for email, person_id in PersonEmail.objects.filter(email__in=set(s.email for s in submitters)).order_by('-person_id').values_list('email', 'person_id'):
+            person_id_by_email[email] = person_id
+
+        new_emails = sorted(set(s.email for s in submitters) - set(person_id_by_email))
+        persons = Person.objects.bulk_create([Person(name=email) for email in new_emails])
+        emails = PersonEmail.objects.bulk_create([PersonEmail(person=person, email=email) for (person, email) in zip(persons, new_emails)])
+        for (person, email) in zip(persons, emails):
+            person.preferred_email = email
+            person_id_by_email[email.email] = person.id
+        Person.objects.bulk_update(persons, ['preferred_email'])
+
+        PersonDocuseal.objects.bulk_create([PersonDocuseal(person_id=person_id_by_email[s.email], submitter=s) for s in submitters])
+        PersonSearchToken.rebuild_persons(Person.objects.filter(id__in=set(person_id_by_email[s.email] for s in submitters)))
+
+    def bulk_create_if_needed(submitters_api):
+        """ Create DocusealSubmitters from API rows that don't exist already.
+        Returns every submitter in the rows keyed by submitter_id """
+        submitters = {s.submitter_id: s for s in DocusealSubmitter.objects.filter(submitter_id__in=[s['id'] for s in submitters_api])}
+        new_submitters = []
+        for s in submitters_api:
+            if s['id'] not in submitters:
+                submitters[s['id']] = DocusealSubmitter(submitter_id=s['id'], email=s['email'], slug=s['slug'])
+                new_submitters.append(submitters[s['id']])
+
+        DocusealSubmitter.objects.bulk_create(new_submitters, update_conflicts=True, unique_fields=['submitter_id'], update_fields=['email', 'slug'])
+        DocusealSubmitter.bulk_associate(new_submitters)
+        Log.new(logging_level=logging.DEBUG, description="Create DocusealSubmitter", json={'count': len(new_submitters)})
+
+        return submitters
 
     def create_if_needed_by_id(submitter_id):
         """ Create a new DocusealSubmitter if one with this email doesn't exist already """
-        if not DocusealSubmitter.objects.filter(submitter_id=submitter_id).exists():
-            submitter = docuseal.get_submitter(submitter_id)
-            if submitter:
-                DocusealSubmitter.new(submitter['id'], submitter['email'], submitter['slug'])
+        DocusealSubmitter.create_if_needed_by_id_list([submitter_id])
+
+    def create_if_needed_by_id_list(submitter_ids):
+        """ Create any DocusealSubmitters in a list of ids that don't exist already, fetching them concurrently.
+        Returns the submitters keyed by submitter_id """
+        existing_ids = set(DocusealSubmitter.objects.filter(submitter_id__in=submitter_ids).values_list('submitter_id', flat=True))
+        submitters_api = fetch_all(docuseal.get_submitter, [i for i in submitter_ids if i not in existing_ids], DOCUSEAL_API_CONCURRENCY, DOCUSEAL_API_RATE_LIMIT)
+        DocusealSubmitter.bulk_create_if_needed([s for s in submitters_api.values() if s])
+        return {s.submitter_id: s for s in DocusealSubmitter.objects.filter(submitter_id__in=submitter_ids)}
 
     def create_if_needed(email):
         """ Create a new DocusealSubmitter if one with this email doesn't exist already """
@@ -267,9 +544,10 @@ class DocusealSubmitter(models.Model):
 
     def new(submitter_id, email, slug):
         """ Create a new instance and auto_associate """
-        doc_sub = DocusealSubmitter.objects.create(submitter_id=submitter_id, email=email, slug=slug)
-        Log.new(logging_level=logging.DEBUG, description="Create DocusealSubmitter", json={'submitter_id': submitter_id})
-        doc_sub._auto_associate()
+        doc_sub, created = DocusealSubmitter.objects.get_or_create(submitter_id=submitter_id, defaults={'email': email, 'slug': slug})
+        if created:
+            Log.new(logging_level=logging.DEBUG, description="Create DocusealSubmitter", json={'submitter_id': submitter_id})
+            doc_sub._auto_associate()
 
     def search(email):
         """ search for a Docuseal submitter from the API """
@@ -296,32 +574,36 @@ class DocusealSubmitter(models.Model):
     def refresh(new_only=False):
         """ clear out existing records and repopulate them from the API """
         try:
-            if new_only:
-                Log.new(logging_level=logging.INFO, description="Fetch New DocusealSubmitter")
-                last_submitter_id = DocusealSubmitter.objects.all().order_by('-submitter_id').first().submitter_id
-            else:
-                Log.new(logging_level=logging.INFO, description="Refresh DocusealSubmitter")
-                DocusealSubmitter.objects.all().delete()
-                last_submitter_id = None
-
-            pagination_next = True
-            while pagination_next:
-                api_dict = {'limit': 100}
-                if last_submitter_id:
-                    if new_only:
-                        sort_word = 'before'
-                    else:
-                        sort_word = 'after'
-                    api_dict[sort_word] = last_submitter_id
+            with SyncState.track('docuseal', 'DocusealSubmitter') as sync_run:
+                count_before = DocusealSubmitter.objects.count()
+                if new_only:
+                    Log.new(logging_level=logging.INFO, description="Fetch New DocusealSubmitter")
+                    last_submitter_id = docuseal_cursor(DocusealSubmitter, 'submitter_id')
+                else:
+                    Log.new(logging_level=logging.INFO, description="Refresh DocusealSubmitter")
+                    DocusealSubmitter.objects.all().delete()
+                    last_submitter_id = None
+
+                pagination_next = True
+                while pagination_next:
+                    api_dict = {'limit': 100}
+                    if last_submitter_id:
+                        if new_only:
+                            sort_word = 'before'
+                        else:
+                            sort_word = 'after'
+                        api_dict[sort_word] = last_submitter_id
                 
-                submitters = docuseal.list_submitters(api_dict)
+                    submitters = docuseal.list_submitters(api_dict)
                 
-                last_submitter_id = submitters['pagination']['next']
-                if not last_submitter_id:
-                    pagination_next = False
-
-                for submitter in submitters['data']:
-                    DocusealSubmitter.new(submitter['id'], submitter['email'], submitter['slug'])
+                    last_submitter_id = submitters['pagination']['next']
+                    if not last_submitter_id:
+                        pagination_next = False
+
+                    with transaction.atomic():
+                        DocusealSubmitter.bulk_create_if_needed(submitters['data'])
+                sync_run.cursor = DocusealSubmitter.objects.aggregate(Max('submitter_id'))['submitter_id__max']
+                sync_run.counts = docuseal_counts(DocusealSubmitter, count_before, new_only)
         except Exception as e:
             Log.new(logging_level=logging.ERROR, description='Docuseal - Submitter refresh error', other_info=e)
 
@@ -333,6 +615,9 @@ class DocusealSubmitterSubmission(models.Model):
 
     class Meta:
         ordering = ('submitter', 'submission',)
+        constraints = [
+            models.UniqueConstraint(fields=['submitter', 'submission'], name='unique_docuseal_submitter_submission'),
+        ]
 
     def __str__(self):
         return f"""{ self.submitter } / { self.submission }"""
@@ -340,7 +625,7 @@ class DocusealSubmitterSubmission(models.Model):
 
 class DocusealTemplate(models.Model):
     """ A Docuseal template """
-    template_id = models.PositiveIntegerField(help_text="What is the Docuseal ID of this template?")
+    template_id = models.PositiveIntegerField(unique=True, help_text="What is the Docuseal ID of this template?")
     folder_name = models.CharField(max_length=128, help_text="What folder id this template under in Docuseal?")
     name = models.CharField(max_length=128, help_text="What is the name of this template?")
     slug = models.CharField(max_length=32, help_text="What is the URL slug for this template?")
@@ -352,56 +637,53 @@ class DocusealTemplate(models.Model):
         return f"""{ self.template_id } / { self.folder_name } / { self.name } / { self.slug }"""
 
     def create_or_update_by_id(template_id):
-        """ Create a template by Id instead of API row """
-        DocusealTemplate.create_or_update(template_api=docuseal.get_template(template_id))
+        """ Create a template by Id instead of API row, and return it """
+        return DocusealTemplate.create_or_update(template_api=docuseal.get_template(template_id))
 
     def create_or_update(template_api):
-        """ Update a template by API row if it exists, otherwise create it """
+        """ Update a template by API row if it exists, otherwise create it. Returns the template """
         template_id = template_api['id']
-        template_qs = DocusealTemplate.objects.filter(template_id=template_id)
-        if template_qs.exists():
-            template = template_qs.first()
-            template.name = template_api['name']
-            template.folder_name = template_api['folder_name']
-            template.save()
-            Log.new(logging_level=logging.DEBUG, description="Update DocusealTemplate", json={'template_id': template_id})
-        else:
-            DocusealTemplate.new(template_api['id'], template_api['folder_name'], template_api['name'], template_api['slug'])
-
-    def new(template_id, folder_name, name, slug):
-        """ Create a new instance and auto_associate """
-        DocusealTemplate.objects.create(template_id=template_id, folder_name=folder_name, name=name, slug=slug)
-        Log.new(logging_level=logging.DEBUG, description="Create DocusealTemplate", json={'template_id': template_id})
+        template, created = DocusealTemplate.objects.update_or_create(
+            template_id=template_id,
+            defaults={'name': template_api['name'], 'folder_name': template_api['folder_name']},
+            create_defaults={'name': template_api['name'], 'folder_name': template_api['folder_name'], 'slug': template_api['slug']},
+            )
+        Log.new(logging_level=logging.DEBUG, description="Create DocusealTemplate" if created else "Update DocusealTemplate", json={'template_id': template_id})
+        return template
 
     def refresh(new_only=False):
         """ clear out existing records and repopulate them from the API """
         try:
-            if new_only:
-                Log.new(logging_level=logging.INFO, description="Fetch New DocusealTemplate")
-                last_template_id = DocusealTemplate.objects.all().order_by('-template_id').first().template_id
-            else:
-                Log.new(logging_level=logging.INFO, description="Refresh DocusealTemplate")
-                last_template_id = None
-                DocusealTemplate.objects.all().delete()
-
-            pagination_next = True
-            while pagination_next:
-                api_dict = {'limit': 100}
-                if last_template_id:
-                    if new_only:
-                        sort_word = 'before'
-                    else:
-                        sort_word = 'after'
-                    api_dict[sort_word] = last_template_id
+            with SyncState.track('docuseal', 'DocusealTemplate') as sync_run:
+                count_before = DocusealTemplate.objects.count()
+                if new_only:
+                    Log.new(logging_level=logging.INFO, description="Fetch New DocusealTemplate")
+                    last_template_id = docuseal_cursor(DocusealTemplate, 'template_id')
+                else:
+                    Log.new(logging_level=logging.INFO, description="Refresh DocusealTemplate")
+                    last_template_id = None
+                    DocusealTemplate.objects.all().delete()
+
+                pagination_next = True
+                while pagination_next:
+                    api_dict = {'limit': 100}
+                    if last_template_id:
+                        if new_only:
+                            sort_word = 'before'
+                        else:
+                            sort_word = 'after'
+                        api_dict[sort_word] = last_template_id
                 
-                templates = docuseal.list_templates(api_dict)
+                    templates = docuseal.list_templates(api_dict)
                 
-                last_template_id = templates['pagination']['next']
-                if not last_template_id:
-                    pagination_next = False
-
-                for template in templates['data']:
-                    DocusealTemplate.create_or_update(template)
+                    last_template_id = templates['pagination']['next']
+                    if not last_template_id:
+                        pagination_next = False
+
+                    for template in templates['data']:
+                        DocusealTemplate.create_or_update(template)
+                sync_run.cursor = DocusealTemplate.objects.aggregate(Max('template_id'))['template_id__max']
+                sync_run.counts = docuseal_counts(DocusealTemplate, count_before, new_only)
         except Exception as e:
             Log.new(logging_level=logging.ERROR, description='Docuseal - Template refresh error', other_info=e)
 
@@ -426,35 +708,52 @@ class CalendarEvent(models.Model):
     description = models.TextField(max_length=2048, help_text='What is the calendar event description?')
     start = models.DateTimeField(help_text='When does the calendar event begin?')
     end = models.DateTimeField(help_text='When does the calendar event finish?')
+    content_hash = models.CharField(max_length=64, blank=True, null=True, help_text="What was the hash of the summary, description, start and end when last synced?")
 
     class Meta:
         ordering = ('-start', 'summary',)
+        constraints = [
+            models.UniqueConstraint(fields=['UID', 'recurrence_order'], name='unique_calendar_event'),
+        ]
 
     def __str__(self):
         return f"""{ self.summary[:50] } / { self.start } / { self.end }"""
     
-    def _auto_associate(self, lbound=None):
-        """ automatically create an event for this calendar event if it is in the future and an event does not exist. """
+    def associate_events(lbound=None):
+        """ make sure each calendar event starting after lbound has an Event, and delete future Events without
+        check-ins whose calendar event is gone. Matching Events are kept, so their ids are stable across refreshes. """
+        now = datetime.datetime.now().astimezone(pytz.timezone(TIME_ZONE))
         if not lbound:
-            lbound = datetime.datetime.now().astimezone(pytz.timezone(TIME_ZONE))
-        if self.start >= lbound:
-            # print("is after lbound")
-            event_qs = Event.objects.filter(summary=self.summary, start=self.start, end=self.end)
-            if not event_qs.exists():
-                Event.objects.create(summary=self.summary, description=self.description, start=self.start, end=self.end, calendar_event=self)
-        # else:
-        #     print("out-of-update-date-range event")
-    
-    def create(event_values, lbound=None):
-        """ create a new event from a dict """
-        # print("creating cal event")
-        event = CalendarEvent.objects.create(
-            UID=event_values['uid'], recurrence_order=event_values['recurrence_order'], 
-            summary=event_values['summary'], 
-            description=event_values['description'], 
-            start=event_values['start'], end=event_values['end'])
-        event._auto_associate(lbound)
-        Log.new(logging_level=logging.DEBUG, description="Create CalendarEvent", json={'uid': event.UID})
+            lbound = now
+        events = list(Event.objects.filter(start__gte=min(lbound, now)))
+        events_by_key = {}
+        for event in events:
+            events_by_key.setdefault((event.summary, event.start, event.end), event)
+
+        wanted = set()
+        new_events = []
+        linked_events = []
+        for calendar_event in CalendarEvent.objects.filter(start__gte=lbound):
+            key = (calendar_event.summary, calendar_event.start, calendar_event.end)
+            wanted.add(key)
+            event = events_by_key.get(key)
+            if not event:
+                event = Event(summary=calendar_event.summary, description=calendar_event.description, start=calendar_event.start, end=calendar_event.end, calendar_event=calendar_event)
+                events_by_key[key] = event
+                new_events.append(event)
+            elif event.calendar_event_id is None:
+                event.calendar_event = calendar_event
+                linked_events.append(event)
+
+        stale_ids = [e.id for e in events if e.start > now and (e.summary, e.start, e.end) not in wanted]
+        Event.objects.filter(id__in=stale_ids).exclude(attendee__isnull=False).delete()
+        Event.objects.bulk_create(new_events)
+        Event.objects.bulk_update(linked_events, ['calendar_event'])
+
+    def get_content_hash(event_values):
+        """ return a hash of the parts of a calendar event we store """
+        content = "\0".join([event_values['summary'], event_values['description'], event_values['start'].isoformat(), event_values['end'].isoformat()])
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
 
     def get_event_list_from_calendar_url(url, lbound=None, ubound=None):
         """ return a sorted list of events from a calendar URL """
@@ -477,86 +776,96 @@ class CalendarEvent(models.Model):
                 events = sorted(events, key=lambda x: x.start)
 
                 return events
+        return []
+
+    def get_event_values(lbound=None, ubound=None, use_cache=False):
+        """ return the calendar events in a window as dicts keyed by (uid, recurrence_order).
+        The list is cached, so refresh_event can reuse what the last refresh downloaded. """
+        cache_key = f"calendar-events:{ lbound.isoformat() if lbound else '' }:{ ubound.isoformat() if ubound else '' }"
+        if use_cache:
+            event_values = cache.get(cache_key)
+            if event_values is not None:
+                return event_values
+
+        uid_count = {}
+        event_values = {}
+        for e in CalendarEvent.get_event_list_from_calendar_url(CALENDAR_URL, lbound, ubound):
+            uid = e.get("UID")
+            uid_count[uid] = uid_count.get(uid, 0) + 1
+
+            start = e.start.astimezone(pytz.timezone(TIME_ZONE))
+            if lbound and ubound and not (lbound <= start <= ubound):
+                continue
 
-    def refresh(request):
-        """ Refresh events from ical URL """
+            values = {
+                'uid': str(uid),
+                'summary': e.get("SUMMARY").__str__().strip(),
+                'description': e.get("DESCRIPTION").__str__().strip()[:2048],
+                'start': start,
+                'end': e.end.astimezone(pytz.timezone(TIME_ZONE)),
+                'recurrence_order': uid_count[uid],
+            }
+            values['content_hash'] = CalendarEvent.get_content_hash(values)
+            event_values[(uuid.UUID(str(uid)), uid_count[uid])] = values
+
+        cache.set(cache_key, event_values, CALENDAR_CACHE_SECONDS)
+        return event_values
+
+    def sync(lbound=None, ubound=None):
+        """ apply the calendar to the table, writing only the calendar events whose content changed.
+        Returns counts of inserted, updated and removed rows. """
+        event_values = CalendarEvent.get_event_values(lbound, ubound)
+        existing = {(e.UID, e.recurrence_order): e for e in CalendarEvent.objects.all()}
+
+        new_events = []
+        changed_events = []
+        for key, values in event_values.items():
+            event = existing.get(key)
+            if not event:
+                new_events.append(CalendarEvent(UID=key[0], recurrence_order=key[1], summary=values['summary'], description=values['description'],
+                    start=values['start'], end=values['end'], content_hash=values['content_hash']))
+            elif event.content_hash != values['content_hash']:
+                for field in ['summary', 'description', 'start', 'end', 'content_hash']:
+                    setattr(event, field, values[field])
+                changed_events.append(event)
+        removed_ids = [e.id for key, e in existing.items() if key not in event_values]
+
+        with transaction.atomic():
+            CalendarEvent.objects.filter(id__in=removed_ids).delete()
+            CalendarEvent.objects.bulk_update(changed_events, ['summary', 'description', 'start', 'end', 'content_hash'], batch_size=500)
+            CalendarEvent.objects.bulk_create(new_events, batch_size=500, update_conflicts=True, unique_fields=['UID', 'recurrence_order'], update_fields=['summary', 'description', 'start', 'end', 'content_hash'])
+            CalendarEvent.associate_events(lbound)
+
+        return {'inserted': len(new_events), 'updated': len(changed_events), 'removed': len(removed_ids)}
+
+    def refresh(request=None):
+        """ Refresh events from ical URL, between the dates posted with the request if there are any """
         try:
-            lbound = None
-            ubound = None
-            json = {'type': 'full'}
-            if request.POST:
-                lbound = request.POST.get("lbound")
-                lbound = datetime.datetime.strptime(lbound, "%Y-%m-%d").astimezone(pytz.timezone(TIME_ZONE))
-                ubound = request.POST.get("ubound")
-                ubound = datetime.datetime.strptime(ubound, "%Y-%m-%d").astimezone(pytz.timezone(TIME_ZONE))
-                json = {'type': 'time-bounded', 'lbound': lbound.isoformat(), 'ubound': ubound.isoformat()}
-
-            events = CalendarEvent.get_event_list_from_calendar_url(CALENDAR_URL, lbound, ubound)
-            CalendarEvent.objects.all().delete()
-            Event.clear_future_unused()
-            
-            uid_count = {}
-            for e in events:
-                uid = e.get("UID")
-
-                if uid in uid_count.keys():
-                    uid_count[uid] += 1
-                else:
-                    uid_count[uid] = 1
-
-                is_process = True
-                if lbound and ubound:
-                    is_process = False
-                    if e.start.astimezone(pytz.timezone(TIME_ZONE)) >= lbound \
-                        and e.start.astimezone(pytz.timezone(TIME_ZONE)) <= ubound:
-                        is_process = True
-                if is_process:
-                    recurrence_order = uid_count[uid]
-                    event_values = {
-                        'uid': uid,
-                        'summary': e.get("SUMMARY").__str__().strip(),
-                        'description': e.get("DESCRIPTION").__str__().strip()[:2048],
-                        'start': e.start.astimezone(pytz.timezone(TIME_ZONE)),
-                        'end': e.end.astimezone(pytz.timezone(TIME_ZONE)),
-                        'recurrence_order': recurrence_order,
-                    }
-
-                    event_qs = CalendarEvent.objects.filter(UID=uid, recurrence_order=recurrence_order)
-                    
-                    if event_qs.exists():
-                        # print("update")
-                        CalendarEvent.update_event(event_qs.first(), event_values)
-
-                    else:
-                        # print("create")
-                        CalendarEvent.create(event_values, lbound)
-
-            if uid_count:
+            with SyncState.track('calendar', 'CalendarEvent') as sync_run:
+                lbound = None
+                ubound = None
+                json = {'type': 'full'}
+                if request and request.POST:
+                    lbound = request.POST.get("lbound")
+                    lbound = datetime.datetime.strptime(lbound, "%Y-%m-%d").astimezone(pytz.timezone(TIME_ZONE))
+                    ubound = request.POST.get("ubound")
+                    ubound = datetime.datetime.strptime(ubound, "%Y-%m-%d").astimezone(pytz.timezone(TIME_ZONE))
+                    json = {'type': 'time-bounded', 'lbound': lbound.isoformat(), 'ubound': ubound.isoformat()}
+
+                json.update(CalendarEvent.sync(lbound, ubound))
+                sync_run.counts = json
                 Log.new(logging_level=logging.INFO, description="Refresh Event", json=json)
+                return json
         except Exception as e:
             Log.new(logging_level=logging.ERROR, description='CalendarEvent refresh error', other_info=e)
 
 
     def refresh_event(self):
-        """ Refresh a single event """
+        """ Refresh a single event, from the last downloaded calendar if it is still cached """
         try:
-            events = CalendarEvent.get_event_list_from_calendar_url(CALENDAR_URL)
-            recurrence_order = 0
-            for e in events:
-                uid = e.get("UID")
-                if uid==str(self.UID):
-                    recurrence_order += 1
-                    if recurrence_order == self.recurrence_order:
-                        event_values = {
-                            'uid': uid,
-                            'summary': e.get("SUMMARY").__str__().strip(),
-                            'description': e.get("DESCRIPTION").__str__().strip()[:2048],
-                            'start': e.start.astimezone(pytz.timezone(TIME_ZONE)),
-                            'end': e.end.astimezone(pytz.timezone(TIME_ZONE)),
-                            'recurrence_order': recurrence_order,
-                        }
-                        CalendarEvent.update_event(self, event_values)
-                        break
+            event_values = CalendarEvent.get_event_values(use_cache=True).get((self.UID, self.recurrence_order))
+            if event_values:
+                CalendarEvent.update_event(self, event_values)
         except Exception as e:
             Log.new(logging_level=logging.ERROR, description='CalendarEvent refresh error', other_info=e)
 
@@ -587,6 +896,7 @@ class CalendarEvent(models.Model):
             event.end = event_values['end']
 
         if is_updated:
+            event.content_hash = CalendarEvent.get_content_hash(event_values)
             event.save()
             Log.new(logging_level=logging.DEBUG, description="Update Event", json=json)
 
@@ -596,9 +906,9 @@ class Event(models.Model):
     iCal files are not stable enough to use as a database. Changed to dates or times can make difficult to track changes
     that make database entries related to them point to incorrect events.
 
-    To avoid this messiness, we dump and rebuild calendar events when we refresh, and events that are in the future and have
-    no person event records. Calendar event instances that are in the future automatically create event instances to 
-    match. Calendar events can be selected as the source for an event from the admin console if needed (such as using a future event 
+    To avoid this messiness, we re-sync calendar events when we refresh, and remove events that are in the future, have
+    no person event records and no longer match a calendar event. Calendar event instances that are in the future automatically 
+    create event instances to match. Calendar events can be selected as the source for an event from the admin console if needed (such as using a future event 
     to backfill a missing historical event you might want to populate).
 
     Three consequences to understand:
@@ -650,9 +960,48 @@ class Event(models.Model):
     # override save to look for cal event changes and to update the local data accordingly unless the local data was changed
 
 
+class LogBuffer:
+    """ Holds the entries from Log.new on this thread and writes them with one bulk_create when the outermost
+    block exits (even on an exception), or sooner once LOG_BUFFER_SIZE entries or LOG_BUFFER_SECONDS have built up """
+    local = threading.local()
+
+    def __enter__(self):
+        state = LogBuffer.local
+        if not getattr(state, 'depth', 0):
+            state.entries = []
+            state.started = time.monotonic()
+            state.depth = 0
+        state.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        state = LogBuffer.local
+        state.depth -= 1
+        if not state.depth:
+            LogBuffer.flush()
+
+    def add(entry):
+        """ buffer an unsaved Log if a buffer is open on this thread. Returns false if there isn't one """
+        state = LogBuffer.local
+        if not getattr(state, 'depth', 0):
+            return False
+        state.entries.append(entry)
+        if len(state.entries) >= LOG_BUFFER_SIZE or time.monotonic() - state.started >= LOG_BUFFER_SECONDS:
+            LogBuffer.flush()
+        return True
+
+    def flush():
+        """ write the buffered entries """
+        state = LogBuffer.local
+        (entries, state.entries) = (getattr(state, 'entries', []), [])
+        state.started = time.monotonic()
+        if entries:
+            Log.objects.bulk_create(entries)
+
+
 class Log(models.Model):
     """ Log activities """
-    timestamp = models.DateTimeField(auto_now_add=True, help_text='When was the event logged?')
+    timestamp = models.DateTimeField(default=timezone.now, help_text='When was the event logged?')
     description = models.CharField(max_length=512, help_text='What happened?')
     other_info = models.TextField(max_length=4096, blank=True, null=True, help_text='What additional detail helps describe the event?')
     json = models.JSONField(blank=True, null=True, help_text="What JSON describes the event?")
@@ -682,9 +1031,16 @@ class Log(models.Model):
 
         return Log.objects.filter(filter_condition).order_by('-timestamp').first()
 
+    def buffered():
+        """ return a context manager that batches Log.new writes on this thread """
+        return LogBuffer()
+
     def new(logging_level, description, json=None, other_info=None):
-        if logging_level >= LOGGING_LEVEL:
-            Log.objects.create(description=description, json=json, other_info=other_info, logging_level=logging_level)
+        if logging_level < LOGGING_LEVEL:
+            return
+        entry = Log(description=description, json=json, other_info=other_info, logging_level=logging_level)
+        if not LogBuffer.add(entry):
+            entry.save()
 
 
 class Permission(models.Model):
@@ -699,14 +1055,106 @@ class Permission(models.Model):
             ("can_refresh_data", "Can force Docuseal and Stripe data to refresh"),
         ]    
 
+class PersonQuerySet(models.QuerySet):
+    """ Set-based versions of the per-person checks """
+
+    def with_membership_status(self):
+        """ annotate membership_status, matching check_membership_status() """
+        memberships = StripeSubscriptionItem.objects.filter(
+            subscription__customer__personstripe__person=OuterRef('pk')
+            ).filter(Q(price__product__name__icontains="membership")|Q(price__product__description__icontains="membership"))
+        # check_membership_status() reports the last non-active status when ordered by subscription name
+        inactive_status = memberships.exclude(subscription__status='active').order_by('-subscription__name').values('subscription__status')[:1]
+
+        return self.annotate(
+            membership_status=Case(
+                When(Exists(memberships), then=Coalesce(Subquery(inactive_status), Value('active'))),
+                default=None,
+                output_field=CharField(),
+                )
+            )
+
+    def with_waiver_status(self):
+        """ annotate has_waiver, matching check_waiver_status() """
+        waivers = DocusealSubmitterSubmission.objects.filter(
+            submitter__persondocuseal__person=OuterRef('pk'),
+            submission__template__folder_name='Waivers',
+            submission__status='completed'
+            )
+        return self.annotate(has_waiver=Exists(waivers))
+
+    def with_status(self):
+        """ annotate membership_status and attach recent_check_ins and todays_check_ins
+        for every person in a constant number of queries, matching check_membership_status()
+        and get_last_check_in() """
+        return self.with_membership_status().prefetch_related(
+                Prefetch('personevent_set', queryset=PersonEvent.objects.select_related('event').order_by('-check_in_time')[:1], to_attr='recent_check_ins'),
+                Prefetch('personevent_set', queryset=PersonEvent.objects.filter(event__start__date=datetime.date.today()), to_attr='todays_check_ins'),
+            )
+
+    def members(self):
+        """ people with any membership status """
+        return self.with_status().filter(membership_status__isnull=False)
+
+    def with_last_check_in(self):
+        """ annotate last_check_in_time, the time of the most recent check-in, matching get_last_check_in() """
+        last_check_in = PersonEvent.objects.filter(person=OuterRef('pk')).order_by('-check_in_time').values('check_in_time')[:1]
+        return self.annotate(last_check_in_time=Subquery(last_check_in))
+
+    def filter_roster(self, status=None, checked_in_from=None, checked_in_to=None, name_prefix=None):
+        """ narrow a with_membership_status() queryset by membership status ('member', 'lapsed', 'none' or a
+        Stripe status), by the date range of the last check-in and by the start of the name """
+        if status == 'member':
+            self = self.filter(membership_status__isnull=False)
+        elif status == 'lapsed':
+            self = self.filter(membership_status__isnull=False).exclude(membership_status='active')
+        elif status == 'none':
+            self = self.filter(membership_status__isnull=True)
+        elif status:
+            self = self.filter(membership_status=status)
+
+        if checked_in_from or checked_in_to:
+            self = self.with_last_check_in()
+            if checked_in_from:
+                self = self.filter(last_check_in_time__date__gte=checked_in_from)
+            if checked_in_to:
+                self = self.filter(last_check_in_time__date__lte=checked_in_to)
+
+        if name_prefix:
+            self = self.filter(name__istartswith=name_prefix)
+
+        return self
+
+    def page(self, after=None, page_size=100):
+        """ return up to page_size people ordered by name and id, starting after the (name, id) cursor,
+        and the cursor of the next page, or None on the last page """
+        persons = self.order_by('name', 'id')
+        if after:
+            name, person_id = after
+            persons = persons.filter(Q(name__gt=name)|Q(name=name, id__gt=person_id))
+        persons = list(persons[:page_size+1])
+
+        next_cursor = None
+        if len(persons) > page_size:
+            persons = persons[:page_size]
+            next_cursor = (persons[-1].name, persons[-1].id)
+        return persons, next_cursor
+
+
 class Person(models.Model):
     """ A dummy model for linking records together """
     name = models.CharField(max_length=128, help_text="What is the preferred name for ths person?")
     preferred_email = models.ForeignKey("subwaive.PersonEmail", related_name="+", blank=True, null=True, on_delete=models.CASCADE, help_text="What is this person's preferred email address?")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = PersonQuerySet.as_manager()
+
     class Meta:
         ordering = ('name', 'preferred_email__email',)
+        indexes = [
+            # the roster pages through people by (name, id)
+            models.Index(fields=['name', 'id'], name='person_roster'),
+        ]
 
     def __str__(self):
         return f"""{ self.name } / { self.preferred_email }"""
@@ -716,9 +1164,13 @@ class Person(models.Model):
         print("checking in...")
         if event_id:
             event = Event.objects.get(id=event_id)
+            # checking in twice to the same event returns the first check-in
+            check_in, created = PersonEvent.objects.get_or_create(person=self, event=event)
         else:
-            event = None
-        return PersonEvent.objects.create(person=self, event=event)
+            check_in = PersonEvent.objects.create(person=self, event=None)
+        PersonEvent.update_rollups([self.id], [event_id])
+        PersonEligibility.objects.filter(person=self).update(last_check_in_date=PersonEligibility.get_last_check_in_date(check_in))
+        return check_in
     
     def check_membership_status_by_person_id(person_id):
         return Person.objects.get(id=person_id).check_membership_status()
@@ -875,55 +1327,81 @@ class Person(models.Model):
     
     def get_user(self):
         """ return the name of a django User with an email associated with this Person """
-        user = None
-        for pe in PersonEmail.objects.filter(person=self):
-            user_qs = User.objects.filter(email=pe.email)
-            if user_qs.exists():
-                user = user_qs.first()
-                continue
-        return user
+        return User.objects.filter(email__in=PersonEmail.objects.filter(person=self).values('email')).first()
 
     def merge(self, merge_child_id):
         """ Merge the associations from merge_child into self and delete merge_child """
-        merge_child = Person.objects.get(id=merge_child_id)
+        Person.merge_many({merge_child_id: self.id})
+
+    def resolve_merges(merges):
+        """ follow chains of merges (a into b, b into c) so each person merges straight into the one who is kept """
+        merges = {child_id: parent_id for child_id, parent_id in merges.items() if child_id != parent_id}
+        resolved = {}
+        for child_id, parent_id in merges.items():
+            seen = {child_id}
+            while parent_id in merges:
+                if parent_id in seen:
+                    raise ValueError(f"Merges form a cycle through person { parent_id }")
+                seen.add(parent_id)
+                parent_id = merges[parent_id]
+            resolved[child_id] = parent_id
+        return resolved
+
+    def merge_many(merges):
+        """ merge many people at once. merges maps the id of each person to remove to the id of the person who takes
+        over their emails, Docuseal submitters, Stripe customers, check-ins, NFC tokens and phones.
+        Every table is updated once for the whole batch, inside one transaction. Returns the resolved merges """
+        merges = Person.resolve_merges(merges)
+        if not merges:
+            return merges
+        child_ids = list(merges)
+        parent_ids = set(merges.values())
+
+        def get_duplicate_ids(rows, field):
+            """ ids of rows whose field the kept person would then hold twice, preferring the rows they had already """
+            seen = set()
+            duplicate_ids = []
+            for row in sorted(rows.values('id', 'person_id', field), key=lambda r: (r['person_id'] in merges, r['id'])):
+                key = (merges.get(row['person_id'], row['person_id']), row[field])
+                if key in seen:
+                    duplicate_ids.append(row['id'])
+                else:
+                    seen.add(key)
+            return duplicate_ids
 
-        Log.new(logging_level=logging.INFO, description="Merge Person", json={'person_id': self.id, 'merge_child_id': merge_child_id})
-        pds = PersonDocuseal.objects.filter(person=merge_child)
-        for pd in pds:
-            pd.person = self
-            pd.save()
+        def moved_person_id():
+            return Case(*[When(person_id=child_id, then=Value(parent_id)) for child_id, parent_id in merges.items()], output_field=IntegerField())
 
-        pes = PersonEmail.objects.filter(person=merge_child)
-        for pe in pes:
-            pe.person = self
-            pe.save()
+        with transaction.atomic():
+            Log.new(logging_level=logging.INFO, description="Merge Person", json={'merges': [{'person_id': parent_id, 'merge_child_id': child_id} for child_id, parent_id in merges.items()]})
+            affected = PersonEvent.objects.filter(person_id__in=child_ids + list(parent_ids))
+            event_ids = list(affected.filter(person_id__in=child_ids).values_list('event', flat=True))
 
-        pss = PersonStripe.objects.filter(person=merge_child)
-        for ps in pss:
-            ps.person = self
-            ps.save()
+            # emails are deleted below, which would cascade to a person who prefers them
+            Person.objects.filter(id__in=child_ids).update(preferred_email=None)
+            PersonEvent.objects.filter(id__in=get_duplicate_ids(affected.filter(event__isnull=False), 'event_id')).delete()
+            PersonEmail.objects.filter(id__in=get_duplicate_ids(PersonEmail.objects.filter(person_id__in=child_ids + list(parent_ids)), 'email')).delete()
 
-        pes = PersonEvent.objects.filter(person=merge_child)
-        for pe in pes:
-            pe.person = self
-            pe.save()
+            for model in [PersonDocuseal, PersonEmail, PersonEvent, PersonStripe, NFC, Phone]:
+                model.objects.filter(person_id__in=child_ids).update(person_id=moved_person_id())
+            nfc_hot_set.invalidate()
 
-        merge_child.delete()
+            Person.objects.filter(id__in=child_ids).delete()
+            PersonEvent.update_rollups(list(parent_ids), event_ids)
+            parents = Person.objects.filter(id__in=parent_ids)
+            PersonEligibility.rebuild_persons(parents)
+            PersonSearchToken.rebuild_persons(parents)
 
-    def search(search_term):
-        """ search for a Person """
-        emails = PersonEmail.objects.filter(Q(person__name__icontains=search_term)|Q(email__icontains=search_term))
+        return merges
 
-        field_submissions = DocusealFieldStore.objects.filter(value__icontains=search_term).values_list('submission')
-        submitters = DocusealSubmitterSubmission.objects.filter(submission__in=field_submissions).values_list('submitter')
-        persons = PersonDocuseal.objects.filter(submitter__in=submitters)
-        
-        person_id_list = set(
-            [pe.person.id for pe in emails]
-            + [s.person.id for s in persons]
-            )
+    def search(search_term):
+        """ search for a Person by the start of words in their name, emails and Docuseal fields, best PERSON_SEARCH_LIMIT matches first """
+        ranked = PersonSearchToken.search(search_term)
+        if ranked is None:
+            return Person.objects.none()
+        rank = Subquery(ranked.filter(person=OuterRef('pk')).values('score')[:1])
 
-        return Person.objects.filter(id__in=person_id_list)
+        return Person.objects.filter(id__in=Subquery(ranked.values('person')[:PERSON_SEARCH_LIMIT])).annotate(search_rank=rank).order_by('-search_rank', 'id')
 
 
 class PersonDocuseal(models.Model):
@@ -936,12 +1414,128 @@ class PersonDocuseal(models.Model):
 
     def __str__(self):
         return f"""{ self.person } / { self.submitter }"""
-    
+
+
+class PersonEligibility(models.Model):
+    """ A denormalized snapshot of the checks made when a person checks in.\n
+    Computing these live takes a dozen queries, which is too slow for the NFC terminal,
+    so they are rebuilt whenever webhooks or refreshes touch the underlying records. """
+    person = models.OneToOneField("subwaive.Person", on_delete=models.CASCADE, related_name="eligibility", help_text="Who is this snapshot for?")
+    has_waiver = models.BooleanField(default=False, help_text="Has this person signed a waiver?")
+    membership_status = models.CharField(max_length=64, blank=True, null=True, help_text="What is the status of this person's membership?")
+    is_staff = models.BooleanField(default=False, help_text="Is this person a staff user?")
+    event_dates = models.JSONField(default=list, blank=True, help_text="What event dates has this person purchased?")
+    last_check_in_date = models.DateField(blank=True, null=True, help_text="What day did this person last check-in?")
+    updated_at = models.DateTimeField(auto_now=True, help_text="When was this snapshot last rebuilt?")
+
+    class Meta:
+        ordering = ('person',)
+
+    def __str__(self):
+        return f"""{ self.person } / { self.membership_status } / { self.updated_at }"""
+
+    def get_or_rebuild(person):
+        """ return the snapshot for a person, building it if it does not exist yet """
+        try:
+            return person.eligibility
+        except PersonEligibility.DoesNotExist:
+            return PersonEligibility.rebuild(person)
+
+    def get_check_in_date(check_in_time, event_start):
+        """ return the date a check-in counts for: its event's, or the local day it was made """
+        if event_start:
+            return event_start.date()
+        if check_in_time:
+            return check_in_time.astimezone(tz=pytz.timezone(TIME_ZONE)).date()
+        return None
+
+    def get_last_check_in_date(last_check_in):
+        """ return the date a check-in counts for """
+        if not last_check_in:
+            return None
+        return PersonEligibility.get_check_in_date(last_check_in.check_in_time, last_check_in.event.start if last_check_in.event else None)
+
+    def rebuild(person):
+        """ recompute the snapshot for a person """
+        return PersonEligibility.rebuild_persons([person])[0]
+
+    def rebuild_persons(persons):
+        """ recompute the snapshots for a queryset or list of people and return them. Each page of
+        ELIGIBILITY_PAGE_SIZE people takes three queries, matching the per-person checks """
+        if isinstance(persons, models.QuerySet):
+            person_ids = list(dict.fromkeys(persons.order_by().values_list('id', flat=True)))
+        else:
+            person_ids = list(dict.fromkeys(person.id for person in persons))
+
+        snapshots = []
+        for i in range(0, len(person_ids), ELIGIBILITY_PAGE_SIZE):
+            page = person_ids[i:i+ELIGIBILITY_PAGE_SIZE]
+            # get_user() takes the first user sharing any of the person's emails
+            staff = User.objects.filter(email__in=PersonEmail.objects.filter(person=OuterRef(OuterRef('pk'))).values('email')).order_by('pk').values('is_staff')[:1]
+            last_check_in = PersonEvent.objects.filter(person=OuterRef('pk')).order_by('-check_in_time')
+            rows = Person.objects.filter(id__in=page).order_by().with_membership_status().with_waiver_status().annotate(
+                is_staff=Subquery(staff),
+                last_check_in_time=Subquery(last_check_in.values('check_in_time')[:1]),
+                last_check_in_event_start=Subquery(last_check_in.values('event__start')[:1]),
+                ).values_list('id', 'has_waiver', 'membership_status', 'is_staff', 'last_check_in_time', 'last_check_in_event_start')
+
+            # get_events() lists the date of each payment link with a price that the person paid through
+            event_dates = {}
+            for person_id, event_date in StripeOneTimePayment.objects.filter(
+                    customer__personstripe__person__in=page, payment_link__date__isnull=False, payment_link__stripepaymentlinkprice__isnull=False
+                    ).order_by().values_list('customer__personstripe__person', 'payment_link__date').distinct():
+                event_dates.setdefault(person_id, set()).add(event_date.isoformat())
+
+            page_snapshots = [
+                PersonEligibility(
+                    person_id=person_id,
+                    has_waiver=has_waiver,
+                    membership_status=membership_status,
+                    is_staff=bool(is_staff),
+                    event_dates=sorted(event_dates.get(person_id, [])),
+                    last_check_in_date=PersonEligibility.get_check_in_date(check_in_time, event_start),
+                    )
+                for person_id, has_waiver, membership_status, is_staff, check_in_time, event_start in rows
+            ]
+            PersonEligibility.objects.bulk_create(page_snapshots, update_conflicts=True, unique_fields=['person'], update_fields=['has_waiver', 'membership_status', 'is_staff', 'event_dates', 'last_check_in_date', 'updated_at'])
+            snapshots.extend(page_snapshots)
+
+        if person_ids:
+            Log.new(logging_level=logging.DEBUG, description="Rebuild PersonEligibility", json={'persons': len(person_ids)})
+        return snapshots
+
+    def get_person_ids(lookups, ids):
+        """ return the ids of the people reached from the rows with these ids through any of the Person lookups """
+        ids = list(ids)
+        person_ids = set()
+        if ids:
+            for lookup in lookups:
+                person_ids.update(Person.objects.filter(**{f"{ lookup }__in": ids}).values_list('id', flat=True))
+        return person_ids
+
+    def rebuild_all():
+        """ recompute the snapshot for everyone. Refreshes rebuild only the people they touch, so this is only run on request """
+        Log.new(logging_level=logging.INFO, description="Refresh PersonEligibility")
+        PersonEligibility.rebuild_persons(Person.objects.all())
+
+    def has_event_on(self, date):
+        """ return true if the person purchased an event on a date """
+        return date.isoformat() in self.event_dates
+
+
+@receiver([post_save, post_delete], sender=User)
+def rebuild_staff_eligibility(sender, instance, update_fields=None, **kwargs):
+    """ the staff flag comes from the Django User sharing a person's email, so adding, changing or removing a user
+    rebuilds the people with its email and anyone whose snapshot still says they are staff. Logins only save last_login and are skipped """
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    PersonEligibility.rebuild_persons(Person.objects.filter(Q(personemail__email=instance.email) | Q(eligibility__is_staff=True)).distinct())
+
 
 class PersonEmail(models.Model):
     """ A list of email addresses associated with a Person """
     person = models.ForeignKey("subwaive.Person", on_delete=models.CASCADE, help_text="Who is the person associated with this email address?")
-    email = models.EmailField(help_text="What is this person's email address?")
+    email = models.EmailField(db_index=True, help_text="What is this person's email address?")
 
     class Meta:
         ordering = ('person', 'email',)
@@ -951,26 +1545,27 @@ class PersonEmail(models.Model):
 
     def unmerge(self):
         """ Break linkages between self and an email address (including Stripe and Docuseal accounts)"""
-        # print('unmerge')
         email = self.email
-        # print("pre-delete",email)
-        person_id = self.person.id
-        # print(person_id)
+        person_id = self.person_id
 
-        Log.new(logging_level=logging.INFO, description="Unmerge Person", json={'person_id': person_id, 'email': email})
+        with transaction.atomic():
+            Log.new(logging_level=logging.INFO, description="Unmerge Person", json={'person_id': person_id, 'email': email})
 
-        PersonStripe.objects.filter(person__id=person_id).delete()
-        PersonDocuseal.objects.filter(person__id=person_id).delete()
-        self.delete()
-        # print("post-delete",email)
+            # every account of the person is associated again, so those under their other emails return to them
+            submitters = list(DocusealSubmitter.objects.filter(Q(persondocuseal__person_id=person_id)|Q(email=email)).distinct())
+            customers = list(StripeCustomer.objects.filter(Q(personstripe__person_id=person_id)|Q(email=email)).distinct())
+            PersonStripe.objects.filter(person_id=person_id).delete()
+            PersonDocuseal.objects.filter(person_id=person_id).delete()
+            # deleting a preferred email would cascade to the person, so they prefer one of their others
+            Person.objects.filter(id=person_id, preferred_email=self).update(preferred_email=Subquery(PersonEmail.objects.filter(person_id=person_id).exclude(id=self.id).values('id')[:1]))
+            self.delete()
 
-        for ds in DocusealSubmitter.objects.filter(email=email):
-            # print(ds)
-            ds._auto_associate()
+            DocusealSubmitter.bulk_associate(submitters)
+            StripeCustomer.bulk_associate(customers)
 
-        for sc in StripeCustomer.objects.filter(email=email):
-            # print(sc)
-            sc._auto_associate()
+            affected_persons = Person.objects.filter(Q(id=person_id)|Q(personemail__email=email)).distinct()
+            PersonEligibility.rebuild_persons(affected_persons)
+            PersonSearchToken.rebuild_persons(affected_persons)
 
 
 class PersonEvent(models.Model):
@@ -981,6 +1576,10 @@ class PersonEvent(models.Model):
 
     class Meta:
         ordering = ('-check_in_time', 'person', 'event',)
+        constraints = [
+            # check-ins without an event are not limited, since NULLs are distinct
+            models.UniqueConstraint(fields=['person', 'event'], name='unique_person_event'),
+        ]
 
     def __str__(self):
         return f"""{ self.check_in_time } / { self.person } / { self.event }"""
@@ -992,7 +1591,227 @@ class PersonEvent(models.Model):
         if last_check_in.exists():
                 is_checked_in = True
         return is_checked_in
-    
+
+    def count_by_weekday(cutoff_date, excluded_template_names=()):
+        """ count check-ins to events starting on or after cutoff_date per person and local day-of-week (0 is Monday)
+        in one grouped query, leaving out anyone who signed a Docuseal template whose name contains an excluded name """
+        check_ins = PersonEvent.objects.filter(event__start__date__gte=cutoff_date)
+
+        if excluded_template_names:
+            excluded_names = Q()
+            for name in excluded_template_names:
+                excluded_names |= Q(name__contains=name)
+            excluded_templates = DocusealTemplate.objects.filter(excluded_names).filter(
+                docusealsubmission__docusealsubmittersubmission__submitter__persondocuseal__person=OuterRef('person'))
+            check_ins = check_ins.exclude(Exists(excluded_templates))
+
+        counts = (check_ins
+            .annotate(weekday=ExtractIsoWeekDay('event__start') - 1)
+            .values('person', 'person__name', 'weekday')
+            .annotate(count=Count('id'))
+            .order_by('person__name', 'person', 'weekday'))
+        return list(counts)
+
+    def update_rollups(person_ids, event_ids):
+        """ recount the attendance rollups touched by check-ins of these people to these events """
+        EventAttendance.refresh(event_ids)
+        PersonWeekAttendance.refresh(person_ids)
+
+    def rebuild_rollups():
+        """ rebuild the attendance rollups from every check-in and record today's membership counts """
+        EventAttendance.refresh()
+        PersonWeekAttendance.refresh()
+        return DailyMembership.record()
+
+
+class EventAttendance(models.Model):
+    """ Check-ins per event, rolled up from PersonEvent so trend reports do not rescan every check-in.\n
+    Kept current on check-in and rebuilt nightly by `manage.py rollup_attendance`. """
+    event = models.OneToOneField("subwaive.Event", on_delete=models.CASCADE, related_name="attendance", help_text="Which event are these check-ins for?")
+    date = models.DateField(db_index=True, help_text="What local date did the event start?")
+    check_ins = models.IntegerField(default=0, help_text="How many check-ins did the event have?")
+    people = models.IntegerField(default=0, help_text="How many different people checked in?")
+
+    class Meta:
+        ordering = ('-date', 'event',)
+
+    def __str__(self):
+        return f"""{ self.date } / { self.event } / { self.check_ins }"""
+
+    def refresh(event_ids=None):
+        """ recount the check-ins of some events, or of every event when event_ids is None """
+        check_ins = PersonEvent.objects.filter(event__isnull=False)
+        attendance = EventAttendance.objects.all()
+        if event_ids is not None:
+            event_ids = [i for i in set(event_ids) if i]
+            check_ins = check_ins.filter(event__in=event_ids)
+            attendance = attendance.filter(event__in=event_ids)
+
+        counts = check_ins.values('event', 'event__start').annotate(check_ins=Count('id'), people=Count('person', distinct=True)).order_by()
+        with transaction.atomic():
+            attendance.delete()
+            EventAttendance.objects.bulk_create([
+                EventAttendance(
+                    event_id=c['event'],
+                    date=c['event__start'].astimezone(pytz.timezone(TIME_ZONE)).date(),
+                    check_ins=c['check_ins'],
+                    people=c['people'],
+                    ) for c in counts
+                ], batch_size=500)
+
+
+class PersonWeekAttendance(models.Model):
+    """ Check-ins per person per week, rolled up from PersonEvent.\n
+    Kept current on check-in and rebuilt nightly by `manage.py rollup_attendance`. """
+    person = models.ForeignKey("subwaive.Person", on_delete=models.CASCADE, related_name="week_attendance", help_text="Who checked in?")
+    week = models.DateField(help_text="What Monday does the week start on?")
+    check_ins = models.IntegerField(default=0, help_text="How many times did they check in that week?")
+
+    class Meta:
+        ordering = ('-week', 'person',)
+        constraints = [
+            models.UniqueConstraint(fields=['person', 'week'], name='unique_person_week_attendance'),
+        ]
+        indexes = [
+            models.Index(fields=['week'], name='person_week_attendance_week'),
+        ]
+
+    def __str__(self):
+        return f"""{ self.week } / { self.person } / { self.check_ins }"""
+
+    def refresh(person_ids=None):
+        """ recount the weekly check-ins of some people, or of everyone when person_ids is None.
+        Check-ins without an event count for the week they were logged in. """
+        check_ins = PersonEvent.objects.all()
+        attendance = PersonWeekAttendance.objects.all()
+        if person_ids is not None:
+            person_ids = list(set(person_ids))
+            check_ins = check_ins.filter(person__in=person_ids)
+            attendance = attendance.filter(person__in=person_ids)
+
+        counts = (check_ins
+            .annotate(week=TruncWeek(Coalesce('event__start', 'check_in_time'), output_field=models.DateField()))
+            .values('person', 'week')
+            .annotate(check_ins=Count('id'))
+            .order_by())
+        with transaction.atomic():
+            attendance.delete()
+            PersonWeekAttendance.objects.bulk_create([
+                PersonWeekAttendance(person_id=c['person'], week=c['week'], check_ins=c['check_ins']) for c in counts
+                ], batch_size=500)
+
+
+class DailyMembership(models.Model):
+    """ A nightly count of memberships by status.\n
+    Membership history is not kept anywhere else, so past days cannot be rebuilt, only recorded as they happen. """
+    date = models.DateField(unique=True, help_text="What day was counted?")
+    active_members = models.IntegerField(default=0, help_text="How many people had an active membership?")
+    inactive_members = models.IntegerField(default=0, help_text="How many people had a membership that was not active?")
+
+    class Meta:
+        ordering = ('-date',)
+
+    def __str__(self):
+        return f"""{ self.date } / { self.active_members } / { self.inactive_members }"""
+
+    def record(date=None):
+        """ count today's (or date's) memberships, replacing an earlier count for the same day """
+        counts = Person.objects.with_membership_status().aggregate(
+            active_members=Count('id', filter=Q(membership_status='active')),
+            inactive_members=Count('id', filter=Q(membership_status__isnull=False) & ~Q(membership_status='active')),
+            )
+        daily_membership, created = DailyMembership.objects.update_or_create(date=date or datetime.date.today(), defaults=counts)
+        return daily_membership
+
+
+class PersonSearchToken(models.Model):
+    """ A normalized word from a person's name, email addresses or Docuseal field values.\n
+    Searching these by prefix uses an index, where icontains on the source tables scans every row. """
+    WEIGHT_FIELD = 1
+    WEIGHT_EMAIL = 2
+    WEIGHT_NAME = 3
+
+    person = models.ForeignKey("subwaive.Person", on_delete=models.CASCADE, related_name="search_tokens", help_text="Who does this token belong to?")
+    token = models.CharField(max_length=255, db_index=True, help_text="What is the lowercase, accent-free word?")
+    weight = models.IntegerField(help_text="How strongly does a match on this token rank the person?")
+
+    class Meta:
+        ordering = ('person', 'token',)
+        constraints = [
+            models.UniqueConstraint(fields=['person', 'token'], name='unique_person_search_token'),
+        ]
+
+    def __str__(self):
+        return f"""{ self.person } / { self.token } / { self.weight }"""
+
+    def normalize(text):
+        """ lowercase text and strip accents """
+        text = unicodedata.normalize('NFKD', text or '')
+        return ''.join(c for c in text if not unicodedata.combining(c)).lower().strip()
+
+    def tokenize(text):
+        """ split text into normalized words """
+        return [t[:255] for t in re.findall(r'\w+', PersonSearchToken.normalize(text))]
+
+    def rebuild_persons(persons):
+        """ recompute the tokens for each person in an iterable """
+        person_ids = [p.id for p in persons]
+        weights = {person_id: {} for person_id in person_ids}
+
+        def add(person_id, text, weight):
+            for token in PersonSearchToken.tokenize(text):
+                weights[person_id][token] = max(weight, weights[person_id].get(token, 0))
+
+        for person_id, name in Person.objects.filter(id__in=person_ids).values_list('id', 'name'):
+            add(person_id, name, PersonSearchToken.WEIGHT_NAME)
+        for person_id, email in PersonEmail.objects.filter(person__in=person_ids).values_list('person_id', 'email'):
+            add(person_id, email, PersonSearchToken.WEIGHT_EMAIL)
+            weights[person_id][PersonSearchToken.normalize(email)[:255]] = PersonSearchToken.WEIGHT_EMAIL
+        field_values = DocusealFieldStore.objects.filter(submission__docusealsubmittersubmission__submitter__persondocuseal__person__in=person_ids)
+        for person_id, value in field_values.values_list('submission__docusealsubmittersubmission__submitter__persondocuseal__person', 'value'):
+            add(person_id, value, PersonSearchToken.WEIGHT_FIELD)
+
+        with transaction.atomic():
+            PersonSearchToken.objects.filter(person__in=person_ids).delete()
+            PersonSearchToken.objects.bulk_create([
+                PersonSearchToken(person_id=person_id, token=token, weight=weight)
+                for person_id, tokens in weights.items() for token, weight in tokens.items()
+            ], batch_size=1000)
+
+    def rebuild(person):
+        """ recompute the tokens for a person """
+        PersonSearchToken.rebuild_persons([person])
+
+    def rebuild_all():
+        """ recompute the tokens for everyone """
+        Log.new(logging_level=logging.INFO, description="Refresh PersonSearchToken")
+        persons = list(Person.objects.only('id'))
+        for i in range(0, len(persons), DOCUSEAL_PAGE_SIZE):
+            PersonSearchToken.rebuild_persons(persons[i:i+DOCUSEAL_PAGE_SIZE])
+
+    def search(search_term):
+        """ return a query of the person and score of people with a token starting with every word of the search term, best match first, or None without any words """
+        terms = list(dict.fromkeys(PersonSearchToken.tokenize(search_term)))
+        if not terms:
+            return None
+        whole = PersonSearchToken.normalize(search_term)
+
+        # each word scores its best token: double the weight for a whole word, the weight for a prefix
+        query = Q()
+        matched = Value(0)
+        score = Max(Case(When(token=whole, then=F('weight') * 2), default=Value(0)))
+        for term in terms:
+            query |= Q(token__startswith=term)
+            matched = matched + Max(Case(When(token__startswith=term, then=Value(1)), default=Value(0)))
+            score = score + Max(Case(When(token=term, then=F('weight') * 2), When(token__startswith=term, then='weight'), default=Value(0)))
+
+        ranked = (PersonSearchToken.objects.filter(query)
+            .values('person')
+            .annotate(matched=ExpressionWrapper(matched, output_field=IntegerField()), score=ExpressionWrapper(score, output_field=IntegerField()))
+            .filter(matched=len(terms))
+            .order_by('-score', 'person'))
+        return ranked
+
 
 class PersonStripe(models.Model):
     """ A map between Person and StripeCustomer """
@@ -1010,17 +1829,17 @@ class Phone(models.Model):
     """ A phone number for a person """
     phone_number = models.CharField(max_length=10, help_text="What is your phone number?")
     person = models.ForeignKey("subwaive.Person", on_delete=models.CASCADE, blank=True, null=True, help_text="Who is the person associated with this phone number?")
-    registration_id = models.CharField(max_length=32, help_text="What is the URL secret for registering this phone number?")
-    activation_id = models.CharField(max_length=32, help_text="What is the URL secret used to activate this phone number?")
+    registration_id = models.CharField(max_length=32, unique=True, help_text="What is the URL secret for registering this phone number?")
+    activation_id = models.CharField(max_length=32, unique=True, help_text="What is the URL secret used to activate this phone number?")
     is_active = models.BooleanField(default=False, help_text="Has this phone number been activated?")
 
 
 class NFC(models.Model):
     """ An NFC token for a person """
-    uid = models.CharField(max_length=32, help_text="UID identifying this NFC")
+    uid = models.CharField(max_length=32, unique=True, help_text="UID identifying this NFC")
     person = models.ForeignKey("subwaive.Person", on_delete=models.CASCADE, blank=True, null=True, help_text="Person associated with this NFC token?")
-    registration_id = models.CharField(max_length=32, help_text="What is the URL secret used to register this NFC token?")
-    activation_id = models.CharField(max_length=32, help_text="What is the URL secret used to activate this NFC token?")
+    registration_id = models.CharField(max_length=32, unique=True, help_text="What is the URL secret used to register this NFC token?")
+    activation_id = models.CharField(max_length=32, unique=True, help_text="What is the URL secret used to activate this NFC token?")
     is_active = models.BooleanField(default=False, help_text="Has this NFC token been activated?")
 
     class Meta:
@@ -1028,6 +1847,20 @@ class NFC(models.Model):
 
     def __str__(self):
         return f"""{ self.person } / { self.uid } / { self.is_active }"""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """ remember what the hot set held for a loaded NFC, so saving it only invalidates the hot set if that changes """
+        nfc = super().from_db(db, field_names, values)
+        if {'uid', 'person_id', 'is_active'} <= set(field_names):
+            nfc._loaded_hot_key = nfc.get_hot_key()
+        return nfc
+
+    def get_hot_key(self):
+        """ return what the hot set holds for this NFC: its UID and person while it is active and registered, else None """
+        if self.is_active and self.person_id:
+            return (self.uid, self.person_id)
+        return None
     
 
 class NFCTerminal(models.Model):
@@ -1043,6 +1876,107 @@ class NFCTerminal(models.Model):
         return f"""{ self.location } / { self.token }"""
 
 
+class CacheVersion(models.Model):
+    """ A counter bumped whenever a process-local cache is out of date, so every worker reloads its copy """
+    name = models.CharField(max_length=64, unique=True, help_text="Which cache does this counter belong to?")
+    version = models.BigIntegerField(default=0, help_text="How many times has this cache been invalidated?")
+
+    class Meta:
+        ordering = ('name',)
+
+    def __str__(self):
+        return f"""{ self.name } / { self.version }"""
+
+    def get(name):
+        """ return the current version of a cache """
+        return CacheVersion.objects.filter(name=name).values_list('version', flat=True).first() or 0
+
+    def bump(name):
+        """ move a cache on to a new version """
+        if not CacheVersion.objects.filter(name=name).update(version=F('version') + 1):
+            version, created = CacheVersion.objects.get_or_create(name=name, defaults={'version': 1})
+            if not created:
+                CacheVersion.objects.filter(name=name).update(version=F('version') + 1)
+
+
+class NFCHotSet:
+    """ A process-local copy of the terminal tokens and the active NFC UIDs with their people, so a tap by a known
+    card is authorized without a lookup. Changing the active NFCs or any terminal bumps a CacheVersion, which each
+    process compares with its copy at most every NFC_CACHE_CHECK_SECONDS (and straight away in the process that made the change) """
+    name = 'nfc'
+
+    def __init__(self, check_seconds=NFC_CACHE_CHECK_SECONDS):
+        self.check_seconds = check_seconds
+        self.lock = threading.Lock()
+        self.version = None
+        self.checked_at = 0
+        self.terminals = {}
+        self.person_ids = {}
+
+    def load(self):
+        """ read every terminal and active NFC. The version is read first, so a change made meanwhile is picked up by the next check """
+        version = CacheVersion.get(self.name)
+        terminals = {t.token: t for t in NFCTerminal.objects.all()}
+        person_ids = dict(NFC.objects.filter(is_active=True, person__isnull=False).values_list('uid', 'person_id'))
+        with self.lock:
+            self.version = version
+            self.checked_at = time.monotonic()
+            self.terminals = terminals
+            self.person_ids = person_ids
+
+    def check(self):
+        """ reload if this copy was never loaded or another process changed NFCs or terminals since it was """
+        if self.version is not None and time.monotonic() - self.checked_at < self.check_seconds:
+            return
+        if self.version is None or CacheVersion.get(self.name) != self.version:
+            self.load()
+        else:
+            self.checked_at = time.monotonic()
+
+    def get_terminal(self, token):
+        """ return the terminal with a token, or None """
+        self.check()
+        return self.terminals.get(token)
+
+    def get_person_id(self, uid):
+        """ return the id of the person an active NFC belongs to, or None if it is unknown, inactive or unregistered """
+        self.check()
+        return self.person_ids.get(uid)
+
+    def invalidate(self):
+        """ make every process reload, this one on its next lookup """
+        CacheVersion.bump(self.name)
+        with self.lock:
+            self.version = None
+
+nfc_hot_set = NFCHotSet()
+
+
+@receiver([post_save, post_delete], sender=NFCTerminal)
+def invalidate_nfc_hot_set(sender, **kwargs):
+    """ changes to terminals through the ORM reach the hot set; update() calls invalidate it themselves """
+    nfc_hot_set.invalidate()
+
+@receiver(post_save, sender=NFC)
+def invalidate_nfc_hot_set_on_save(sender, instance, created, **kwargs):
+    """ only a save that adds, moves or drops an active card reaches the hot set, so taps by unknown cards,
+    which create unregistered NFCs, leave every process's copy alone. An NFC whose earlier state is unknown always invalidates """
+    hot_key = instance.get_hot_key()
+    if created:
+        is_changed = hot_key is not None
+    else:
+        is_changed = not hasattr(instance, '_loaded_hot_key') or instance._loaded_hot_key != hot_key
+    if is_changed:
+        nfc_hot_set.invalidate()
+    instance._loaded_hot_key = hot_key
+
+@receiver(post_delete, sender=NFC)
+def invalidate_nfc_hot_set_on_delete(sender, instance, **kwargs):
+    """ deleting an inactive or unregistered NFC leaves the hot set alone """
+    if getattr(instance, '_loaded_hot_key', instance.get_hot_key()) is not None:
+        nfc_hot_set.invalidate()
+
+
 class QRCategory(models.Model):
     """ Categories for organizing QR codes """
     name = models.CharField(max_length=64, help_text="What is the name of the QR code category?")
@@ -1073,9 +2007,9 @@ class QRCustom(models.Model):
 
 class StripeCustomer(models.Model):
     """ A Stripe Customer """
-    stripe_id = models.CharField(max_length=64, blank=True, null=True, help_text="What is the Stripe ID of this customer?")
+    stripe_id = models.CharField(max_length=64, blank=True, null=True, unique=True, help_text="What is the Stripe ID of this customer?")
     name = models.CharField(max_length=128, help_text="What is the name of this customer?")
-    email = models.EmailField(help_text="What is the email address of this customer?")
+    email = models.EmailField(db_index=True, help_text="What is the email address of this customer?")
 
     class Meta:
         ordering = ('email', 'name',)
@@ -1098,24 +2032,61 @@ class StripeCustomer(models.Model):
                         Log.new(logging_level=logging.INFO, description="Auto-name by Stripe", json={'old': person.name, 'new': self.name})
                         person.name=self.name
                         person.save()
+                        PersonSearchToken.rebuild(person)
             else:
                 person = Person.objects.create(name=self.name)
                 email = PersonEmail.objects.create(person=person, email=self.email)
                 person.preferred_email = email
                 person.save()
-
-    def create_and_or_return(stripe_id=None,email=None): #!!! prefer stripe_id, fallback email, if email then no stripe_id
-        """ return a record if it exists, else create and return it """
+                PersonSearchToken.rebuild(person)
+
+    def bulk_associate(customers):
+        """ _auto_associate many customers at once, creating any missing people in bulk """
+        linked = set(PersonStripe.objects.filter(customer__in=customers).values_list('customer_id', flat=True))
+        customers = [c for c in customers if c.id not in linked]
+
+        person_id_by_email = {}
+        for email, person_id in PersonEmail.objects.filter(email__in=set(c.email for c in customers)).order_by('-person_id').values_list('email', 'person_id'):
+            person_id_by_email[email] = person_id
+
+        # people still named after an email address take the customer's name
+        names = {}
+        for c in customers:
+            if c.email in person_id_by_email and "@" not in c.name and "." not in c.name:
+                names.setdefault(person_id_by_email[c.email], c.name)
+        renamed = [p for p in Person.objects.filter(id__in=names) if "@" in p.name and "." in p.name]
+        for person in renamed:
+            Log.new(logging_level=logging.INFO, description="Auto-name by Stripe", json={'old': person.name, 'new': names[person.id]})
+            person.name = names[person.id]
+        Person.objects.bulk_update(renamed, ['name'])
+
+        new_names = {}
+        for c in customers:
+            if c.email not in person_id_by_email:
+                new_names.setdefault(c.email, c.name)
+        new_emails = sorted(new_names)
+        persons = Person.objects.bulk_create([Person(name=new_names[email]) for email in new_emails])
+        emails = PersonEmail.objects.bulk_create([PersonEmail(person=person, email=email) for (person, email) in zip(persons, new_emails)])
+        for (person, email) in zip(persons, emails):
+            person.preferred_email = email
+            person_id_by_email[email.email] = person.id
+        Person.objects.bulk_update(persons, ['preferred_email'])
+
+        PersonStripe.objects.bulk_create([PersonStripe(person_id=person_id_by_email[c.email], customer=c) for c in customers])
+        PersonSearchToken.rebuild_persons(Person.objects.filter(id__in=set(person_id_by_email[c.email] for c in customers)))
+
+    def create_and_or_return(stripe_id=None,email=None,api_record=None): #!!! prefer stripe_id, fallback email, if email then no stripe_id
+        """ return a record if it exists, else create and return it. api_record saves the retrieve when the caller already has it """
         if stripe_id:
             json = {'stripe_id': stripe_id}
 
-            customer_qs = StripeCustomer.objects.filter(stripe_id=stripe_id)
-            if customer_qs.exists():
-                customer = customer_qs.first()
-            else:
-                api_record = stripe.Customer.retrieve(stripe_id)
-                customer = StripeCustomer.objects.create(stripe_id=stripe_id, name=api_record.name, email=api_record.email)
-                Log.new(logging_level=logging.DEBUG, description="Create StripeCustomer", json=json)
+            customer = StripeCustomer.objects.filter(stripe_id=stripe_id).first()
+            if not customer:
+                if api_record is None:
+                    api_record = stripe_cache.get('customer', stripe_id, lambda: stripe.Customer.retrieve(stripe_id))
+                customer, created = StripeCustomer.objects.get_or_create(stripe_id=stripe_id, defaults={'name': api_record.name, 'email': api_record.email})
+                if created:
+                    Log.new(logging_level=logging.DEBUG, description="Create StripeCustomer", json=json)
         elif email:
             json = {'stripe_id': email}
 
@@ -1134,20 +2105,17 @@ class StripeCustomer(models.Model):
         """ updates an existing record, otherwise creates one """
         json = {'stripe_id': stripe_id}
 
-        customer_qs = StripeCustomer.objects.filter(stripe_id=stripe_id)
-        api_record = stripe.Customer.retrieve(stripe_id)
+        api_record = stripe_cache.get('customer', stripe_id, lambda: stripe.Customer.retrieve(stripe_id))
+        customer, created = StripeCustomer.objects.update_or_create(stripe_id=stripe_id, defaults={'name': api_record.name, 'email': api_record.email})
+        Log.new(logging_level=logging.DEBUG, description="Create StripeCustomer" if created else "Update StripeCustomer", json=json)
 
-        if customer_qs.exists():
-            customer = customer_qs.first()
-            customer.name = api_record.name
-            customer.email = api_record.email
-            customer.save()
-            Log.new(logging_level=logging.DEBUG, description="Update StripeCustomer", json=json)
-        else:
-            StripeCustomer.objects.create(stripe_id=stripe_id, name=api_record.name, email=api_record.email)
-            Log.new(logging_level=logging.DEBUG, description="Create StripeCustomer", json=json)
+        return customer
 
 
+    def get_persons(self):
+        """ return the people associated with this customer """
+        return Person.objects.filter(personstripe__customer=self).distinct()
+
     def get_url(self):
         """ URL for a hyperlink """
         return f"{ STRIPE_WWW_ENDPOINT }/customers/{ self.stripe_id }"
@@ -1156,28 +2124,36 @@ class StripeCustomer(models.Model):
         sc = StripeCustomer.objects.create(stripe_id=stripe_id, name=name, email=email)
         Log.new(logging_level=logging.DEBUG, description="Create StripeCustomer", json={'stripe_id': stripe_id})
         sc._auto_associate()
+        return sc
 
     def search(name, email):
         """ search for a Stripe customer from the API """
         pass
 
+    def dict_from_api(api_record):
+        """ returns a dict of field values from an API record """
+        email = (api_record['email'] or '')[:128]
+        return {'stripe_id': api_record['id'], 'name': (api_record['name'] or email)[:128], 'email': email}
+
     def refresh(new_only=False):
-        """ clear out existing records and repopulate them from the API """
+        """ reconcile existing records with the API """
         try:
-            Log.new(logging_level=logging.INFO, description="Refresh StripeCustomer")
-            StripeCustomer.objects.all().delete()
-            for customer in stripe.Customer.list().auto_paging_iter():
-                stripe_id = customer['id']
-                name = customer['name'][:128]
-                email = customer['email'][:128]
-                StripeCustomer.new(stripe_id=stripe_id, name=name, email=email)
+            def associate_page(api_objects, customers, inserts):
+                StripeCustomer.bulk_associate(inserts)
+
+            return reconcile_stripe(StripeCustomer,
+                stripe.Customer.list(**stripe_list_args(StripeCustomer, new_only)).auto_paging_iter(),
+                StripeCustomer.dict_from_api,
+                new_only=new_only,
+                on_page=associate_page,
+                persons=['personstripe__customer'])
         except Exception as e:
             Log.new(logging_level=logging.ERROR, description='Stripe - Customer refresh error', other_info=e)
 
 
 class StripeOneTimePayment(models.Model):
     """ A Stripe one-time payment """
-    stripe_id = models.CharField(max_length=128, help_text="What is the Stripe ID of this checkout session?")
+    stripe_id = models.CharField(max_length=128, unique=True, help_text="What is the Stripe ID of this checkout session?")
     customer = models.ForeignKey("subwaive.StripeCustomer", on_delete=models.CASCADE, help_text="What Stripe Customer is associated with this checkout session?")
     date = models.DateField(null=True, blank=True, help_text="What is date is associated with the payment link or what was the date the checkout session occurred?") #!!! if we store paymentlink, why muddle this field's contents?
     status = models.CharField(max_length=64, help_text="What is the status of tis checkout session?")
@@ -1191,7 +2167,7 @@ class StripeOneTimePayment(models.Model):
 
     def create_if_needed(checkout_session):
         """ creates a new record """
-        json = {'stripe_id': checkout_session.stripe_id}
+        json = {'stripe_id': checkout_session.id}
         
         if checkout_session.status == 'complete':
             payment_qs = StripeOneTimePayment.objects.filter(stripe_id=checkout_session.id)
@@ -1223,32 +2199,50 @@ class StripeOneTimePayment(models.Model):
                 else:
                     otp_date = fromtimestamp(checkout_session.created).date()
 
-                StripeOneTimePayment.objects.create(stripe_id=checkout_session.id, customer=customer, date=otp_date, status=checkout_session.status, payment_link=payment_link)
-                Log.new(logging_level=logging.DEBUG, description="Create StripeOneTimePayment", json=json)
+                payment, created = StripeOneTimePayment.objects.get_or_create(stripe_id=checkout_session.id, defaults={'customer': customer, 'date': otp_date, 'status': checkout_session.status, 'payment_link': payment_link})
+                if created:
+                    Log.new(logging_level=logging.DEBUG, description="Create StripeOneTimePayment", json=json)
+                    PersonEligibility.rebuild_persons(customer.get_persons())
 
     def get_session(stripe_id):
         """ return a session from the API for a given ID"""
-        return stripe.checkout.Session.retrieve(stripe_id)
+        return stripe_cache.get('checkout_session', stripe_id, lambda: stripe.checkout.Session.retrieve(stripe_id))
 
     def get_url(self):
         """ URL for a hyperlink """
         return f"{ STRIPE_WWW_ENDPOINT }/payments/{ self.stripe_id }"
 
     def refresh(new_only=False):
-        """ clear out existing records and repopulate them from the API """
+        """ reconcile existing records with the API """
         try:
-            Log.new(logging_level=logging.INFO, description="Refresh StripeOneTimePayment")
-            StripeOneTimePayment.objects.all().delete()
-            for plp in StripePaymentLinkPrice.objects.filter(payment_link__is_recurring=False):
-                for cs in stripe.checkout.Session.list(payment_link=plp.payment_link.stripe_id):
-                    StripeOneTimePayment.create_if_needed(cs)
+            list_args = stripe_list_args(StripeOneTimePayment, new_only)
+            payment_links = StripePaymentLink.objects.filter(is_recurring=False, stripepaymentlinkprice__isnull=False).distinct()
+            payment_link_by_stripe_id = {pl.stripe_id: pl for pl in payment_links}
+            customer_id_by_email = {email: customer_id for customer_id, email in StripeCustomer.objects.order_by('-id').values_list('id', 'email')}
+
+            def checkout_sessions():
+                for payment_link in payment_links:
+                    yield from stripe.checkout.Session.list(payment_link=payment_link.stripe_id, **list_args).auto_paging_iter()
+
+            def dict_from_api(checkout_session):
+                if checkout_session.status != 'complete':
+                    return None
+                email = checkout_session.customer_details['email']
+                if email not in customer_id_by_email:
+                    name = checkout_session.customer_details['name'] or email
+                    customer_id_by_email[email] = StripeCustomer.new(stripe_id=None, name=name, email=email).id
+                payment_link = payment_link_by_stripe_id[checkout_session.payment_link]
+                otp_date = payment_link.date or fromtimestamp(checkout_session.created).date()
+                return {'stripe_id': checkout_session.id, 'customer_id': customer_id_by_email[email], 'date': otp_date, 'status': checkout_session.status, 'payment_link_id': payment_link.id}
+
+            return reconcile_stripe(StripeOneTimePayment, checkout_sessions(), dict_from_api, new_only=new_only, persons=['personstripe__customer__stripeonetimepayment'])
         except Exception as e:
             Log.new(logging_level=logging.ERROR, description='Stripe - OneTimePayment refresh error', other_info=e)
 
 
 class StripePaymentLink(models.Model):
     """ A Stripe PaymentLink """
-    stripe_id = models.CharField(max_length=64, help_text="What is the Stripe ID of this payment link?")
+    stripe_id = models.CharField(max_length=64, unique=True, help_text="What is the Stripe ID of this payment link?")
     url = models.URLField(help_text="What is the URL of this payment link?")
     is_recurring = models.BooleanField(default=False, help_text="Is this payment link for a recurring charge?")
     date = models.DateField(blank=True, null=True, help_text="What event_date was provided in the payment link metadata?")
@@ -1264,41 +2258,49 @@ class StripePaymentLink(models.Model):
         """ updates an existing record, otherwise creates one """
         json = {'stripe_id': stripe_id}
 
-        payment_link_qs = StripePaymentLink.objects.filter(stripe_id=stripe_id)
-        if payment_link_qs.exists():
-            payment_link = payment_link_qs
-            payment_link.create_or_update_children()
-        else:
-            plink = StripePaymentLink.objects.create(stripe_id=payment_link.id, url=payment_link.url)
-            Log.new(logging_level=logging.DEBUG, description="Create StripePaymentLink", json=json)
-            plink.create_or_update_children()
+        api_record = stripe_cache.get('payment_link', stripe_id, lambda: stripe.PaymentLink.retrieve(stripe_id, expand=STRIPE_LINE_ITEM_EXPAND))
+        payment_link, created = StripePaymentLink.objects.update_or_create(stripe_id=stripe_id, defaults=StripePaymentLink.dict_from_api(api_record))
+        Log.new(logging_level=logging.DEBUG, description="Create StripePaymentLink" if created else "Update StripePaymentLink", json=json)
+        payment_link.create_or_update_children(api_record)
+
+        return payment_link
 
-    def create_or_update_children(self):
+    def create_or_update_children(self, api_record=None):
         """ updates existing child records, otherwise creates them """
-        for line_item in stripe.PaymentLink.list_line_items(self.stripe_id).auto_paging_iter():
-            price = StripePrice.create_or_update(line_item.price.id)
+        for line_item in StripePaymentLink.get_line_items(self.stripe_id, api_record):
+            price = StripePrice.create_or_update(line_item.price.id, api_record=line_item.price)
             StripePaymentLinkPrice.create_if_needed(payment_link=self, price=price)
 
+    def get_line_items(stripe_id, api_record=None):
+        """ return the line items of a payment link, from the expanded API record when it holds all of them """
+        line_items = api_record.get('line_items') if api_record else None
+        if line_items is not None and not line_items.has_more:
+            return line_items.data
+        return stripe.PaymentLink.list_line_items(stripe_id, expand=['data.price.product']).auto_paging_iter()
+
     def get_url(self):
         """ URL for a hyperlink """
         return f"{ STRIPE_WWW_ENDPOINT }/payment-links/{ self.stripe_id }"
 
+    def dict_from_api(api_record):
+        """ returns a dict of field values from an API record """
+        if api_record.subscription_data:
+            is_recurring = True
+        else:
+            is_recurring = False
+        if "event_date" in api_record.metadata.keys():
+            event_date = datetime.datetime.strptime(api_record.metadata.get("event_date"), "%Y-%m-%d").date()
+        else:
+            event_date = None
+        return {'stripe_id': api_record.id, 'url': api_record.url, 'is_recurring': is_recurring, 'date': event_date}
+
     def refresh(new_only=False):
-        """ clear out existing records and repopulate them from the API """
+        """ reconcile existing records with the API """
+        # payment links cannot be listed by creation date, but the listing is short and unchanged links are not written
         try:
-            Log.new(logging_level=logging.INFO, description="Refresh StripePaymentLink")
-            StripePaymentLink.objects.all().delete()
-            for payment_link in stripe.PaymentLink.list().auto_paging_iter():
-                if payment_link.subscription_data:
-                    is_recurring = True
-                else:
-                    is_recurring = False
-                if "event_date" in payment_link.metadata.keys():
-                    event_date = datetime.datetime.strptime(payment_link.metadata.get("event_date"), "%Y-%m-%d")
-                else:
-                    event_date = None
-                StripePaymentLink.objects.create(stripe_id=payment_link.id, url=payment_link.url, is_recurring=is_recurring, date=event_date)
-                Log.new(logging_level=logging.DEBUG, description="Create StripePaymentLink", json={'stripe_id': payment_link.id})
+            return reconcile_stripe(StripePaymentLink, stripe.PaymentLink.list().auto_paging_iter(), StripePaymentLink.dict_from_api, new_only=new_only,
+                # an event's date comes from its payment link
+                persons=['personstripe__customer__stripeonetimepayment__payment_link'])
         except Exception as e:
             Log.new(logging_level=logging.ERROR, description='Stripe - PaymentLink refresh error', other_info=e)
 
@@ -1311,32 +2313,54 @@ class StripePaymentLinkPrice(models.Model):
 
     class Meta:
         ordering = ('price', 'payment_link',)
+        constraints = [
+            models.UniqueConstraint(fields=['payment_link', 'price'], name='unique_stripe_payment_link_price'),
+        ]
 
     def __str__(self):
         return f"""{ self.price } / { self.payment_link }"""
 
     def create_if_needed(payment_link, price):
         """ create a PaymentLink-Price map if one does not already exist """
-        if not StripePaymentLinkPrice.objects.filter(payment_link=payment_link, price=price).exists():
-            StripePaymentLinkPrice.objects.create(payment_link=payment_link, price=price)
+        payment_link_price, created = StripePaymentLinkPrice.objects.get_or_create(payment_link=payment_link, price=price)
+        if created:
             Log.new(logging_level=logging.DEBUG, description="Create StripePaymentLinkPrice")
     
     def refresh():
+        """ reconcile existing PaymentLink-Price maps with the API """
         try:
-            Log.new(logging_level=logging.INFO, description="Refresh StripePaymentLinkPrice")
-            StripePaymentLinkPrice.objects.all().delete()
-            for payment_link in StripePaymentLink.objects.all():
-                for line_item in stripe.PaymentLink.list_line_items(payment_link.stripe_id).auto_paging_iter():
-                    stripe_id = line_item.price.id
-                    price = StripePrice.create_and_or_return(stripe_id=stripe_id)
-                    StripePaymentLinkPrice.objects.create(payment_link=payment_link, price=price)
+            with SyncState.track('stripe', 'StripePaymentLinkPrice') as sync_run:
+                existing = {(payment_link_id, price_id): plp_id for plp_id, payment_link_id, price_id in StripePaymentLinkPrice.objects.values_list('id', 'payment_link_id', 'price_id')}
+                payment_link_id_by_stripe_id = dict(StripePaymentLink.objects.values_list('stripe_id', 'id'))
+                price_id_by_stripe_id = dict(StripePrice.objects.values_list('stripe_id', 'id'))
+                current = set()
+                # line items arrive with the listing, so only links with more items than fit in it need another call
+                for api_payment_link in stripe.PaymentLink.list(expand=[f"data.{ field }" for field in STRIPE_LINE_ITEM_EXPAND]).auto_paging_iter():
+                    if api_payment_link.id not in payment_link_id_by_stripe_id:
+                        continue
+                    for line_item in StripePaymentLink.get_line_items(api_payment_link.id, api_payment_link):
+                        if line_item.price.id not in price_id_by_stripe_id:
+                            price_id_by_stripe_id[line_item.price.id] = StripePrice.create_and_or_return(stripe_id=line_item.price.id, api_record=line_item.price).id
+                        current.add((payment_link_id_by_stripe_id[api_payment_link.id], price_id_by_stripe_id[line_item.price.id]))
+
+                inserts = [StripePaymentLinkPrice(payment_link_id=payment_link_id, price_id=price_id) for payment_link_id, price_id in current if (payment_link_id, price_id) not in existing]
+                stale = [key for key in existing if key not in current]
+                with transaction.atomic():
+                    StripePaymentLinkPrice.objects.bulk_create(inserts, ignore_conflicts=True)
+                    removed, _ = StripePaymentLinkPrice.objects.filter(id__in=[existing[key] for key in stale]).delete()
+                # one-time payments are described by the prices on their payment link
+                person_ids = PersonEligibility.get_person_ids(['personstripe__customer__stripeonetimepayment__payment_link'], set(plp.payment_link_id for plp in inserts) | set(payment_link_id for payment_link_id, _ in stale))
+                if person_ids:
+                    PersonEligibility.rebuild_persons(Person.objects.filter(id__in=person_ids))
+                sync_run.counts = {'inserted': len(inserts), 'removed': removed}
+                Log.new(logging_level=logging.INFO, description="Refresh StripePaymentLinkPrice", json={'inserted': len(inserts), 'removed': removed})
         except Exception as e:
             Log.new(logging_level=logging.ERROR, description='Stripe - PaymentLinkPrice refresh error', other_info=e)
 
 
 class StripePrice(models.Model):
     """ A Stripe Price """
-    stripe_id = models.CharField(max_length=64, help_text="What is the Stripe ID of this price?")
+    stripe_id = models.CharField(max_length=64, unique=True, help_text="What is the Stripe ID of this price?")
     name = models.CharField(max_length=64, help_text="What is the name of the Price?")
     interval = models.CharField(max_length=64, help_text="What is the interval type of this price?")
     price = models.IntegerField(help_text="What is the numerical base-currency value of this price?")
@@ -1354,47 +2378,40 @@ class StripePrice(models.Model):
         
         return f"{ description } { price }"
 
-    def create_and_or_return(stripe_id):
-        """ create a StripePrice if one does not already exist """
+    def create_and_or_return(stripe_id, api_record=None):
+        """ create a StripePrice if one does not already exist. api_record saves the retrieve when the caller already has it """
         json = {'stripe_id': stripe_id}
 
-        price_qs = StripePrice.objects.filter(stripe_id=stripe_id)
-        if not price_qs.exists():
-            api_record = StripePrice.fetch_api_data(stripe_id)
+        price = StripePrice.objects.filter(stripe_id=stripe_id).first()
+        if not price:
+            if api_record is None:
+                api_record = StripePrice.fetch_api_data(stripe_id)
             api_prc = StripePrice.dict_from_api(api_record)
-            product = StripeProduct.create_and_or_return(api_record.product)
+            product = StripeProduct.create_and_or_return(stripe_id_of(api_record.product), api_record=stripe_object_of(api_record.product))
             # print(product)
-            price = StripePrice.objects.create(stripe_id=stripe_id, product=product, name=api_prc['name'], interval=api_prc['interval'], price=api_prc['price_amount'])
-            Log.new(logging_level=logging.DEBUG, description="Create StripePrice", json=json)
-        else:
-            price = price_qs.first()
+            price, created = StripePrice.objects.get_or_create(stripe_id=stripe_id, defaults={'product': product, 'name': api_prc['name'], 'interval': api_prc['interval'], 'price': api_prc['price_amount']})
+            if created:
+                Log.new(logging_level=logging.DEBUG, description="Create StripePrice", json=json)
         
         return price
 
-    def create_or_update(stripe_id):
+    def create_or_update(stripe_id, api_record=None):
         """ updates an existing record, otherwise creates one """
         json = {'stripe_id': stripe_id}
 
-        price_qs = StripePrice.objects.filter(stripe_id=stripe_id)
-        api_record = StripePrice.fetch_api_data(stripe_id)
+        if api_record is None:
+            api_record = StripePrice.fetch_api_data(stripe_id)
         api_prc = StripePrice.dict_from_api(api_record)
-        product = StripeProduct.create_or_update(api_prc.product)
-
-        if price_qs.exists():
-            price = price_qs.first()
-            price.name = api_prc['name']
-            price.interval = api_prc['interval']
-            price.price = api_prc['price_amount']
-            price.product = product
-            price.save()
-            Log.new(logging_level=logging.DEBUG, description="Update StripePrice", json=json)
-        else:
-            StripePrice.objects.create(stripe_id=stripe_id, product=product, name=api_prc['name'], interval=api_prc['interval'], price=api_prc['price_amount'])
-            Log.new(logging_level=logging.DEBUG, description="Create StripePrice", json=json)
+        product = StripeProduct.create_or_update(stripe_id_of(api_record.product), api_record=stripe_object_of(api_record.product))
+
+        price, created = StripePrice.objects.update_or_create(stripe_id=stripe_id, defaults={'product': product, 'name': api_prc['name'], 'interval': api_prc['interval'], 'price': api_prc['price_amount']})
+        Log.new(logging_level=logging.DEBUG, description="Create StripePrice" if created else "Update StripePrice", json=json)
+
+        return price
 
     def fetch_api_data(stripe_id):
         """ fetch api data """
-        return stripe.Price.retrieve(stripe_id)
+        return stripe_cache.get('price', stripe_id, lambda: stripe.Price.retrieve(stripe_id, expand=['product']))
     
     def dict_from_api(api_record):
         """ returns a dict of required values from an API record """
@@ -1417,24 +2434,31 @@ class StripePrice(models.Model):
         return f"{ STRIPE_WWW_ENDPOINT }/prices/{ self.stripe_id }"
 
     def refresh(new_only=False):
-        """ clear out existing records and repopulate them from the API """
+        """ reconcile existing records with the API """
         try:
-            Log.new(logging_level=logging.INFO, description="Refresh StripePrice")
-            StripePrice.objects.all().delete()
-            for price in stripe.Price.list(active=True).auto_paging_iter():
-                # print(price.product)
-                if stripe.Product.retrieve(price.product).active:
-                    product = StripeProduct.objects.get(stripe_id=price.product)
-                    api_prc = StripePrice.dict_from_api(price)
-                    StripePrice.objects.create(stripe_id=api_prc['stripe_id'], product=product, name=api_prc['name'], interval=api_prc['interval'], price=api_prc['price_amount'])
-                    Log.new(logging_level=logging.DEBUG, description="Create StripePrice", json={'stripe_id': api_prc['stripe_id']})
+            # StripeProduct.refresh only keeps active products, so there is no need to retrieve each product
+            product_id_by_stripe_id = dict(StripeProduct.objects.values_list('stripe_id', 'id'))
+
+            def dict_from_api(price):
+                if price.product not in product_id_by_stripe_id:
+                    return None
+                api_prc = StripePrice.dict_from_api(price)
+                return {'stripe_id': api_prc['stripe_id'], 'product_id': product_id_by_stripe_id[price.product], 'name': api_prc['name'], 'interval': api_prc['interval'], 'price': api_prc['price_amount']}
+
+            return reconcile_stripe(StripePrice,
+                stripe.Price.list(active=True, **stripe_list_args(StripePrice, new_only)).auto_paging_iter(),
+                dict_from_api,
+                new_only=new_only,
+                # prices still referenced by a subscription or payment link are kept
+                removable=Q(stripesubscriptionitem__isnull=True, stripepaymentlinkprice__isnull=True),
+                persons=['personstripe__customer__stripesubscription__stripesubscriptionitem__price', 'personstripe__customer__stripeonetimepayment__payment_link__stripepaymentlinkprice__price'])
         except Exception as e:
             Log.new(logging_level=logging.ERROR, description='Stripe - Price refresh error', other_info=e)
 
 
 class StripeProduct(models.Model):
     """ A Stripe Product """
-    stripe_id = models.CharField(max_length=64, help_text="What is the Stripe ID of this product?")
+    stripe_id = models.CharField(max_length=64, unique=True, help_text="What is the Stripe ID of this product?")
     name = models.CharField(max_length=64,  help_text="What is the name of this product?")
     description = models.TextField(max_length=512, help_text="What is the description of this product?")
 
@@ -1444,55 +2468,55 @@ class StripeProduct(models.Model):
     def __str__(self):
         return f"""{ self.stripe_id } / { self.name } / { self.description[:50] }"""
 
-    def create_and_or_return(stripe_id):
-        """ create a StripeProduct if one does not already exist """
+    def create_and_or_return(stripe_id, api_record=None):
+        """ create a StripeProduct if one does not already exist. api_record saves the retrieve when the caller already has it """
         json = {'stripe_id': stripe_id}
 
-        product_qs = StripeProduct.objects.filter(stripe_id=stripe_id)
-        if not product_qs.exists():
-            api_prd = stripe.Product.retrieve(stripe_id)
-            product = StripeProduct.objects.create(stripe_id=stripe_id, name=api_prd.name, description=api_prd.description)
-            Log.new(logging_level=logging.DEBUG, description="Create StripeProduct", json=json)
-        else:
-            product = product_qs.first()
+        product = StripeProduct.objects.filter(stripe_id=stripe_id).first()
+        if not product:
+            api_prd = api_record or stripe_cache.get('product', stripe_id, lambda: stripe.Product.retrieve(stripe_id))
+            product, created = StripeProduct.objects.get_or_create(stripe_id=stripe_id, defaults={'name': api_prd.name, 'description': api_prd.description or ''})
+            if created:
+                Log.new(logging_level=logging.DEBUG, description="Create StripeProduct", json=json)
         
         return product
 
-    def create_or_update(stripe_id):
+    def create_or_update(stripe_id, api_record=None):
         """ updates an existing record, otherwise creates one """
         json = {'stripe_id': stripe_id}
         
-        product_qs = StripeProduct.objects.filter(stripe_id=stripe_id)
-        api_prd = stripe.Product.retrieve(stripe_id)
-        if product_qs.exists():
-            product = product_qs.first()
-            product.name = api_prd.name
-            product.description = api_prd.description
-            product.save()
-            Log.new(logging_level=logging.DEBUG, description="Update StripeProduct", json=json)
-        else:
-            StripeProduct.objects.create(stripe_id=stripe_id, name=api_prd.name, description=api_prd.description)
-            Log.new(logging_level=logging.DEBUG, description="Create StripeProduct", json=json)
+        api_prd = api_record or stripe_cache.get('product', stripe_id, lambda: stripe.Product.retrieve(stripe_id))
+        product, created = StripeProduct.objects.update_or_create(stripe_id=stripe_id, defaults={'name': api_prd.name, 'description': api_prd.description or ''})
+        Log.new(logging_level=logging.DEBUG, description="Create StripeProduct" if created else "Update StripeProduct", json=json)
+
+        return product
 
     def get_url(self):
         """ URL for a hyperlink """
         return f"{ STRIPE_WWW_ENDPOINT }/products/{ self.stripe_id }"
 
+    def dict_from_api(api_record):
+        """ returns a dict of field values from an API record """
+        return {'stripe_id': api_record.id, 'name': api_record.name, 'description': api_record.description or ''}
+
     def refresh(new_only=False):
-        """ clear out existing records and repopulate them from the API """
+        """ reconcile existing records with the API """
         try:
-            Log.new(logging_level=logging.INFO, description="Refresh StripeProduct")
-            StripeProduct.objects.all().delete()
-            for product in stripe.Product.list(active=True).auto_paging_iter():
-                StripeProduct.objects.create(stripe_id=product.id, name=product.name, description=product.description)
-                Log.new(logging_level=logging.DEBUG, description="Create StripeProduct", json={'stripe_id': product.id})
+            return reconcile_stripe(StripeProduct,
+                stripe.Product.list(active=True, **stripe_list_args(StripeProduct, new_only)).auto_paging_iter(),
+                StripeProduct.dict_from_api,
+                new_only=new_only,
+                # products are kept until their prices are gone
+                removable=Q(stripeprice__isnull=True),
+                # memberships, donations and day passes are told apart by product name
+                persons=['personstripe__customer__stripesubscription__stripesubscriptionitem__price__product', 'personstripe__customer__stripeonetimepayment__payment_link__stripepaymentlinkprice__price__product'])
         except Exception as e:
             Log.new(logging_level=logging.ERROR, description='Stripe - Product refresh error', other_info=e)
 
 
 class StripeSubscription(models.Model):
     """ A Stripe Subscription """
-    stripe_id = models.CharField(max_length=64, help_text="What is the Stripe ID of this subscription?")
+    stripe_id = models.CharField(max_length=64, unique=True, help_text="What is the Stripe ID of this subscription?")
     customer = models.ForeignKey("subwaive.StripeCustomer", on_delete=models.CASCADE, help_text="What Stripe Customer holds this Subscription?")
     created = models.DateTimeField(null=True, blank=True, help_text="When was this subscription created?")
     current_period_end = models.DateTimeField(null=True, blank=True, help_text="When does this subscription end if not renewed?")
@@ -1510,52 +2534,57 @@ class StripeSubscription(models.Model):
         json = {'stripe_id': stripe_id}
 
         subscription_qs = StripeSubscription.objects.filter(stripe_id=stripe_id)
-        api_record = stripe.Subscription.retrieve(stripe_id)
+        api_record = stripe_cache.get('subscription', stripe_id, lambda: stripe.Subscription.retrieve(stripe_id, expand=STRIPE_SUBSCRIPTION_EXPAND))
 
-        customer_id = api_record.customer
+        customer_id = stripe_id_of(api_record.customer)
         created = fromtimestamp(api_record.created)
         current_period_end = fromtimestamp(api_record.current_period_end)
         status = api_record.status
         name = StripeSubscription.get_api_name(stripe_id)
 
-        if subscription_qs.exists():
-            if status == 'canceled':
-                subscription_qs.delete()
+        if status == 'canceled':
+            removed, _ = subscription_qs.delete()
+            if removed:
                 Log.new(logging_level=logging.INFO, description="Cancel StripeSubscription", json=json)
-            else:
-                subscription = subscription_qs.first()
-                subscription.customer = StripeCustomer.create_and_or_return(customer_id)
-                subscription.created = created
-                subscription.current_period_end = current_period_end
-                subscription.status = status
-                subscription.name = name
-                subscription.save()
-    
-                Log.new(logging_level=logging.DEBUG, description="Delete StripeSubscriptionItem", json={'subscription.id': subscription.id})
-                StripeSubscriptionItem.objects.filter(subscription=subscription).delete()
-                StripeSubscriptionItem.create_if_needed(api_record)
-                Log.new(logging_level=logging.DEBUG, description="Update StripeSubscription", json=json)
-        elif status != 'canceled':
-            customer = StripeCustomer.create_and_or_return(customer_id)
-            subscription = StripeSubscription.objects.create(stripe_id=stripe_id, customer=customer, name=name, created=created, current_period_end=current_period_end, status=status)
+        else:
+            customer = StripeCustomer.create_and_or_return(customer_id, api_record=stripe_object_of(api_record.customer))
+            subscription, is_created = StripeSubscription.objects.update_or_create(stripe_id=stripe_id, defaults={'customer': customer, 'name': name, 'created': created, 'current_period_end': current_period_end, 'status': status})
             Log.new(logging_level=logging.DEBUG, description="Delete StripeSubscriptionItem", json={'subscription.id': subscription.id})
             StripeSubscriptionItem.objects.filter(subscription=subscription).delete()
             StripeSubscriptionItem.create_if_needed(api_record)
-            Log.new(logging_level=logging.DEBUG, description="Create StripeSubscription", json=json)
+            Log.new(logging_level=logging.DEBUG, description="Create StripeSubscription" if is_created else "Update StripeSubscription", json=json)
+
+        PersonEligibility.rebuild_persons(Person.objects.filter(personstripe__customer__stripe_id=customer_id).distinct())
 
     def get_api_name(stripe_id):
         """ return a name if provided in the checkout, else "self" """
-        name = None
+        return stripe_cache.get('subscription_name', stripe_id, lambda: StripeSubscription.fetch_api_name(stripe_id))
 
+    def fetch_api_name(stripe_id):
+        """ look up the name given in a subscription's checkout """
         session = stripe.checkout.Session.list(subscription=stripe_id)
+        return StripeSubscription.name_from_session(session.data[0] if session.data else None)
+
+    def name_from_session(session):
+        """ return the name given in a checkout session's custom fields, else "self" """
+        name = None
         try:
-            name = session.data[0].custom_fields[0].text.value
+            name = session.custom_fields[0].text.value
         except:
             pass
         if not name:
             name = "self"
         return name
 
+    def list_api_names(created):
+        """ return checkout names by subscription id from one listing of completed checkout sessions created in a range """
+        names = {}
+        for session in stripe.checkout.Session.list(status='complete', created=created).auto_paging_iter():
+            # sessions are listed newest first, matching fetch_api_name
+            if session.subscription and session.subscription not in names:
+                names[session.subscription] = StripeSubscription.name_from_session(session)
+        return names
+
     def get_url(self):
         """ URL for a hyperlink """
         return f"{ STRIPE_WWW_ENDPOINT }/subscriptions/{ self.stripe_id }"
@@ -1567,25 +2596,61 @@ class StripeSubscription(models.Model):
         Log.new(logging_level=logging.DEBUG, description="Create StripeSubscription", json={'stripe_id': stripe_id})
 
     def refresh(new_only=False):
-        """ clear out existing records and repopulate them from the API """
+        """ reconcile existing records with the API """
         try:
-            Log.new(logging_level=logging.INFO, description="Refresh StripeSubscription")
-            StripeSubscription.objects.all().delete()
-            for subscription in stripe.Subscription.search(query='-status:"canceled"').auto_paging_iter():
-                customer = StripeCustomer.objects.get(stripe_id=subscription.customer)
-
-                stripe_id = subscription['id']
-                name = StripeSubscription.get_api_name(stripe_id)
-
-                created = fromtimestamp(subscription.created)
-                current_period_end = fromtimestamp(subscription.current_period_end)
-                status = subscription.status
-
-                subscription_qs = StripeSubscription.objects.filter(stripe_id=stripe_id)
-                if subscription_qs:
-                    subscription_qs.first().update(created, current_period_end, status)
-                else:
-                    StripeSubscription.new(stripe_id, customer, name, created, current_period_end, status, subscription)
+            customer_id_by_stripe_id = dict(StripeCustomer.objects.filter(stripe_id__isnull=False).values_list('stripe_id', 'id'))
+            existing_stripe_ids = set(StripeSubscription.objects.values_list('stripe_id', flat=True))
+            # checkout names for new subscriptions come from session listings covering when they were created
+            names = {}
+            names_since = None
+
+            def load_names(page):
+                nonlocal names_since
+                created = [subscription.created for subscription in page if subscription.id not in existing_stripe_ids]
+                if not created:
+                    return
+                # a checkout session expires within a day, so it was created at most a day before its subscription
+                since = min(created) - CHECKOUT_SESSION_MAX_SECONDS
+                if names_since is None or since < names_since:
+                    for subscription_id, name in StripeSubscription.list_api_names({'gte': since} if names_since is None else {'gte': since, 'lt': names_since}).items():
+                        names.setdefault(subscription_id, name)
+                    names_since = since
+
+            def with_names(api_subscriptions):
+                page = []
+                for subscription in api_subscriptions:
+                    page.append(subscription)
+                    if len(page) >= STRIPE_SYNC_PAGE_SIZE:
+                        load_names(page)
+                        yield from page
+                        page = []
+                load_names(page)
+                yield from page
+
+            def dict_from_api(subscription):
+                customer_id = stripe_id_of(subscription.customer)
+                if customer_id not in customer_id_by_stripe_id:
+                    customer_id_by_stripe_id[customer_id] = StripeCustomer.create_and_or_return(customer_id, api_record=stripe_object_of(subscription.customer)).id
+                values = {
+                    'stripe_id': subscription.id,
+                    'customer_id': customer_id_by_stripe_id[customer_id],
+                    'created': fromtimestamp(subscription.created),
+                    'current_period_end': fromtimestamp(subscription.current_period_end),
+                    'status': subscription.status,
+                }
+                # the checkout name does not change, so only look it up for new subscriptions
+                if subscription.id not in existing_stripe_ids:
+                    # a checkout completed after its listing falls back to its own lookup
+                    values['name'] = names[subscription.id] if subscription.id in names else StripeSubscription.get_api_name(subscription.id)
+                return values
+
+            # listing subscriptions excludes canceled ones by default. customers, prices and products arrive expanded
+            return reconcile_stripe(StripeSubscription,
+                with_names(stripe.Subscription.list(expand=[f"data.{ field }" for field in STRIPE_SUBSCRIPTION_EXPAND], **stripe_list_args(StripeSubscription, new_only)).auto_paging_iter()),
+                dict_from_api,
+                new_only=new_only,
+                on_page=lambda api_objects, subscriptions, inserts: StripeSubscriptionItem.reconcile(api_objects, subscriptions),
+                persons=['personstripe__customer__stripesubscription'])
         except Exception as e:
             Log.new(logging_level=logging.ERROR, description='Stripe - Subscription refresh error', other_info=e)
 
@@ -1618,7 +2683,7 @@ class StripeSubscription(models.Model):
 
 class StripeSubscriptionItem(models.Model):
     """ A Stripe SubscriptionItem """
-    stripe_id = models.CharField(max_length=64, help_text="What is the Stripe ID of this subscription item?")
+    stripe_id = models.CharField(max_length=64, unique=True, help_text="What is the Stripe ID of this subscription item?")
     subscription = models.ForeignKey("subwaive.StripeSubscription", on_delete=models.CASCADE, help_text="What subscription is this subscription item a part of?")
     price = models.ForeignKey("subwaive.StripePrice", on_delete=models.CASCADE, help_text="What Stripe Price is associated with the subscription item?")
 
@@ -1630,12 +2695,241 @@ class StripeSubscriptionItem(models.Model):
 
     def create_if_needed(api_sub):
         """ loops through a Stripe API Subscription object and creates a SubscriptionItem if one does not already exist """
+        subscription = StripeSubscription.objects.get(stripe_id=api_sub.id)
         for item in api_sub['items']:
             item_id = item.id
             price_id = item.price.id
-            price = StripePrice.create_and_or_return(stripe_id=price_id)
-            subscription = StripeSubscription.objects.get(stripe_id=api_sub.id)
-            if not StripeSubscriptionItem.objects.filter(stripe_id=item_id, subscription=subscription, price=price).exists():
-                StripeSubscriptionItem.objects.create(stripe_id=item_id, subscription=subscription, price=price)
+            price = StripePrice.create_and_or_return(stripe_id=price_id, api_record=item.price)
+            subscription_item, created = StripeSubscriptionItem.objects.update_or_create(stripe_id=item_id, defaults={'subscription': subscription, 'price': price})
+            if created:
                 Log.new(logging_level=logging.DEBUG, description="Create StripeSubscriptionItem")
 
+    def reconcile(api_subscriptions, subscriptions):
+        """ reconcile the items of a page of Stripe API Subscription objects with existing records.
+        subscriptions is a dict of local StripeSubscription records by stripe_id. Returns the ids of subscriptions whose items changed """
+        api_items = [(subscriptions[api_sub.id], item) for api_sub in api_subscriptions for item in api_sub['items']]
+        price_by_stripe_id = {p.stripe_id: p for p in StripePrice.objects.filter(stripe_id__in=[item.price.id for _, item in api_items])}
+        existing = {i.stripe_id: i for i in StripeSubscriptionItem.objects.filter(subscription__in=subscriptions.values())}
+
+        inserts = []
+        updates = []
+        for subscription, item in api_items:
+            if item.price.id not in price_by_stripe_id:
+                price_by_stripe_id[item.price.id] = StripePrice.create_and_or_return(stripe_id=item.price.id, api_record=item.price)
+            price = price_by_stripe_id[item.price.id]
+            row = existing.pop(item.id, None)
+            if row is None:
+                inserts.append(StripeSubscriptionItem(stripe_id=item.id, subscription=subscription, price=price))
+            elif row.subscription_id != subscription.id or row.price_id != price.id:
+                row.subscription = subscription
+                row.price = price
+                updates.append(row)
+
+        with transaction.atomic():
+            StripeSubscriptionItem.objects.bulk_create(inserts, update_conflicts=True, unique_fields=['stripe_id'], update_fields=['subscription', 'price'])
+            StripeSubscriptionItem.objects.bulk_update(updates, ['subscription', 'price'])
+            # whatever is left over was removed from its subscription
+            StripeSubscriptionItem.objects.filter(id__in=[i.id for i in existing.values()]).delete()
+
+        return set(item.subscription_id for item in inserts + updates + list(existing.values()))
+
+
+class SyncRun:
+    """ Times the sync of one object type and records its cursor, counts and duration in SyncState when the
+    block exits. If the block raises, the error is recorded instead and the previous cursor is kept """
+    def __init__(self, source, object_type):
+        self.source = source
+        self.object_type = object_type
+        self.cursor = None
+        self.counts = None
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        error = f"{ exc_type.__name__ }: { exc_value }" if exc_type else None
+        SyncState.record(self.source, self.object_type, None if error else self.cursor, self.counts, time.monotonic() - self.started, error)
+
+
+class SyncState(models.Model):
+    """ Where the last sync of an external object type left off, and how it went """
+    source = models.CharField(max_length=32, help_text="What external system is synced? (ex. stripe)")
+    object_type = models.CharField(max_length=64, help_text="What kind of object is synced? (ex. StripeCustomer)")
+    cursor = models.CharField(max_length=128, blank=True, null=True, help_text="Where should the next incremental sync resume from?")
+    last_run_at = models.DateTimeField(blank=True, null=True, help_text="When did the last sync finish?")
+    inserted = models.PositiveIntegerField(default=0, help_text="How many rows did the last sync insert?")
+    updated = models.PositiveIntegerField(default=0, help_text="How many rows did the last sync update?")
+    removed = models.PositiveIntegerField(default=0, help_text="How many rows did the last sync remove?")
+    duration = models.FloatField(blank=True, null=True, help_text="How many seconds did the last sync take?")
+    error = models.TextField(blank=True, null=True, help_text="What went wrong in the last sync, if anything?")
+
+    class Meta:
+        ordering = ('source', 'object_type',)
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'object_type'], name='unique_sync_state'),
+        ]
+        indexes = [
+            models.Index(fields=['object_type'], name='sync_state_object_type'),
+        ]
+
+    def __str__(self):
+        return f"""{ self.source } / { self.object_type } / { self.last_run_at }"""
+
+    def get_cursor(source, object_type):
+        """ return the cursor stored for an object type, if any """
+        return SyncState.objects.filter(source=source, object_type=object_type).values_list('cursor', flat=True).first()
+
+    def get_int_cursor(source, object_type):
+        """ return the cursor stored for an object type as an integer, if any """
+        cursor = SyncState.get_cursor(source, object_type)
+        return int(cursor) if cursor else None
+
+    def get_by_object_type(object_types):
+        """ return the sync states of some object types, by object type """
+        return {state.object_type: state for state in SyncState.objects.filter(object_type__in=object_types)}
+
+    def record(source, object_type, cursor=None, counts=None, duration=None, error=None):
+        """ store the outcome of a sync. A missing cursor keeps the previous one. """
+        counts = counts or {}
+        values = {
+            'last_run_at': datetime.datetime.now().astimezone(pytz.timezone(TIME_ZONE)),
+            'inserted': counts.get('inserted', 0),
+            'updated': counts.get('updated', 0),
+            'removed': counts.get('removed', 0),
+            'duration': round(duration, 3) if duration is not None else None,
+            'error': error,
+        }
+        if cursor is not None:
+            values['cursor'] = cursor
+        return SyncState.objects.update_or_create(source=source, object_type=object_type, defaults=values)[0]
+
+    def track(source, object_type):
+        """ return a context manager that records a sync of an object type when it ends """
+        return SyncRun(source, object_type)
+
+
+class WebhookEvent(models.Model):
+    """ A webhook received from Stripe or Docuseal, queued until a worker refreshes the object it is about.\n
+    Webhooks only say which object changed; the worker pulls the object from the API once per batch,
+    however many events arrived for it. """
+    STATUS_PENDING = 'pending'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    source = models.CharField(max_length=32, help_text="What system sent the webhook? (ex. stripe)")
+    event_type = models.CharField(max_length=64, help_text="What kind of event was it? (ex. invoice.paid)")
+    object_type = models.CharField(max_length=64, help_text="What kind of object needs refreshing? (ex. subscription)")
+    object_id = models.CharField(max_length=128, help_text="What is the id of the object that needs refreshing?")
+    payload = models.JSONField(blank=True, null=True, help_text="What object did the webhook carry?")
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING, help_text="Has the event been handled?")
+    attempts = models.PositiveIntegerField(default=0, help_text="How many times has a worker tried to handle the event?")
+    error = models.TextField(blank=True, null=True, help_text="What went wrong the last time the event was handled?")
+    received_at = models.DateTimeField(auto_now_add=True, help_text="When did the webhook arrive?")
+    processed_at = models.DateTimeField(blank=True, null=True, help_text="When was the event handled?")
+    next_attempt_at = models.DateTimeField(blank=True, null=True, help_text="When may a worker next try to handle the event? (empty for straight away)")
+
+    class Meta:
+        ordering = ('received_at',)
+        indexes = [
+            models.Index(fields=['status', 'received_at'], name='webhook_event_status'),
+        ]
+
+    def __str__(self):
+        return f"""{ self.source } / { self.event_type } / { self.object_id } / { self.status }"""
+
+    def enqueue(source, event_type, object_type, object_id, payload=None):
+        """ store a webhook for the worker """
+        return WebhookEvent.objects.create(source=source, event_type=event_type, object_type=object_type, object_id=str(object_id), payload=payload)
+
+    def handle(source, object_type, object_id, payloads):
+        """ refresh one object from the API """
+        if source == 'stripe':
+            # the object must be seen as it is now, not as it was cached. This runs in the worker, whose
+            # cache may not be the one of the web process that received the webhook
+            stripe_cache.invalidate(object_type, object_id)
+            if object_type == 'customer':
+                StripeCustomer.create_or_update(object_id)
+            elif object_type == 'subscription':
+                StripeSubscription.create_or_update(object_id)
+            elif object_type == 'checkout_session':
+                StripeOneTimePayment.create_if_needed(StripeOneTimePayment.get_session(object_id))
+            elif object_type == 'payment_link':
+                StripePaymentLink.create_or_update(object_id)
+            else:
+                raise ValueError(f"Unknown Stripe object type: { object_type }")
+
+        elif source == 'docuseal':
+            if object_type == 'template':
+                DocusealTemplate.create_or_update_by_id(object_id)
+            elif object_type == 'submission':
+                # make sure the template and submitters exist before the submission is pulled
+                for template_id in set(p['template']['id'] for p in payloads if p.get('template')):
+                    if not DocusealTemplate.objects.filter(template_id=template_id).exists():
+                        DocusealTemplate.create_or_update_by_id(template_id)
+                emails = set(p['email'] for p in payloads if p.get('email'))
+                emails.update(s['email'] for p in payloads for s in p.get('submitters', []))
+                for email in emails:
+                    DocusealSubmitter.create_if_needed(email)
+
+                DocusealSubmission.create_or_update(int(object_id))
+                DocusealFieldStore.re_extract(int(object_id))
+            else:
+                raise ValueError(f"Unknown Docuseal object type: { object_type }")
+
+        else:
+            raise ValueError(f"Unknown webhook source: { source }")
+
+    def get_retry_delay(attempts):
+        """ return how long to wait before trying an event again after it failed attempts times """
+        return datetime.timedelta(seconds=min(WEBHOOK_RETRY_SECONDS * 2 ** (attempts - 1), WEBHOOK_RETRY_MAX_SECONDS))
+
+    def claim(limit=WEBHOOK_BATCH_SIZE):
+        """ return a batch of events that are due, holding them back from other workers for WEBHOOK_CLAIM_SECONDS.
+        Rows another worker is claiming are skipped rather than waited for """
+        now = datetime.datetime.now().astimezone(pytz.timezone(TIME_ZONE))
+        with transaction.atomic():
+            events = list(WebhookEvent.objects.select_for_update(skip_locked=True)
+                .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now), status=WebhookEvent.STATUS_PENDING)
+                .order_by('received_at')[:limit])
+            WebhookEvent.objects.filter(id__in=[event.id for event in events]).update(next_attempt_at=now + datetime.timedelta(seconds=WEBHOOK_CLAIM_SECONDS))
+        return events
+
+    def process_pending(limit=WEBHOOK_BATCH_SIZE):
+        """ handle queued events that are due, refreshing each object once however many events name it.
+        Failed events are retried with exponential backoff. Returns the number of objects refreshed. """
+        events = WebhookEvent.claim(limit)
+
+        groups = {}
+        for event in events:
+            groups.setdefault((event.source, event.object_type, event.object_id), []).append(event)
+
+        for (source, object_type, object_id), group in groups.items():
+            ids = [event.id for event in group]
+            try:
+                WebhookEvent.handle(source, object_type, object_id, [event.payload or {} for event in group])
+                WebhookEvent.objects.filter(id__in=ids).update(
+                    status=WebhookEvent.STATUS_DONE,
+                    attempts=models.F('attempts') + 1,
+                    error=None,
+                    processed_at=datetime.datetime.now().astimezone(pytz.timezone(TIME_ZONE)),
+                    next_attempt_at=None)
+                Log.new(logging_level=logging.DEBUG, description="Webhook handling complete", json={'source': source, 'object_type': object_type, 'object_id': object_id, 'events': len(group)})
+            except Exception as e:
+                Log.new(logging_level=logging.ERROR, description='Webhook handling error', json={'source': source, 'object_type': object_type, 'object_id': object_id}, other_info=e)
+                attempts = max(event.attempts for event in group) + 1
+                processed_at = datetime.datetime.now().astimezone(pytz.timezone(TIME_ZONE))
+                WebhookEvent.objects.filter(id__in=ids).update(
+                    status=WebhookEvent.STATUS_FAILED if attempts >= WEBHOOK_MAX_ATTEMPTS else WebhookEvent.STATUS_PENDING,
+                    attempts=attempts,
+                    error=str(e),
+                    processed_at=processed_at,
+                    # a short outage should not use up every attempt
+                    next_attempt_at=processed_at + WebhookEvent.get_retry_delay(attempts))
+
+        return len(groups)
@@ -11,18 +11,37 @@ from subwaive import docuseal
 from subwaive.models import DocusealTemplate
 from subwaive.models import Event
 from subwaive.models import Log
-from subwaive.models import NFC,NFCTerminal
-from subwaive.models import PersonEmail
-from subwaive.utils import generate_qr_bitmap, send_email, url_secret
+from subwaive.models import NFC,nfc_hot_set
+from subwaive.models import Person, PersonEligibility, PersonEmail
+from subwaive.utils import generate_qr_bitmap, generate_qr_modules, send_email, url_secret
 
 TIME_ZONE = os.environ.get("TIME_ZONE")
 
+# terminals that render QR codes themselves ask for the module matrix with this header value
+QR_FORMAT_HEADER = 'X-QR-Format'
+QR_FORMAT_MODULES = 'modules'
+
+def qr_response(request, content, headers):
+    """ a QR code for the terminal to show. Terminals sending X-QR-Format: modules get the bit-packed module matrix
+    (see render_qr_modules), older firmware gets the raw bitmap """
+    if request.headers.get(QR_FORMAT_HEADER) == QR_FORMAT_MODULES:
+        (payload, qr_size) = generate_qr_modules(content)
+        content_type = "application/x-qr-modules"
+    else:
+        (payload, qr_size) = generate_qr_bitmap(content)
+        content_type = "text/bitmap"
+    return HttpResponse(
+        content=payload,
+        content_type=content_type,
+        status=200,
+        headers=dict(headers, qr_size=qr_size))
+
 @csrf_exempt
 def nfc_self_serve(request):
     """ self-serve terminal interface for NFC check-in and self-serve sign-up """
     response = HttpResponse(status=401)
     token = request.headers.get('X-Self-Serve-Token')
-    terminal = NFCTerminal.objects.filter(token=token).first()
+    terminal = nfc_hot_set.get_terminal(token)
     # print(f"token: {request.headers.get('X-Self-Serve-Token')}")
     # print(f"http-payload: {request.POST}")
 
@@ -30,57 +49,48 @@ def nfc_self_serve(request):
         # print(f"terminal: {terminal.location}")
         uid = request.POST.get("uid", None)
         # print(f"uid: {uid}")
-        nfc_qs = NFC.objects.filter(uid=uid)
+        nfc = None
+        person_id = nfc_hot_set.get_person_id(uid)
+        if person_id:
+            # a known active card needs no NFC lookup, only its person and their snapshot
+            person = Person.objects.select_related('eligibility').filter(id=person_id).first()
+            if person:
+                nfc = NFC(uid=uid, person=person, is_active=True)
+        if not nfc:
+            nfc = NFC.objects.select_related('person__eligibility').filter(uid=uid).first()
 
-        if not nfc_qs.exists():
+        if not nfc:
             Log.new(logging_level=logging.INFO, description="NFC - new token", json={'uid': uid, 'terminal': terminal.id})
             # print("nfc not in database")
             # store NFC
-            nfc = NFC.objects.create(uid=uid, registration_id=url_secret(), activation_id=url_secret())
+            nfc, created = NFC.objects.get_or_create(uid=uid, defaults={'registration_id': url_secret(), 'activation_id': url_secret()})
             # create link to register NFC
             url = request.build_absolute_uri(redirect('register_nfc', nfc.registration_id).url)
-            (bmp,qr_size) = generate_qr_bitmap(url)
-            # print(bmp)
-            response = HttpResponse(
-                content=bmp, 
-                content_type="text/bitmap",
-                status=200,
-                headers={'line1': 'Register', 'line2': 'w/ QR code', 'qr_size': qr_size})
-            
+            response = qr_response(request, url, {'line1': 'Register', 'line2': 'w/ QR code'})
+
         else:
             # print("nfc found in database")
-            last_check_in = None
+            today = datetime.datetime.now(tz=pytz.timezone(TIME_ZONE)).date()
+            is_last_check_in_date_today = False
+            is_event_requires_registration = False
+            is_staff = False
+            event = None
 
-            person = nfc_qs.first().person
+            person = nfc.person
             if person:
-                last_check_in = person.get_last_check_in()
+                # a snapshot keeps the tap to a single lookup instead of a dozen queries
+                eligibility = PersonEligibility.get_or_rebuild(person)
+                is_last_check_in_date_today = eligibility.last_check_in_date == today
+                is_staff = eligibility.is_staff
                 event = Event.get_current_event()
-                is_event_requires_registration = False
                 if event:
                     # print(event)
-                    if event.get_registration_link():
+                    registration_link = event.get_registration_link()
+                    if registration_link:
                         is_event_requires_registration = True
-                is_staff = False
-                if person.get_user():
-                    is_staff = person.get_user().is_staff
-
-
-
-            is_last_check_in_date_today = False
-            if last_check_in:
-                # print("found prior check-in")
-                # print(last_check_in.check_in_time.astimezone(tz=pytz.timezone(TIME_ZONE)))
-                # print(datetime.datetime.now(tz=pytz.timezone(TIME_ZONE)).date())
-                if last_check_in.event:
-                    if last_check_in.event.start.date() == datetime.datetime.now(tz=pytz.timezone(TIME_ZONE)).date():
-                        # print("last event check in was today")
-                        is_last_check_in_date_today = True
-                elif last_check_in.check_in_time.astimezone(tz=pytz.timezone(TIME_ZONE)).date() == datetime.datetime.now(tz=pytz.timezone(TIME_ZONE)).date():
-                    # print("last ad hoc check in was today")
-                    is_last_check_in_date_today = True
             # print(f"is_last_check_in_date_today: {is_last_check_in_date_today}")
 
-            if person and not nfc_qs.first().is_active:
+            if person and not nfc.is_active:
                 Log.new(logging_level=logging.INFO, description="NFC - token not activated", json={'uid': uid, 'terminal': terminal.id, 'person': person.id})
                 response = HttpResponse(
                     status=200,
@@ -91,49 +101,28 @@ def nfc_self_serve(request):
                 NFC.objects.filter(uid=uid).delete()
                 nfc = NFC.objects.create(uid=uid, registration_id=url_secret(), activation_id=url_secret())
                 url = request.build_absolute_uri(redirect('register_nfc', nfc.registration_id).url)
-                (bmp,qr_size) = generate_qr_bitmap(url)
-                response = HttpResponse(
-                    content=bmp, 
-                    content_type="text/bitmap",
-                    status=200,
-                    headers={'line1': 'Register', 'line2': 'w/ QR code', 'qr_size': qr_size})
+                response = qr_response(request, url, {'line1': 'Register', 'line2': 'w/ QR code'})
 
-            elif not person.check_waiver_status():
+            elif not eligibility.has_waiver:
                 Log.new(logging_level=logging.INFO, description="NFC - waiver needed", json={'uid': uid, 'terminal': terminal.id, 'person': person.id})
                 url_qs = DocusealTemplate.objects.filter(folder_name='Waivers')
                 if url_qs.exists():
                     url = url_qs.first().get_url()
-                    (bmp,qr_size) = generate_qr_bitmap(url)
-                    response = HttpResponse(
-                        content=bmp, 
-                        content_type="text/bitmap",
-                        status=200,
-                        headers={'line1': 'Sign', 'line2': 'Waiver', 'qr_size': qr_size})
+                    response = qr_response(request, url, {'line1': 'Sign', 'line2': 'Waiver'})
                 else:
                     docuseal.refresh_all()
                     response = HttpResponse(
                         status=200,
                         headers={'line1': 'Refreshing', 'line2': 'Waivers'})
 
-            elif is_event_requires_registration and not event.start.date in [e.date for e in person.get_events()]:
+            elif is_event_requires_registration and not eligibility.has_event_on(event.start.astimezone(pytz.timezone(TIME_ZONE)).date()):
                 Log.new(logging_level=logging.INFO, description="NFC - event requires registration", json={'uid': uid, 'terminal': terminal.id, 'person': person.id})
-                url = event.get_registration_link()
-                (bmp,qr_size)=generate_qr_bitmap(url)
-                response = HttpResponse(
-                    content=bmp, 
-                    content_type="text/bitmap",
-                    status=200,
-                    headers={'line1': 'Register', 'line2': 'for Event', 'qr_size': qr_size})
+                response = qr_response(request, registration_link, {'line1': 'Register', 'line2': 'for Event'})
 
-            elif not person.check_membership_status() and not person.get_events():
+            elif not eligibility.membership_status and not eligibility.event_dates:
                 Log.new(logging_level=logging.INFO, description="NFC - membership not found", json={'uid': uid, 'terminal': terminal.id, 'person': person.id})
                 url = "https://www.makefixhack.org/p/membership-and-donation.html"
-                (bmp,qr_size) = generate_qr_bitmap(url)
-                response = HttpResponse(
-                    content=bmp, 
-                    content_type="text/bitmap",
-                    status=200,
-                    headers={'line1': 'Membership', 'line2': 'Needed', 'qr_size': qr_size})
+                response = qr_response(request, url, {'line1': 'Membership', 'line2': 'Needed'})
 
             elif is_last_check_in_date_today and is_staff:
                 Log.new(logging_level=logging.INFO, description="NFC - terminal config requested", json={'uid': uid, 'terminal': terminal.id, 'person': person.id})
@@ -1,102 +1,185 @@
-import datetime
+import base64
+import json
 import logging
 
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.db.models import Prefetch
+from django.http import JsonResponse
 from django.shortcuts import render, redirect
+from django.template.loader import render_to_string
 from django.urls import reverse
+from django.utils.dateparse import parse_date
 
+from subwaive import duplicates
 from subwaive.models import DocusealFieldStore, StripeCustomer
 from subwaive.models import Event
-from subwaive.models import Person, PersonEmail, PersonEvent
+from subwaive.models import Person, PersonEmail, PersonEvent, PersonSearchToken
 from subwaive.utils import CONFIDENTIALITY_LEVEL_CONFIDENTIAL
 
+ROSTER_PAGE_SIZE = 100
+ROSTER_STATUSES = [
+    ('', 'Any status'),
+    ('member', 'Any membership'),
+    ('active', 'Active'),
+    ('lapsed', 'Lapsed'),
+    ('none', 'No membership'),
+]
 
-@login_required
-def person_list(request):
-    """ List of people in the system """
-    persons_prelim = Person.objects.all().order_by('name','preferred_email__email')
 
-    persons = [
+def get_roster(persons):
+    """ build the card details for a Person.objects.with_status() queryset """
+    return [
         {
             'name': p.name,
             'id': p.id,
-            'person_card': redirect('person_card', person_id=p.id).url,
-            'last_check_in': p.get_last_check_in(),
-            'membership_status': p.check_membership_status(),
-            'last_check_in_event_id_list': [ci.event.id for ci in PersonEvent.objects.filter(person=p, event__start__date=datetime.date.today())],
+            'person_card': reverse('person_card', kwargs={'person_id': p.id}),
+            'preferred_email': p.preferred_email.email if p.preferred_email else None,
+            'last_check_in': p.recent_check_ins[0] if p.recent_check_ins else None,
+            'membership_status': p.membership_status,
+            'last_check_in_event_id_list': [ci.event_id for ci in p.todays_check_ins],
         }
-        for p in persons_prelim
+        for p in persons
     ]
 
-    check_in_events = Event.get_current_event()
+
+def encode_cursor(cursor):
+    """ turn a (name, id) page cursor into a string for the query string """
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+
+def decode_cursor(value):
+    """ turn a string from encode_cursor() back into a (name, id) cursor, or None if it is missing or malformed """
+    if not value:
+        return None
+    try:
+        name, person_id = json.loads(base64.urlsafe_b64decode(value.encode()))
+        return (str(name), int(person_id))
+    except (ValueError, TypeError):
+        return None
+
+
+def get_roster_filters(request):
+    """ read the roster filters from the query string, ignoring dates that do not parse """
+    filters = {
+        'status': request.GET.get('status') or None,
+        'name_prefix': request.GET.get('name', '').strip() or None,
+    }
+    for key in ('checked_in_from', 'checked_in_to'):
+        try:
+            filters[key] = parse_date(request.GET.get(key) or '')
+        except ValueError:
+            filters[key] = None
+    return filters
+
+
+def get_next_query(request, next_cursor):
+    """ return the query string of the page after next_cursor, keeping the filters, or None on the last page """
+    if not next_cursor:
+        return None
+    query = request.GET.copy()
+    query['cursor'] = encode_cursor(next_cursor)
+    return query.urlencode()
+
+
+def get_roster_page(request, roster):
+    """ filter a roster ('all' or 'members') by the request and return one page of card details """
+    persons = ROSTERS[roster]['persons']().filter_roster(**get_roster_filters(request))
+    page, next_cursor = persons.select_related('preferred_email').page(decode_cursor(request.GET.get('cursor')), ROSTER_PAGE_SIZE)
+    return {
+        'persons': get_roster(page),
+        'total': persons.count(),
+        'next_query': get_next_query(request, next_cursor),
+    }
+
+
+def render_roster(request, roster):
+    """ the first page of a roster, with its filters; later pages stream in from roster_page """
+    roster_page = get_roster_page(request, roster)
+    redirect_name = ROSTERS[roster]['view']
 
     button_dict = [
-            {'url': reverse('person_list'), 'anchor': 'All', 'active': True},
-            {'url': reverse('member_list'), 'anchor': 'Members'},
+            {'url': reverse('person_list'), 'anchor': 'All', 'active': roster == 'all'},
+            {'url': reverse('member_list'), 'anchor': 'Members', 'active': roster == 'members'},
             {'url': reverse('member_email_list'), 'anchor': 'Email'},
             {'url': reverse('person_search'), 'anchor': 'Search'},
+            {'url': reverse('duplicate_people'), 'anchor': 'Duplicates'},
     ]
 
     context = {
         'CONFIDENTIALITY_LEVEL': CONFIDENTIALITY_LEVEL_CONFIDENTIAL,
-        'persons': persons,
+        'persons': roster_page['persons'],
+        'total': roster_page['total'],
+        'next_query': roster_page['next_query'],
+        'page_url': reverse(f'{ redirect_name }_page'),
+        'filters': request.GET,
+        'statuses': ROSTER_STATUSES,
         'buttons': button_dict,
-        'check_in_events': check_in_events,
-        'redirect_name': 'person_list',
+        'check_in_events': Event.get_current_event(),
+        'redirect_name': redirect_name,
     }
 
     return render(request, f'subwaive/person/person-list.html', context)
 
 
+@login_required
+def person_list(request):
+    """ List of people in the system """
+    return render_roster(request, 'all')
+
+
 @login_required
 def member_list(request):
     """ List of members in the system """
-    persons_prelim = Person.objects.all().order_by('name','preferred_email__email')
+    return render_roster(request, 'members')
 
-    persons = [
-        {
-            'name': p.name,
-            'id': p.id,
-            'person_card': redirect('person_card', person_id=p.id).url,
-            'last_check_in': p.get_last_check_in(),
-            'membership_status': p.check_membership_status(),
-            'last_check_in_event_id_list': [ci.event.id for ci in PersonEvent.objects.filter(person=p, event__start__date=datetime.date.today())],
-        }
-        for p in persons_prelim if p.check_membership_status()
-    ]
-
-    check_in_events = Event.get_current_event()
 
-    button_dict = [
-            {'url': reverse('person_list'), 'anchor': 'All'},
-            {'url': reverse('member_list'), 'anchor': 'Members', 'active': True},
-            {'url': reverse('member_email_list'), 'anchor': 'Email'},
-            {'url': reverse('person_search'), 'anchor': 'Search'},
-    ]
+@login_required
+def roster_page(request, roster):
+    """ A page of a roster as JSON: the rendered cards, the people on them and the query string of the next page """
+    roster_page = get_roster_page(request, roster)
+    persons = roster_page['persons']
 
     context = {
-        'CONFIDENTIALITY_LEVEL': CONFIDENTIALITY_LEVEL_CONFIDENTIAL,
         'persons': persons,
-        'buttons': button_dict,
-        'check_in_events': check_in_events,
-        'redirect_name': 'member_list',
+        'check_in_events': Event.get_current_event(),
+        'redirect_name': ROSTERS[roster]['view'],
     }
 
-    return render(request, f'subwaive/person/person-list.html', context)
+    return JsonResponse({
+        'html': render_to_string('subwaive/person/person-cards.html', context, request),
+        'persons': [
+            {
+                'id': p['id'],
+                'name': p['name'],
+                'preferred_email': p['preferred_email'],
+                'membership_status': p['membership_status'],
+                'last_check_in_time': p['last_check_in'].check_in_time.isoformat() if p['last_check_in'] else None,
+            }
+            for p in persons
+        ],
+        'total': roster_page['total'],
+        'next_query': roster_page['next_query'],
+    })
+
+
+ROSTERS = {
+    'all': {'persons': lambda: Person.objects.with_status(), 'view': 'person_list'},
+    'members': {'persons': lambda: Person.objects.members(), 'view': 'member_list'},
+}
 
 
 @login_required
 def member_email_list(request):
     """ Return a list of preferred emails for current members """
-    persons_prelim = Person.objects.all().order_by('name','preferred_email__email')
+    persons_prelim = Person.objects.members().select_related('preferred_email').order_by('name','preferred_email__email')
 
     persons = [
         {
             'name': p.name,
             'preferred_email': p.preferred_email
         }
-        for p in persons_prelim if p.check_membership_status()
+        for p in persons_prelim
     ]
 
     check_in_events = Event.get_current_event()
@@ -126,24 +209,13 @@ def person_search(request):
     results_prelim = None
     results = None
     if search_term:
-        results_prelim = Person.search(search_term)
+        results_prelim = Person.search(search_term).with_status().select_related('preferred_email')
 
     if results_prelim:
         if len(results_prelim) == 1:
             return redirect('person_card', results_prelim.first().id)
         else:
-            results = [
-                {
-                    'name': p.name,
-                    'id': p.id,
-                    'person_card': redirect('person_card', person_id=p.id).url,
-                    'preferred_email': p.preferred_email.email,
-                    'membership_status': p.check_membership_status(),
-                    'last_check_in': p.get_last_check_in(),
-                    'last_check_in_event_id_list': [ci.event.id for ci in PersonEvent.objects.filter(person=p, event__start__date=datetime.date.today())],
-                }
-                for p in results_prelim
-            ]
+            results = get_roster(results_prelim)
 
     check_in_events = Event.get_current_event()
        
@@ -296,20 +368,24 @@ def merge_people(request, merge_child_id, merge_parent_id=None):
             'emails': merge_child.get_email_list(),
             } 
         
-        persons = Person.objects.exclude(id=merge_child_id)
+        persons = Person.objects.exclude(id=merge_child_id).filter_roster(name_prefix=get_roster_filters(request)['name_prefix'])
+        persons = persons.prefetch_related(Prefetch('personemail_set', to_attr='emails'))
+        page, next_cursor = persons.page(decode_cursor(request.GET.get('cursor')), ROSTER_PAGE_SIZE)
 
         merge_parents = [
             {
                 'id': p.id,
                 'name': p.name,
-                'emails': p.get_email_list(),
+                'emails': p.emails,
                 } 
-            for p in persons
+            for p in page
             ]
 
         context = {
             'merge_parents': merge_parents,
             'merge_child': merge_child,
+            'filters': request.GET,
+            'next_query': get_next_query(request, next_cursor),
             'CONFIDENTIALITY_LEVEL': CONFIDENTIALITY_LEVEL_CONFIDENTIAL,
         }
 
@@ -317,6 +393,28 @@ def merge_people(request, merge_child_id, merge_parent_id=None):
     
     return return_object
 
+@login_required
+def duplicate_people(request):
+    """ a page listing clusters of likely duplicate people, any of which can be merged at once """
+    email_only = bool(request.GET.get('email_only'))
+    plans = duplicates.find_duplicates(use_names=not email_only)
+
+    if request.method == 'POST':
+        # plans are found again rather than posted, so only clusters that still exist are merged
+        plan_ids = set(request.POST.getlist('plan'))
+        selected = [plan for plan in plans if plan['id'] in plan_ids]
+        merges = duplicates.apply_plans(selected)
+        messages.success(request, f'Merged { len(merges) } people into { len(set(merges.values())) }')
+        return redirect(f"{ reverse('duplicate_people') }?{ request.GET.urlencode() }")
+
+    context = {
+        'plans': plans,
+        'email_only': email_only,
+        'CONFIDENTIALITY_LEVEL': CONFIDENTIALITY_LEVEL_CONFIDENTIAL,
+    }
+
+    return render(request, f'subwaive/person/person-duplicates.html', context)
+
 @login_required
 def unmerge_people(request, email_id):
     """ unmerge people """
@@ -349,6 +447,7 @@ def set_docuseal_name(request, person_id, important_field_id):
     name = DocusealFieldStore.objects.get(id=important_field_id).value
     person.name = name
     person.save()
+    PersonSearchToken.rebuild(person)
 
     messages.success(request, f'Name set to <em>{ name }</em>')
 
@@ -361,6 +460,7 @@ def set_stripe_name(request, person_id, customer_id):
     name = StripeCustomer.objects.get(id=customer_id).name
     person.name = name
     person.save()
+    PersonSearchToken.rebuild(person)
 
     messages.success(request, f'Name set to <em>{ name }</em>')
 
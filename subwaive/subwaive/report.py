@@ -1,37 +1,42 @@
 import datetime
+import os
 
 from django.contrib.auth.decorators import login_required, permission_required
+from django.core.cache import cache
+from django.db.models import Count, Sum
+from django.http import HttpResponse
 from django.shortcuts import render
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
 
-from subwaive.models import DocusealTemplate,PersonEvent
+from subwaive.models import DailyMembership, EventAttendance, PersonEvent, PersonWeekAttendance
+from subwaive.utils import CONFIDENTIALITY_LEVEL_CONFIDENTIAL
 
 """
 Trends
 """
 
+REPORT_CACHE_SECONDS = int(os.environ.get("REPORT_CACHE_SECONDS", 300))
+
+DATA_REFRESH_TOKEN = os.environ.get("DATA_REFRESH_TOKEN")
+
 @login_required
 def recent_member_activity(request, lag_days=60):
     """ Event attendance totals and by day-of-week """
     excludes = ['MakeFixHack-Volunteer-Agreement','Director-Independence-Questionnaire','MakeFixHack-Conflict-of-interest-Policy']
 
     cutoff_date = (datetime.datetime.now() - datetime.timedelta(days=lag_days)).date()
-    pe = PersonEvent.objects.filter(event__start__date__gte=cutoff_date)
+
+    cache_key = f"recent_member_activity:{ lag_days }:{ datetime.date.today().isoformat() }"
+    counts = cache.get(cache_key)
+    if counts is None:
+        counts = PersonEvent.count_by_weekday(cutoff_date, excludes)
+        cache.set(cache_key, counts, REPORT_CACHE_SECONDS)
 
     attendees = {}
-    for p in pe:
-        is_exclude = False
-        for d in DocusealTemplate.objects.filter(docusealsubmission__docusealsubmittersubmission__submitter__persondocuseal__person=p.person):
-            if any(x in d.name for x in excludes):
-                is_exclude = True
-            if not is_exclude:
-                person_name = p.person.name
-                if person_name not in attendees.keys():
-                    attendees[person_name] = {}
-                event_dow = p.event.start.date().weekday()
-                if event_dow in attendees[person_name].keys():
-                    attendees[person_name][p.event.start.date().weekday()] += 1
-                else:
-                    attendees[person_name][p.event.start.date().weekday()] = 1
+    for c in counts:
+        person_days = attendees.setdefault(c['person__name'], {})
+        person_days[c['weekday']] = person_days.get(c['weekday'], 0) + c['count']
 
     days = ['Monday', 'Tuesday','Wednesday','Thursday','Friday','Saturday','Sunday']
     
@@ -65,3 +70,62 @@ def recent_member_activity(request, lag_days=60):
         }
 
     return render(request, f'subwaive/reports/recent-member-activity.html', context)
+
+def attendance_trend(request, url_name, lag_days, title, columns, rows):
+    """ render a table from one of the attendance rollups """
+    button_dict = [
+        {'url': reverse('attendance_by_event', kwargs={'lag_days': lag_days}), 'anchor': 'By Event', 'active': url_name=='attendance_by_event'},
+        {'url': reverse('attendance_by_week', kwargs={'lag_days': lag_days}), 'anchor': 'By Week', 'active': url_name=='attendance_by_week'},
+        {'url': reverse('membership_by_day', kwargs={'lag_days': lag_days}), 'anchor': 'Members', 'active': url_name=='membership_by_day'},
+    ]
+    lag_options = [(days, reverse(url_name, kwargs={'lag_days': days})) for days in [90, 365, 365*5]]
+
+    context = {
+        'title': title,
+        'columns': columns,
+        'rows': rows,
+        'lag_days': lag_days,
+        'lag_options': lag_options,
+        'buttons': button_dict,
+        'CONFIDENTIALITY_LEVEL': CONFIDENTIALITY_LEVEL_CONFIDENTIAL,
+        }
+
+    return render(request, f'subwaive/reports/attendance-trend.html', context)
+
+@login_required
+def attendance_by_event(request, lag_days=365):
+    """ Check-ins per event """
+    cutoff_date = datetime.date.today() - datetime.timedelta(days=lag_days)
+    attendance = EventAttendance.objects.filter(date__gte=cutoff_date).select_related('event')
+    rows = [(a.date, a.event.summary, a.check_ins, a.people) for a in attendance]
+
+    return attendance_trend(request, 'attendance_by_event', lag_days, "Check-ins by Event", ['Date', 'Event', 'Check-ins', 'People'], rows)
+
+@login_required
+def attendance_by_week(request, lag_days=365):
+    """ Check-ins and people checking in per week """
+    cutoff_date = datetime.date.today() - datetime.timedelta(days=lag_days)
+    attendance = PersonWeekAttendance.objects.filter(week__gte=cutoff_date).values('week').annotate(check_ins=Sum('check_ins'), people=Count('person')).order_by('-week')
+    rows = [(a['week'], a['check_ins'], a['people']) for a in attendance]
+
+    return attendance_trend(request, 'attendance_by_week', lag_days, "Check-ins by Week", ['Week of', 'Check-ins', 'People'], rows)
+
+@login_required
+def membership_by_day(request, lag_days=365):
+    """ Memberships by status per day """
+    cutoff_date = datetime.date.today() - datetime.timedelta(days=lag_days)
+    rows = DailyMembership.objects.filter(date__gte=cutoff_date).values_list('date', 'active_members', 'inactive_members')
+
+    return attendance_trend(request, 'membership_by_day', lag_days, "Members by Day", ['Date', 'Active', 'Not Active'], rows)
+
+@csrf_exempt
+def rollup_attendance_by_token(request):
+    """ allow attendance rollups to be rebuilt by token """
+
+    if request.headers.get('X-Refresh-Token') == DATA_REFRESH_TOKEN:
+        print(datetime.datetime.now(), "Rolling up attendance by token")
+        PersonEvent.rebuild_rollups()
+
+        return HttpResponse(status=200)
+    else:
+        return HttpResponse(status=401)
@@ -78,8 +78,14 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'subwaive.middleware.LogBufferMiddleware',
+    'subwaive.middleware.SQLProfileMiddleware',
 ]
 
+# where SQLProfileMiddleware reports each request's SQL: 'log', 'header' or 'log,header'; empty turns it off
+SQL_PROFILE = os.environ.get('SQL_PROFILE', '')
+SQL_PROFILE_THRESHOLD = int(os.environ.get('SQL_PROFILE_THRESHOLD', 5))
+
 ROOT_URLCONF = 'subwaive.urls'
 
 TEMPLATES = [
@@ -33,4 +33,26 @@ function fallbackCopyToClipboard(text) {
   } finally {
     document.body.removeChild(textarea);
   }
-}
\ No newline at end of file
+}
+
+// Append the next page of a roster, fetched as JSON, to the element named by the link's data-target.
+// The link's href still points at the plain page, which is used if the fetch fails.
+async function loadMoreCards(link) {
+  try {
+    const response = await fetch(link.dataset.pageUrl, { credentials: 'same-origin' });
+    if (!response.ok) {
+      throw new Error(`Roster page returned ${response.status}`);
+    }
+    const page = await response.json();
+    document.getElementById(link.dataset.target).insertAdjacentHTML('beforeend', page.html);
+    if (page.next_query) {
+      link.href = `?${page.next_query}`;
+      link.dataset.pageUrl = `${link.dataset.pageUrl.split('?')[0]}?${page.next_query}`;
+    } else {
+      link.remove();
+    }
+  } catch (err) {
+    console.error('Failed to load the next roster page: ', err);
+    window.location = link.href;
+  }
+}
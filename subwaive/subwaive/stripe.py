@@ -5,12 +5,14 @@ import os
 
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render, redirect
 from django.views.decorators.csrf import csrf_exempt
 
 import stripe
 
+from subwaive.api_cache import stripe_cache
+from subwaive.models import WebhookEvent
 from subwaive.models import Log,StripeOneTimePayment,StripePaymentLink,StripePrice,StripeProduct,StripePaymentLinkPrice,StripeSubscription,StripeCustomer
 from subwaive.utils import generate_qr_svg, refresh, CONFIDENTIALITY_LEVEL_PUBLIC, QR_SMALL, QR_LARGE
 
@@ -99,19 +101,19 @@ def receive_webhook(request):
 
     try:
         if 'id' in payload.keys():
+            # the worker (manage.py process_webhooks) pulls the objects from the API
             if event.type in customer_events:
-                StripeCustomer.create_or_update(payload['id'])
+                WebhookEvent.enqueue('stripe', event.type, 'customer', payload['id'], payload)
 
             elif event.type in invoice_events:
                 if payload['subscription']: # subscription
-                    StripeSubscription.create_or_update(payload['subscription'])
+                    WebhookEvent.enqueue('stripe', event.type, 'subscription', payload['subscription'], payload)
                 
             elif event.type in checkout_events:
-                session = StripeOneTimePayment.get_session(payload['id'])
-                StripeOneTimePayment.create_if_needed(session)
+                WebhookEvent.enqueue('stripe', event.type, 'checkout_session', payload['id'], payload)
 
             elif event.type in payment_link_events:
-                StripePaymentLink.create_or_update(payload['id'])
+                WebhookEvent.enqueue('stripe', event.type, 'payment_link', payload['id'], payload)
 
             else:
                 # need to handle everything we use
@@ -120,7 +122,7 @@ def receive_webhook(request):
         else:
             Log.new(logging_level=logging.WARN, description="Unexpected Stripe webhook payload", json=payload, other_info=event.type)
 
-        Log.new(logging_level=logging.DEBUG, description="Stripe webhook handling complete", json=payload, other_info=event.type)
+        Log.new(logging_level=logging.DEBUG, description="Stripe webhook queued", json=payload, other_info=event.type)
         return HttpResponse(status=200)
     
     except json.JSONDecodeError as e:
@@ -227,6 +229,7 @@ def stripe_refresh_page(request):
                 {'description': 'StripeProduct'},
                 {'description': 'StripePrice'},
                 {'description': 'StripePaymentLink'},
+                {'description': 'StripePaymentLinkPrice'},
             ]
         },
         {
@@ -243,4 +246,9 @@ def stripe_refresh_page(request):
         },
     ]
 
-    return refresh(request, page_title, data_source, tiles, button_dict)
\ No newline at end of file
+    return refresh(request, page_title, data_source, tiles, button_dict)
+
+@login_required
+def stripe_cache_stats(request):
+    """ Report Stripe API cache hits and misses by object type """
+    return JsonResponse(stripe_cache.get_stats())
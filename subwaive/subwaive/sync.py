@@ -0,0 +1,169 @@
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import time
+import traceback
+
+from django.db import connections
+from django.utils import timezone
+
+from subwaive.models import CalendarEvent, Log, PersonEligibility, SyncState
+from subwaive.models import DocusealFieldStore, DocusealSubmission, DocusealSubmitter, DocusealTemplate
+from subwaive.models import StripeCustomer, StripeOneTimePayment, StripePaymentLink, StripePaymentLinkPrice, StripePrice, StripeProduct, StripeSubscription
+
+"""
+Sync orchestration
+
+Runs the refreshes of every external source outside the web server. Each task runs in its own worker
+process once the tasks it depends on have succeeded, so independent sources (the calendar, Docuseal and
+Stripe) refresh side by side while, for example, Stripe prices still wait for products. A task that
+fails or runs past its timeout is reported and the tasks that depend on it are skipped.
+Run it with `manage.py sync`.
+"""
+
+# seconds a task may run before its worker is stopped
+SYNC_TIMEOUT = int(os.environ.get("SYNC_TIMEOUT", 1800))
+SYNC_WORKERS = int(os.environ.get("SYNC_WORKERS", 4))
+
+STATUS_OK = 'ok'
+STATUS_ERROR = 'error'
+STATUS_TIMEOUT = 'timeout'
+STATUS_SKIPPED = 'skipped'
+
+# each task names its source, what it runs, the model whose rows it syncs and the tasks that must succeed first.
+# explicit tasks only run when --only names them
+TASKS = {
+    'event': {'source': 'calendar', 'model': CalendarEvent, 'after': [],
+        'run': lambda new_only: CalendarEvent.refresh()},
+    'docuseal_template': {'source': 'docuseal', 'model': DocusealTemplate, 'after': [],
+        'run': lambda new_only: DocusealTemplate.refresh(new_only)},
+    'docuseal_submitter': {'source': 'docuseal', 'model': DocusealSubmitter, 'after': [],
+        'run': lambda new_only: DocusealSubmitter.refresh(new_only)},
+    'docuseal_submission': {'source': 'docuseal', 'model': DocusealSubmission, 'after': ['docuseal_template', 'docuseal_submitter'],
+        'run': lambda new_only: DocusealSubmission.refresh(new_only)},
+    'docuseal_field_store': {'source': 'docuseal', 'model': DocusealFieldStore, 'after': ['docuseal_submission'],
+        'run': lambda new_only: DocusealFieldStore.refresh(new_only)},
+    'stripe_product': {'source': 'stripe', 'model': StripeProduct, 'after': [],
+        'run': lambda new_only: StripeProduct.refresh(new_only)},
+    'stripe_price': {'source': 'stripe', 'model': StripePrice, 'after': ['stripe_product'],
+        'run': lambda new_only: StripePrice.refresh(new_only)},
+    'stripe_payment_link': {'source': 'stripe', 'model': StripePaymentLink, 'after': [],
+        'run': lambda new_only: StripePaymentLink.refresh(new_only)},
+    'stripe_payment_link_price': {'source': 'stripe', 'model': StripePaymentLinkPrice, 'after': ['stripe_price', 'stripe_payment_link'],
+        'run': lambda new_only: StripePaymentLinkPrice.refresh()},
+    'stripe_customer': {'source': 'stripe', 'model': StripeCustomer, 'after': [],
+        'run': lambda new_only: StripeCustomer.refresh(new_only)},
+    'stripe_subscription': {'source': 'stripe', 'model': StripeSubscription, 'after': ['stripe_customer', 'stripe_price'],
+        'run': lambda new_only: StripeSubscription.refresh(new_only)},
+    'stripe_one_time_payment': {'source': 'stripe', 'model': StripeOneTimePayment, 'after': ['stripe_customer', 'stripe_payment_link_price'],
+        'run': lambda new_only: StripeOneTimePayment.refresh(new_only)},
+    # refreshes rebuild the snapshots of the people they touch, so rebuilding everyone is only done on request
+    'eligibility': {'source': 'subwaive', 'model': PersonEligibility, 'after': ['docuseal_field_store', 'stripe_subscription', 'stripe_one_time_payment'], 'explicit': True,
+        'run': lambda new_only: PersonEligibility.rebuild_all()},
+}
+
+def select(tasks, only=None):
+    """ return the names of tasks matching any of only (task names or sources), or all of them.
+    Explicit tasks are only returned when named """
+    if not only:
+        return [name for name, task in tasks.items() if not task.get('explicit')]
+    unknown = set(only) - set(tasks) - set(task['source'] for task in tasks.values())
+    if unknown:
+        raise ValueError(f"Unknown sync tasks or sources: { ', '.join(sorted(unknown)) }")
+    return [name for name, task in tasks.items() if name in only or (task['source'] in only and not task.get('explicit'))]
+
+def get_timeout(task_name, task, timeouts, default=SYNC_TIMEOUT):
+    """ return the timeout for a task, set by its name, then its source, then the default """
+    return timeouts.get(task_name, timeouts.get(task['source'], default))
+
+def run_task(task, new_only):
+    """ run one task with buffered logging and return its result. Refreshes log their own errors,
+    so the outcome is taken from the SyncState the task recorded, if it recorded one """
+    start = time.monotonic()
+    started_at = timezone.now()
+    try:
+        with Log.buffered():
+            counts = task['run'](new_only)
+        result = {'status': STATUS_OK, 'error': None}
+    except Exception as e:
+        counts = None
+        result = {'status': STATUS_ERROR, 'error': f"{ type(e).__name__ }: { e }"}
+    state = SyncState.objects.filter(source=task['source'], object_type=task['model'].__name__, last_run_at__gte=started_at).first()
+    if state and state.error and result['status'] == STATUS_OK:
+        result = {'status': STATUS_ERROR, 'error': state.error}
+    if state and not isinstance(counts, dict):
+        counts = {'inserted': state.inserted, 'updated': state.updated, 'removed': state.removed}
+    result['seconds'] = round(time.monotonic() - start, 3)
+    result['counts'] = counts if isinstance(counts, dict) else None
+    result['rows'] = task['model'].objects.count()
+    return result
+
+def run_in_worker(task, new_only, conn):
+    """ the body of a worker process: run a task and send its result back """
+    try:
+        result = run_task(task, new_only)
+    except Exception:
+        result = {'status': STATUS_ERROR, 'error': traceback.format_exc(limit=3), 'seconds': None, 'counts': None, 'rows': None}
+    conn.send(result)
+    conn.close()
+    connections.close_all()
+
+def run(tasks=TASKS, only=None, new_only=False, workers=SYNC_WORKERS, timeouts=None, default_timeout=SYNC_TIMEOUT):
+    """ run the selected tasks in dependency order, at most workers at a time, and return a result per task.
+    workers=0 runs every task in this process, one after the other, without timeouts. """
+    timeouts = timeouts or {}
+    selected = select(tasks, only)
+    # dependencies outside the selection are taken as already synced
+    pending = {name: [after for after in tasks[name]['after'] if after in selected] for name in selected}
+    results = {}
+    running = {}
+
+    def finish(name, result):
+        results[name] = dict(result, task=name, source=tasks[name]['source'])
+
+    while pending or running:
+        progressed = False
+        for name, after in list(pending.items()):
+            if any(results.get(a, {}).get('status') not in (None, STATUS_OK) for a in after):
+                del pending[name]
+                progressed = True
+                finish(name, {'status': STATUS_SKIPPED, 'error': "a task it depends on did not finish", 'seconds': None, 'counts': None, 'rows': None})
+            elif all(a in results for a in after) and (not workers or len(running) < workers):
+                del pending[name]
+                progressed = True
+                if not workers:
+                    finish(name, run_task(tasks[name], new_only))
+                    continue
+                # workers must open their own database connections rather than share this one
+                connections.close_all()
+                parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.get_context('fork').Process(target=run_in_worker, args=(tasks[name], new_only, child_conn), daemon=True)
+                process.start()
+                child_conn.close()
+                running[name] = (process, parent_conn, time.monotonic())
+
+        if not running:
+            if pending and not progressed:
+                raise ValueError(f"Sync tasks depend on each other in a cycle: { ', '.join(pending) }")
+            continue
+
+        multiprocessing.connection.wait([conn for _, conn, _ in running.values()], timeout=0.5)
+        for name, (process, conn, started) in list(running.items()):
+            if conn.poll():
+                finish(name, conn.recv())
+            elif not process.is_alive():
+                finish(name, {'status': STATUS_ERROR, 'error': f"worker exited with code { process.exitcode }", 'seconds': round(time.monotonic() - started, 3), 'counts': None, 'rows': None})
+            elif time.monotonic() - started > get_timeout(name, tasks[name], timeouts, default_timeout):
+                process.terminate()
+                finish(name, {'status': STATUS_TIMEOUT, 'error': f"stopped after { get_timeout(name, tasks[name], timeouts, default_timeout) } seconds", 'seconds': round(time.monotonic() - started, 3), 'counts': None, 'rows': None})
+            else:
+                continue
+            process.join(timeout=5)
+            conn.close()
+            del running[name]
+
+    summary = [results[name] for name in selected]
+    is_ok = all(result['status'] == STATUS_OK for result in summary)
+    Log.new(logging_level=logging.INFO if is_ok else logging.ERROR, description="Sync", json={'new_only': new_only, 'tasks': summary})
+    return summary
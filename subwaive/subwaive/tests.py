@@ -1,5 +1,37 @@
-from django.test import TestCase
-from subwaive.models import Person
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from unittest import mock
+from docuseal import docuseal
+import stripe
+import threading
+from subwaive import benchmark, duplicates, person, sync
+from subwaive.api_cache import APICache, stripe_cache
+from subwaive.fetch import fetch_all
+from subwaive.middleware import SQLProfileMiddleware
+from subwaive.models import DocusealField, DocusealFieldStore, DocusealSubmission, DocusealSubmitter, DocusealSubmitterSubmission, DocusealTemplate
+from subwaive.models import CalendarEvent, DailyMembership, Event, EventAttendance, PersonEvent, PersonWeekAttendance
+from subwaive.models import CacheVersion, NFC, NFCTerminal, QRCategory, QRCustom, nfc_hot_set
+from subwaive.models import Person, PersonDocuseal, PersonEligibility, PersonEmail, PersonSearchToken, PersonStripe
+from subwaive.models import StripeCustomer, StripeOneTimePayment, StripePaymentLink, StripePaymentLinkPrice, StripePrice, StripeProduct, StripeSubscription, StripeSubscriptionItem
+from subwaive.models import WEBHOOK_MAX_ATTEMPTS, WebhookEvent
+from subwaive.models import Log, LogBuffer
+from subwaive.models import SyncState, reconcile_stripe, stripe_list_args
+from subwaive.utils import QRCache, generate_qr_bitmap, generate_qr_modules, generate_qr_svg, qr_cache
+import datetime
+import icalendar
+import logging
+import pytz
+import qrcode
+import tempfile
 import time
 
 
@@ -19,4 +51,1394 @@ class PersonTestCase(TestCase):
         person2 = Person.objects.create(name="Person Two")
 
         self.assertNotEqual(person1.created_at, person2.created_at)
-        self.assertTrue(person1.created_at < person2.created_at)
\ No newline at end of file
+        self.assertTrue(person1.created_at < person2.created_at)
+
+class PersonEligibilityTestCase(TestCase):
+    def setUp(self):
+        self.person = Person.objects.create(name="Waivered User")
+        email = PersonEmail.objects.create(person=self.person, email="waivered@example.com")
+        self.person.preferred_email = email
+        self.person.save()
+
+        template = DocusealTemplate.objects.create(template_id=1, folder_name="Waivers", name="Waiver", slug="waiver")
+        submission = DocusealSubmission.objects.create(submission_id=1, status="completed", slug="submission", template=template)
+        submitter = DocusealSubmitter.objects.create(submitter_id=1, email="waivered@example.com", slug="submitter")
+        DocusealSubmitterSubmission.objects.create(submitter=submitter, submission=submission)
+        PersonDocuseal.objects.create(person=self.person, submitter=submitter)
+
+    def test_rebuild_captures_checks(self):
+        """A rebuilt snapshot should match the live checks"""
+        eligibility = PersonEligibility.rebuild(self.person)
+        self.assertTrue(eligibility.has_waiver)
+        self.assertIsNone(eligibility.membership_status)
+        self.assertFalse(eligibility.is_staff)
+        self.assertEqual(eligibility.event_dates, [])
+        self.assertIsNone(eligibility.last_check_in_date)
+
+    def test_user_changes_rebuild_the_staff_flag(self):
+        """Creating, demoting or re-addressing a staff user should update the snapshots of the people it matches"""
+        PersonEligibility.rebuild(self.person)
+        user = User.objects.create_user("staff", email="waivered@example.com", is_staff=True)
+        self.assertTrue(PersonEligibility.objects.get(person=self.person).is_staff)
+        user.email = "someone-else@example.com"
+        user.save()
+        self.assertFalse(PersonEligibility.objects.get(person=self.person).is_staff)
+        user.email = "waivered@example.com"
+        user.save()
+        self.assertTrue(PersonEligibility.objects.get(person=self.person).is_staff)
+        user.delete()
+        self.assertFalse(PersonEligibility.objects.get(person=self.person).is_staff)
+
+    def test_check_in_updates_snapshot(self):
+        """Checking in should update the last check-in date of an existing snapshot"""
+        PersonEligibility.rebuild(self.person)
+        self.person.check_in()
+        self.person.eligibility.refresh_from_db()
+        self.assertIsNotNone(self.person.eligibility.last_check_in_date)
+
+    def test_nfc_tap_reads_snapshot(self):
+        """An NFC tap by a known card should not recompute the checks"""
+        NFCTerminal.objects.create(token="terminal-token", location="Front Desk")
+        NFC.objects.create(uid="abc123", person=self.person, registration_id="r", activation_id="a", is_active=True)
+        PersonEligibility.rebuild(self.person)
+        nfc_hot_set.load()
+
+        # person + snapshot, current event, log: the terminal and card come from the hot set
+        with mock.patch.object(nfc_hot_set, 'check_seconds', 60), self.assertNumQueries(3):
+            response = self.client.post(reverse('nfc_self_serve'), {'uid': 'abc123'}, headers={'X-Self-Serve-Token': 'terminal-token'})
+        self.assertEqual(response.headers['line1'], 'Membership')
+
+
+class NFCHotSetTestCase(TestCase):
+    def setUp(self):
+        self.person = Person.objects.create(name="Card Holder")
+        PersonEligibility.rebuild(self.person)
+        PersonEligibility.objects.filter(person=self.person).update(has_waiver=True)
+        NFCTerminal.objects.create(token="terminal-token", location="Front Desk")
+        self.nfc = NFC.objects.create(uid="abc123", person=self.person, registration_id="r", activation_id="a", is_active=True)
+
+    def tap(self, uid="abc123", token="terminal-token"):
+        return self.client.post(reverse('nfc_self_serve'), {'uid': uid}, headers={'X-Self-Serve-Token': token})
+
+    def test_unknown_terminal_needs_no_queries(self):
+        """Once loaded, an unknown terminal should be turned away without touching the database"""
+        nfc_hot_set.load()
+        with mock.patch.object(nfc_hot_set, 'check_seconds', 60), self.assertNumQueries(0):
+            response = self.tap(token="wrong")
+        self.assertEqual(response.status_code, 401)
+
+    def test_saves_invalidate_this_process(self):
+        """Deactivating a card should take effect on the next tap"""
+        self.assertEqual(self.tap().headers['line1'], 'Membership')
+        self.nfc.is_active = False
+        self.nfc.save()
+        self.assertIsNone(nfc_hot_set.get_person_id("abc123"))
+        self.assertEqual(self.tap().headers['line1'], 'Check')
+
+    def test_only_changes_to_active_cards_bump_the_version(self):
+        """Taps by unknown cards and registering a card should not make other workers reload; activating, moving and deleting an active card should"""
+        version = CacheVersion.get(nfc_hot_set.name)
+        self.tap(uid="stray")
+        self.tap(uid="stray")
+        stray = NFC.objects.get(uid="stray")
+        stray.person = self.person
+        stray.save()
+        NFC.objects.filter(uid="stray-2").delete()
+        NFC.objects.create(uid="stray-2", registration_id="r2", activation_id="a2")
+        NFC.objects.filter(uid="stray-2").delete()
+        self.assertEqual(CacheVersion.get(nfc_hot_set.name), version)
+
+        stray.is_active = True
+        stray.save()
+        self.assertEqual(CacheVersion.get(nfc_hot_set.name), version + 1)
+        stray.save()
+        self.assertEqual(CacheVersion.get(nfc_hot_set.name), version + 1)
+        stray.person = Person.objects.create(name="Someone Else")
+        stray.save()
+        self.assertEqual(CacheVersion.get(nfc_hot_set.name), version + 2)
+        NFC.objects.filter(uid="stray").delete()
+        self.assertEqual(CacheVersion.get(nfc_hot_set.name), version + 3)
+        self.assertIsNone(nfc_hot_set.get_person_id("stray"))
+
+    def test_other_processes_invalidate_through_the_version(self):
+        """A change made by another worker should be picked up once the check interval passes"""
+        nfc_hot_set.load()
+        # another worker deactivates the card with a queryset update and bumps the version
+        NFC.objects.filter(uid="abc123").update(is_active=False)
+        CacheVersion.objects.filter(name=nfc_hot_set.name).update(version=F('version') + 1)
+        with mock.patch.object(nfc_hot_set, 'check_seconds', 60):
+            self.assertEqual(nfc_hot_set.get_person_id("abc123"), self.person.id)
+        with mock.patch.object(nfc_hot_set, 'check_seconds', 0):
+            self.assertIsNone(nfc_hot_set.get_person_id("abc123"))
+
+    def test_terminals_choose_the_qr_format(self):
+        """Old firmware should still get the bitmap; terminals asking for modules get the packed matrix"""
+        # no membership, so the tap answers with a QR code for the membership page
+        response = self.tap()
+        self.assertEqual((response.headers['line1'], response['Content-Type']), ('Membership', "text/bitmap"))
+        (bmp, qr_size) = generate_qr_bitmap("https://www.makefixhack.org/p/membership-and-donation.html")
+        self.assertEqual((response.content, response.headers['qr_size']), (bmp, str(qr_size)))
+
+        response = self.client.post(reverse('nfc_self_serve'), {'uid': "abc123"}, headers={'X-Self-Serve-Token': "terminal-token", 'X-QR-Format': "modules"})
+        self.assertEqual(response['Content-Type'], "application/x-qr-modules")
+        (modules, qr_size) = generate_qr_modules("https://www.makefixhack.org/p/membership-and-donation.html")
+        self.assertEqual((response.content, response.headers['qr_size']), (modules, str(qr_size)))
+
+    def test_merge_moves_cards_in_the_hot_set(self):
+        """Merging a card holder into someone else should point the card at them"""
+        kept = Person.objects.create(name="Kept")
+        nfc_hot_set.load()
+        kept.merge(self.person.id)
+        self.assertEqual(nfc_hot_set.get_person_id("abc123"), kept.id)
+
+
+class PersonWithStatusTestCase(TestCase):
+    def setUp(self):
+        product = StripeProduct.objects.create(stripe_id="prod_1", name="Membership", description="Monthly membership")
+        price = StripePrice.objects.create(stripe_id="price_1", name="Monthly", interval="month", price=5000, product=product)
+        for name, status in [("Active Member", "active"), ("Lapsed Member", "past_due")]:
+            person = Person.objects.create(name=name)
+            customer = StripeCustomer.objects.create(stripe_id=f"cus_{ status }", name=name, email=f"{ status }@example.com")
+            PersonStripe.objects.create(person=person, customer=customer)
+            subscription = StripeSubscription.objects.create(stripe_id=f"sub_{ status }", customer=customer, status=status, name="self")
+            StripeSubscriptionItem.objects.create(stripe_id=f"si_{ status }", subscription=subscription, price=price)
+        Person.objects.create(name="Not A Member")
+
+    def test_with_status_matches_per_person_checks(self):
+        """Annotated membership status should match check_membership_status()"""
+        for person in Person.objects.with_status():
+            self.assertEqual(person.membership_status, person.check_membership_status())
+
+    def test_with_status_query_count_is_constant(self):
+        """The roster should not issue queries per person"""
+        person = Person.objects.get(name="Active Member")
+        person.check_in()
+        with self.assertNumQueries(3):
+            persons = list(Person.objects.with_status())
+            self.assertEqual(len(persons), 3)
+            self.assertEqual([p.recent_check_ins for p in persons if p.id == person.id][0][0].person_id, person.id)
+
+    def test_bulk_eligibility_matches_per_person_checks(self):
+        """Snapshots rebuilt together should match the live checks, in the same number of queries however many people there are"""
+        active = Person.objects.get(name="Active Member")
+        PersonEmail.objects.create(person=active, email="active@example.com")
+        User.objects.create_user("staff", email="active@example.com", is_staff=True)
+        event = Event.objects.create(summary="Open Shop", description="", start=datetime.datetime(2026, 5, 1, 23, tzinfo=datetime.timezone.utc), end=datetime.datetime(2026, 5, 2, 2, tzinfo=datetime.timezone.utc))
+        active.check_in(event.id)
+        Person.objects.get(name="Lapsed Member").check_in()
+        payment_link = StripePaymentLink.objects.create(stripe_id="plink_1", url="https://buy.stripe.com/1", date=datetime.date(2026, 6, 1))
+        StripePaymentLinkPrice.objects.create(payment_link=payment_link, price=StripePrice.objects.get())
+        for i in range(2):
+            StripeOneTimePayment.objects.create(stripe_id=f"cs_{ i }", customer=StripeCustomer.objects.get(stripe_id="cus_active"), date=payment_link.date, status="complete", payment_link=payment_link)
+
+        # person ids, event dates, checks, the write and a log entry
+        with self.assertNumQueries(5):
+            snapshots = PersonEligibility.rebuild_persons(Person.objects.all())
+        for person in Person.objects.all():
+            snapshot = PersonEligibility.objects.get(person=person)
+            user = person.get_user()
+            self.assertEqual(
+                (snapshot.has_waiver, snapshot.membership_status, snapshot.is_staff, snapshot.event_dates, snapshot.last_check_in_date),
+                (person.check_waiver_status(), person.check_membership_status(), bool(user and user.is_staff), sorted(set(e['date'].isoformat() for e in person.get_events())), PersonEligibility.get_last_check_in_date(person.get_last_check_in())))
+        self.assertEqual(len(snapshots), 3)
+        self.assertEqual(PersonEligibility.objects.get(person=active).event_dates, ["2026-06-01"])
+
+    def test_members_excludes_non_members(self):
+        """members() should only return people with a membership"""
+        self.assertEqual(sorted(p.name for p in Person.objects.members()), ["Active Member", "Lapsed Member"])
+
+    def test_roster_views_render(self):
+        """Roster pages should render from the annotated queryset"""
+        self.client.force_login(User.objects.create_user(username="staff"))
+        for url_name in ['person_list', 'member_list', 'member_email_list']:
+            response = self.client.get(reverse(url_name))
+            self.assertContains(response, "Active Member")
+        response = self.client.post(reverse('person_search'), {'search_term': 'Member'})
+        self.assertEqual(response.status_code, 200)
+
+
+class RosterPageTestCase(TestCase):
+    def setUp(self):
+        product = StripeProduct.objects.create(stripe_id="prod_1", name="Membership", description="Monthly membership")
+        price = StripePrice.objects.create(stripe_id="price_1", name="Monthly", interval="month", price=5000, product=product)
+        for name, status in [("Alice Active", "active"), ("Bob Lapsed", "past_due")]:
+            p = Person.objects.create(name=name)
+            customer = StripeCustomer.objects.create(stripe_id=f"cus_{ status }", name=name, email=f"{ status }@example.com")
+            PersonStripe.objects.create(person=p, customer=customer)
+            subscription = StripeSubscription.objects.create(stripe_id=f"sub_{ status }", customer=customer, status=status, name="self")
+            StripeSubscriptionItem.objects.create(stripe_id=f"si_{ status }", subscription=subscription, price=price)
+        # two people share a name so the cursor has to break the tie on id
+        for name in ["Carol None", "Carol None", "Dave None"]:
+            p = Person.objects.create(name=name)
+            PersonEmail.objects.create(person=p, email=f"{ p.id }@example.com")
+        self.client.force_login(User.objects.create_user(username="staff"))
+
+    def test_filter_roster_by_status(self):
+        """Status filters should select members, lapsed members, non-members or one Stripe status"""
+        persons = Person.objects.with_membership_status()
+        self.assertEqual(sorted(p.name for p in persons.filter_roster(status='member')), ["Alice Active", "Bob Lapsed"])
+        self.assertEqual([p.name for p in persons.filter_roster(status='lapsed')], ["Bob Lapsed"])
+        self.assertEqual([p.name for p in persons.filter_roster(status='active')], ["Alice Active"])
+        self.assertEqual(sorted(p.name for p in persons.filter_roster(status='none')), ["Carol None", "Carol None", "Dave None"])
+        self.assertEqual([p.name for p in persons.filter_roster(name_prefix="da")], ["Dave None"])
+
+    def test_filter_roster_by_last_check_in(self):
+        """The check-in range should apply to each person's most recent check-in"""
+        alice = Person.objects.get(name="Alice Active")
+        bob = Person.objects.get(name="Bob Lapsed")
+        last_month = datetime.datetime.now(tz=pytz.utc) - datetime.timedelta(days=30)
+        # check_in_time is set on insert, so older check-ins are backdated afterwards
+        old_check_ins = [PersonEvent.objects.create(person=alice).id, PersonEvent.objects.create(person=bob).id]
+        PersonEvent.objects.filter(id__in=old_check_ins).update(check_in_time=last_month)
+        PersonEvent.objects.create(person=bob)
+        week_ago = datetime.date.today() - datetime.timedelta(days=7)
+        self.assertEqual([p.name for p in Person.objects.filter_roster(checked_in_from=week_ago)], ["Bob Lapsed"])
+        self.assertEqual([p.name for p in Person.objects.filter_roster(checked_in_to=week_ago)], ["Alice Active"])
+
+    def test_page_walks_every_person_once(self):
+        """Following the cursor should visit everyone in (name, id) order without repeats"""
+        seen = []
+        after = None
+        while True:
+            page, after = Person.objects.page(after, page_size=2)
+            seen += [p.id for p in page]
+            if not after:
+                break
+        self.assertEqual(seen, list(Person.objects.order_by('name', 'id').values_list('id', flat=True)))
+
+    def test_roster_streams_in_json_pages(self):
+        """The first page renders with a link to the next, and the JSON endpoint returns the rest"""
+        with mock.patch.object(person, 'ROSTER_PAGE_SIZE', 3):
+            response = self.client.get(reverse('person_list'), {'status': 'none'})
+            self.assertContains(response, "Dave None")
+            self.assertEqual(response.context['total'], 3)
+            self.assertIsNone(response.context['next_query'])
+
+            response = self.client.get(reverse('person_list'))
+            self.assertContains(response, "Carol None", count=1)
+            self.assertNotContains(response, "Dave None")
+            self.assertEqual(response.context['total'], 5)
+            page = self.client.get(f"{ reverse('person_list_page') }?{ response.context['next_query'] }").json()
+        self.assertEqual([p['name'] for p in page['persons']], ["Carol None", "Dave None"])
+        self.assertIn("Dave None", page['html'])
+        self.assertIsNone(page['next_query'])
+
+    def test_malformed_cursor_starts_at_first_page(self):
+        """A cursor that does not decode should be ignored rather than fail"""
+        response = self.client.get(reverse('member_list_page'), {'cursor': "not-a-cursor", 'checked_in_from': "2025-02-30"})
+        self.assertEqual([p['name'] for p in response.json()['persons']], ["Alice Active", "Bob Lapsed"])
+
+    def test_merge_page_filters_and_prefetches_emails(self):
+        """The merge page should filter by name and not query emails per person"""
+        child = Person.objects.get(name="Alice Active")
+        response = self.client.get(reverse('merge_people', args=[child.id]), {'name': "Carol"})
+        self.assertContains(response, "Carol None", count=4)
+        self.assertNotContains(response, "Dave None")
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('merge_people', args=[child.id]), {'name': "Carol"})
+        with CaptureQueriesContext(connection) as more:
+            self.client.get(reverse('merge_people', args=[child.id]))
+        self.assertEqual(len(few), len(more))
+
+
+class PersonMergeTestCase(TestCase):
+    def setUp(self):
+        self.event = Event.objects.create(summary="Open Shop", description="", start=datetime.datetime.now(datetime.timezone.utc), end=datetime.datetime.now(datetime.timezone.utc))
+        self.persons = []
+        for i, email in enumerate(["pat@example.com", "Pat@example.com", "pat.work@example.com"]):
+            p = Person.objects.create(name=f"Pat { i }")
+            p.preferred_email = PersonEmail.objects.create(person=p, email=email)
+            p.save()
+            p.check_in(self.event.id)
+            customer = StripeCustomer.objects.create(stripe_id=f"cus_{ i }", name="Pat", email=email)
+            PersonStripe.objects.create(person=p, customer=customer)
+            self.persons.append(p)
+        # the third person shares their work email with the second, so all three are one person
+        PersonEmail.objects.create(person=self.persons[1], email="pat.work@example.com")
+        NFC.objects.create(uid="card", person=self.persons[2], registration_id="r", activation_id="a", is_active=True)
+
+    def test_merge_many_moves_everything_once(self):
+        """Merging should move every association to the kept person without duplicate check-ins or emails"""
+        kept = self.persons[0]
+        merges = Person.merge_many({self.persons[2].id: self.persons[1].id, self.persons[1].id: kept.id})
+        self.assertEqual(merges, {self.persons[2].id: kept.id, self.persons[1].id: kept.id})
+        self.assertEqual(list(Person.objects.all()), [kept])
+        self.assertEqual(PersonEvent.objects.filter(person=kept).count(), 1)
+        self.assertEqual(sorted(PersonEmail.objects.filter(person=kept).values_list('email', flat=True)), ["Pat@example.com", "pat.work@example.com", "pat@example.com"])
+        self.assertEqual(PersonStripe.objects.filter(person=kept).count(), 3)
+        self.assertEqual(NFC.objects.get().person, kept)
+        self.assertEqual(self.event.attendance.check_ins, 1)
+
+    def test_merge_many_is_atomic(self):
+        """A failure part way through a merge should leave everyone as they were"""
+        with mock.patch.object(PersonEvent, 'update_rollups', side_effect=RuntimeError("boom")), self.assertRaises(RuntimeError):
+            Person.merge_many({self.persons[1].id: self.persons[0].id})
+        self.assertEqual(Person.objects.count(), 3)
+        self.assertEqual(PersonEmail.objects.filter(person=self.persons[1]).count(), 2)
+
+    def test_merge_cycles_are_rejected(self):
+        """A merge plan that loops back on itself should be refused"""
+        with self.assertRaises(ValueError):
+            Person.merge_many({self.persons[0].id: self.persons[1].id, self.persons[1].id: self.persons[0].id})
+
+    def test_merge_by_email(self):
+        """People sharing emails, directly or through someone else, should merge into the oldest"""
+        plans = duplicates.find_duplicates(use_names=False)
+        self.assertEqual([(plan['keep'], plan['merge']) for plan in plans], [(self.persons[0], self.persons[1:])])
+        with mock.patch('builtins.print'):
+            call_command('find_duplicates', '--email-only', '--apply')
+        self.assertEqual(list(Person.objects.all()), [self.persons[0]])
+        self.assertEqual(duplicates.find_duplicates(use_names=False), [])
+
+    def test_merge_query_count_does_not_grow_with_rows(self):
+        """Merging should update each table once rather than save each row"""
+        def count_merge_queries(rows):
+            parent = Person.objects.create(name="Parent")
+            child = Person.objects.create(name="Child")
+            for i in range(rows):
+                PersonEmail.objects.create(person=child, email=f"child{ child.id }.{ i }@example.com")
+                PersonEvent.objects.create(person=child)
+            with CaptureQueriesContext(connection) as queries:
+                parent.merge(child.id)
+            return len(queries)
+
+        self.assertEqual(count_merge_queries(1), count_merge_queries(10))
+
+    def test_unmerge_returns_other_accounts(self):
+        """Unmerging an email should split off its accounts and keep the person's others"""
+        person = self.persons[1]
+        person.merge(self.persons[2].id)
+        preferred = person.preferred_email
+        preferred.unmerge()
+
+        person.refresh_from_db()
+        self.assertEqual(person.preferred_email.email, "pat.work@example.com")
+        self.assertEqual(sorted(person.personstripe_set.values_list('customer__stripe_id', flat=True)), ["cus_2"])
+        split = Person.objects.get(personemail__email="Pat@example.com")
+        self.assertEqual(split.name, "Pat")
+        self.assertEqual(list(split.personstripe_set.values_list('customer__stripe_id', flat=True)), ["cus_1"])
+
+
+class DuplicatePeopleTestCase(TestCase):
+    def setUp(self):
+        self.pat = Person.objects.create(name="Pat Lee")
+        PersonEmail.objects.create(person=self.pat, email="pat.lee@gmail.com")
+        # created by Stripe under a tagged address, and by Docuseal under a work address
+        self.pat_stripe = Person.objects.create(name="patlee+shop@gmail.com")
+        PersonEmail.objects.create(person=self.pat_stripe, email="PatLee+shop@gmail.com")
+        self.pat_docuseal = Person.objects.create(name="pat@work.example.com")
+        PersonEmail.objects.create(person=self.pat_docuseal, email="pat@work.example.com")
+        submitter = DocusealSubmitter.objects.create(submitter_id=1, email="pat@work.example.com", slug="s1")
+        submission = DocusealSubmission.objects.create(submission_id=1, status='completed', slug="sub1")
+        DocusealSubmitterSubmission.objects.create(submitter=submitter, submission=submission)
+        PersonDocuseal.objects.create(person=self.pat_docuseal, submitter=submitter)
+        DocusealFieldStore.objects.create(submission=submission, field=DocusealField.objects.create(field="Full Name"), value="Pat Q. Lee")
+        DocusealFieldStore.objects.create(submission=submission, field=DocusealField.objects.create(field="Emergency Contact Name"), value="Sam Other")
+        DocusealFieldStore.objects.create(submission=submission, field=DocusealField.objects.create(field="Minor's Name"), value="Sam Other")
+        DocusealFieldStore.objects.create(submission=submission, field=DocusealField.objects.create(field="Participant Name"), value="Sam Other")
+        self.sam = Person.objects.create(name="Sam Other")
+
+    def test_normalize_email(self):
+        """Case, +tags and Gmail dots should not tell addresses apart"""
+        self.assertEqual(duplicates.normalize_email(" Pat.Lee+shop@GoogleMail.com"), "patlee@gmail.com")
+        self.assertEqual(duplicates.normalize_email("pat.lee+shop@example.com"), "pat.lee@example.com")
+        self.assertIsNone(duplicates.normalize_email("not an email"))
+
+    def test_clusters_by_email_and_docuseal_name(self):
+        """People should join by normalized email, and separately by the name typed into Docuseal, but not by an emergency contact or a minor"""
+        plans = duplicates.find_duplicates()
+        self.assertEqual([(plan['id'], plan['keep'], plan['merge'], plan['reasons']) for plan in plans], [
+            (f"email-{ self.pat.id }", self.pat, [self.pat_stripe], ["email patlee@gmail.com"]),
+            (f"name-{ self.pat.id }", self.pat, [self.pat_docuseal], ["name pat lee"]),
+        ])
+
+        plans = duplicates.find_duplicates(use_names=False)
+        self.assertEqual([plan['merge'] for plan in plans], [[self.pat_stripe]])
+
+    def test_command_lists_then_applies(self):
+        """The command should only merge with --apply, and then only people who share an email"""
+        with mock.patch('builtins.print'):
+            call_command('find_duplicates')
+        self.assertEqual(Person.objects.count(), 4)
+        with mock.patch('builtins.print'):
+            call_command('find_duplicates', '--apply')
+        self.assertEqual(sorted(Person.objects.values_list('name', flat=True)), ["Pat Lee", "Sam Other", "pat@work.example.com"])
+        self.assertEqual(PersonDocuseal.objects.get().person, self.pat_docuseal)
+
+    def test_view_merges_selected_plans(self):
+        """The page should list the clusters, select only those joined by an email, and merge the ones selected"""
+        self.client.force_login(User.objects.create_user(username="staff"))
+        response = self.client.get(reverse('duplicate_people'))
+        self.assertContains(response, "pat@work.example.com")
+        self.assertContains(response, f'value="email-{ self.pat.id }" id="plan-email-{ self.pat.id }" checked>', html=False)
+        self.assertContains(response, f'value="name-{ self.pat.id }" id="plan-name-{ self.pat.id }">', html=False)
+        response = self.client.post(reverse('duplicate_people'), {'plan': []})
+        self.assertEqual(Person.objects.count(), 4)
+        response = self.client.post(f"{ reverse('duplicate_people') }?email_only=1", {'plan': [f"email-{ self.pat.id }"]})
+        self.assertRedirects(response, f"{ reverse('duplicate_people') }?email_only=1")
+        self.assertEqual(Person.objects.count(), 3)
+        self.assertFalse(Person.objects.filter(id=self.pat_stripe.id).exists())
+        self.client.post(reverse('duplicate_people'), {'plan': [f"name-{ self.pat.id }"]})
+        self.assertEqual(sorted(Person.objects.values_list('name', flat=True)), ["Pat Lee", "Sam Other"])
+
+
+class EventDetailsTestCase(TestCase):
+    def setUp(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.event = Event.objects.create(summary="Open Shop", description="", start=now, end=now+datetime.timedelta(hours=3))
+        product = StripeProduct.objects.create(stripe_id="prod_1", name="Membership", description="Monthly membership")
+        price = StripePrice.objects.create(stripe_id="price_1", name="Monthly", interval="month", price=5000, product=product)
+        template = DocusealTemplate.objects.create(template_id=1, folder_name="Waivers", name="Waiver", slug="waiver")
+        payment_link = StripePaymentLink.objects.create(stripe_id="plink_1", url="https://buy.stripe.com/1", date=now.date())
+
+        self.persons = {}
+        for i, (name, status, has_waiver) in enumerate([("Member", "active", True), ("Lapsed", "past_due", True), ("Unwaivered", "active", False), ("Guest", None, True)]):
+            person = Person.objects.create(name=name)
+            self.persons[name] = person
+            customer = StripeCustomer.objects.create(stripe_id=f"cus_{ i }", name=name, email=f"{ i }@example.com")
+            PersonStripe.objects.create(person=person, customer=customer)
+            if status:
+                subscription = StripeSubscription.objects.create(stripe_id=f"sub_{ i }", customer=customer, status=status, name="self")
+                StripeSubscriptionItem.objects.create(stripe_id=f"si_{ i }", subscription=subscription, price=price)
+            if has_waiver:
+                submission = DocusealSubmission.objects.create(submission_id=i, status="completed", slug=f"submission{ i }", template=template)
+                submitter = DocusealSubmitter.objects.create(submitter_id=i, email=f"{ i }@example.com", slug=f"submitter{ i }")
+                DocusealSubmitterSubmission.objects.create(submitter=submitter, submission=submission)
+                PersonDocuseal.objects.create(person=person, submitter=submitter)
+            StripeOneTimePayment.objects.create(stripe_id=f"cs_{ i }", customer=customer, date=now.date(), status="complete", payment_link=payment_link)
+        self.client.force_login(User.objects.create_user(username="staff"))
+
+    def get_details(self, **params):
+        return self.client.get(reverse('event_details', args=[self.event.id]), params)
+
+    def test_bulk_checks_match_per_person_checks(self):
+        """Annotated waiver and membership flags should match the per-person checks"""
+        for person in Person.objects.with_membership_status().with_waiver_status():
+            self.assertEqual(person.membership_status, person.check_membership_status())
+            self.assertEqual(person.has_waiver, person.check_waiver_status())
+
+    def test_details_lists_issues_candidates_and_payees(self):
+        """Attendees with issues, people who could check in and unattended payees should be listed"""
+        for name in ["Member", "Lapsed", "Unwaivered"]:
+            self.persons[name].check_in(self.event.id)
+        context = self.get_details().context
+        self.assertEqual([p.name for p in context['persons']], ["Lapsed", "Member", "Unwaivered"])
+        self.assertEqual({i['person'].name: (i.get('membership'), i.get('waiver')) for i in context['check_in_issues']},
+            {"Lapsed": ('inactive', None), "Unwaivered": (None, True)})
+        self.assertEqual([p['name'] for p in context['possible_check_ins']], ["Guest"])
+        self.assertEqual([ec['person'].name for ec in context['event_customers']], ["Guest"])
+
+    def test_query_count_does_not_grow_with_attendees(self):
+        """The page should cost the same number of queries however many people attend"""
+        self.persons["Member"].check_in(self.event.id)
+        with CaptureQueriesContext(connection) as one_attendee:
+            self.get_details()
+        for name in ["Lapsed", "Unwaivered", "Guest"]:
+            self.persons[name].check_in(self.event.id)
+        with self.assertNumQueries(len(one_attendee)):
+            self.get_details()
+
+    def test_candidates_are_bounded_and_searchable(self):
+        """The add form should list at most EVENT_CANDIDATE_LIMIT people, narrowed by a search term"""
+        PersonSearchToken.rebuild_all()
+        with mock.patch('subwaive.event.EVENT_CANDIDATE_LIMIT', 2):
+            context = self.get_details().context
+            self.assertEqual(len(context['possible_check_ins']), 2)
+            self.assertTrue(context['is_candidate_list_truncated'])
+            context = self.get_details(candidate="lap").context
+            self.assertEqual([p['name'] for p in context['possible_check_ins']], ["Lapsed"])
+            self.assertFalse(context['is_candidate_list_truncated'])
+
+
+class ReconcileStripeTestCase(TestCase):
+    def api_products(self, *products):
+        return [stripe.StripeObject.construct_from({'id': stripe_id, 'name': name, 'description': None, 'created': created}, None) for stripe_id, name, created in products]
+
+    def test_full_sync_inserts_updates_and_removes(self):
+        """A full sync should only write what changed and remove what the API no longer lists"""
+        reconcile_stripe(StripeProduct, self.api_products(("prod_1", "Membership", 100), ("prod_2", "Day Pass", 200)), StripeProduct.dict_from_api)
+        unchanged = StripeProduct.objects.get(stripe_id="prod_1")
+
+        counts = reconcile_stripe(StripeProduct, self.api_products(("prod_1", "Membership", 100), ("prod_3", "Donation", 300)), StripeProduct.dict_from_api)
+        self.assertEqual(counts, {'inserted': 1, 'updated': 0, 'removed': 1, 'skipped': 0})
+        self.assertEqual(StripeProduct.objects.get(stripe_id="prod_1").id, unchanged.id)
+        self.assertFalse(StripeProduct.objects.filter(stripe_id="prod_2").exists())
+
+        counts = reconcile_stripe(StripeProduct, self.api_products(("prod_1", "Membership!", 100), ("prod_3", "Donation", 300)), StripeProduct.dict_from_api)
+        self.assertEqual(counts['updated'], 1)
+        self.assertEqual(StripeProduct.objects.get(stripe_id="prod_1").name, "Membership!")
+
+    def test_new_only_sync_keeps_rows_and_stores_cursor(self):
+        """A partial sync should not remove rows and should advance the cursor"""
+        reconcile_stripe(StripeProduct, self.api_products(("prod_1", "Membership", 100)), StripeProduct.dict_from_api)
+        reconcile_stripe(StripeProduct, self.api_products(("prod_2", "Day Pass", 200)), StripeProduct.dict_from_api, new_only=True)
+
+        self.assertEqual(StripeProduct.objects.count(), 2)
+        self.assertEqual(stripe_list_args(StripeProduct, new_only=True), {'created': {'gte': 200}})
+        self.assertEqual(stripe_list_args(StripeProduct), {})
+
+    def test_only_people_linked_to_changed_rows_are_rebuilt(self):
+        """A sync should rebuild eligibility for the people whose customers changed or were removed, and nobody else"""
+        persons = {}
+        for stripe_id, name in [("cus_1", "Changed"), ("cus_2", "Unchanged"), ("cus_3", "Removed")]:
+            persons[name] = Person.objects.create(name=name)
+            PersonStripe.objects.create(person=persons[name], customer=StripeCustomer.objects.create(stripe_id=stripe_id, name=name, email=f"{ stripe_id }@example.com"))
+        api_customers = [{'id': "cus_1", 'name': "Changed Name", 'email': "cus_1@example.com"}, {'id': "cus_2", 'name': "Unchanged", 'email': "cus_2@example.com"}]
+
+        with mock.patch.object(PersonEligibility, 'rebuild_persons') as rebuild_persons:
+            reconcile_stripe(StripeCustomer, api_customers, StripeCustomer.dict_from_api, persons=['personstripe__customer'])
+        self.assertEqual(sorted(person.name for person in rebuild_persons.call_args.args[0]), ["Changed", "Removed"])
+
+
+class SyncStateTestCase(TestCase):
+    def submitter_page(self, *submitter_ids):
+        return {'data': [{'id': i, 'email': f"user{ i }@example.com", 'slug': f"u{ i }"} for i in submitter_ids], 'pagination': {'next': None}}
+
+    def test_incremental_sync_of_an_empty_table_records_a_cursor(self):
+        """A new-only sync of an empty table should list from the start and store the highest id as its cursor"""
+        with mock.patch('docuseal.docuseal.list_submitters', return_value=self.submitter_page(3, 5)) as list_submitters:
+            DocusealSubmitter.refresh(new_only=True)
+        list_submitters.assert_called_once_with({'limit': 100})
+
+        state = SyncState.objects.get(source='docuseal', object_type='DocusealSubmitter')
+        self.assertEqual((state.cursor, state.inserted, state.error), ('5', 2, None))
+        self.assertIsNotNone(state.duration)
+
+        with mock.patch('docuseal.docuseal.list_submitters', return_value=self.submitter_page()) as list_submitters:
+            DocusealSubmitter.refresh(new_only=True)
+        list_submitters.assert_called_once_with({'limit': 100, 'before': 5})
+
+    def test_errors_are_recorded_and_keep_the_cursor(self):
+        """A failed sync should store its error without moving the cursor"""
+        SyncState.record('docuseal', 'DocusealSubmitter', cursor=5)
+        with mock.patch('docuseal.docuseal.list_submitters', side_effect=Exception("API down")):
+            DocusealSubmitter.refresh(new_only=True)
+
+        state = SyncState.objects.get(source='docuseal', object_type='DocusealSubmitter')
+        self.assertEqual((state.cursor, state.error), ('5', "Exception: API down"))
+
+        summary = sync.run({'submitter': {'source': 'docuseal', 'model': DocusealSubmitter, 'after': [], 'run': lambda new_only: DocusealSubmitter.refresh(new_only)}}, workers=0)
+        self.assertEqual(summary[0]['status'], sync.STATUS_ERROR)
+
+    def test_refresh_page_reads_states_in_one_query(self):
+        """The refresh page should show every object type's last sync from a single query"""
+        self.client.force_login(User.objects.create_superuser("admin"))
+        SyncState.record('stripe', 'StripeProduct', counts={'inserted': 4}, duration=2)
+        SyncState.record('stripe', 'StripeCustomer', duration=1, error="Exception: API down")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('stripe_refresh'))
+        self.assertEqual(len([q for q in queries if 'subwaive_syncstate' in q['sql']]), 1)
+        self.assertContains(response, "4 inserted, 0 updated, 0 removed")
+        self.assertContains(response, "Exception: API down")
+
+
+class ExternalIdConstraintTestCase(TestCase):
+    def test_duplicate_external_ids_are_rejected(self):
+        """External ids should be unique"""
+        StripeProduct.objects.create(stripe_id="prod_1", name="Membership", description="")
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            StripeProduct.objects.create(stripe_id="prod_1", name="Membership", description="")
+
+    def test_repeat_check_ins(self):
+        """Checking in to an event twice should return the first check-in, check-ins without an event are not limited"""
+        person = Person.objects.create(name="Member")
+        event = Event.objects.create(summary="Open Shop", description="", start=datetime.datetime.now(datetime.timezone.utc), end=datetime.datetime.now(datetime.timezone.utc))
+        self.assertEqual(person.check_in(event.id), person.check_in(event.id))
+        person.check_in()
+        person.check_in()
+        self.assertEqual(PersonEvent.objects.filter(person=person).count(), 3)
+
+        duplicate = Person.objects.create(name="Member")
+        duplicate.check_in(event.id)
+        person.merge(duplicate.id)
+        self.assertEqual(PersonEvent.objects.filter(event=event).count(), 1)
+
+    def test_template_create_or_update(self):
+        """Templates should be created once and then updated"""
+        template_api = {'id': 7, 'folder_name': "Waivers", 'name': "Waiver", 'slug': "waiver"}
+        DocusealTemplate.create_or_update(template_api)
+        DocusealTemplate.create_or_update(dict(template_api, name="Waiver 2025", slug="changed"))
+        template = DocusealTemplate.objects.get()
+        self.assertEqual((template.name, template.slug), ("Waiver 2025", "waiver"))
+
+    def test_submission_update_does_not_need_its_template(self):
+        """Updating a submission should not look up its template, and creating one should fetch a template that is not stored yet"""
+        submission_api = {'id': 5, 'slug': "s5", 'status': 'completed', 'created_at': None, 'completed_at': None, 'archived_at': None, 'template': {'id': 9}, 'submitters': []}
+        DocusealSubmission.objects.create(submission_id=5, status='pending', slug="s5")
+        with mock.patch('subwaive.models.docuseal.get_template') as get_template:
+            DocusealSubmission.create_or_update(5, submission_api)
+        get_template.assert_not_called()
+        self.assertEqual(DocusealSubmission.objects.get().status, 'completed')
+
+        with mock.patch('subwaive.models.docuseal.get_template', return_value={'id': 9, 'folder_name': "Waivers", 'name': "Waiver", 'slug': "waiver"}):
+            DocusealSubmission.create_or_update(6, dict(submission_api, id=6, slug="s6"))
+        self.assertEqual(DocusealSubmission.objects.get(submission_id=6).template.template_id, 9)
+
+    def test_reconcile_updates_rows_inserted_meanwhile(self):
+        """A row inserted after the reconcile looked for it should be updated instead of failing the refresh"""
+        StripeProduct.objects.create(stripe_id="prod_1", name="Old", description="")
+        with mock.patch.object(StripeProduct.objects, 'filter', return_value=StripeProduct.objects.none()):
+            counts = reconcile_stripe(StripeProduct, [{'id': "prod_1", 'created': 1}], lambda p: {'stripe_id': p['id'], 'name': "New", 'description': ""}, new_only=True)
+        self.assertEqual(counts['inserted'], 1)
+        self.assertEqual(StripeProduct.objects.get().name, "New")
+
+
+class DocusealBulkTestCase(TestCase):
+    def setUp(self):
+        DocusealTemplate.objects.create(template_id=1, folder_name="Waivers", name="Waiver", slug="waiver")
+        DocusealField.objects.create(field="Full Name")
+        self.submissions_api = [
+            {'id': submission_id, 'slug': f"s{ submission_id }", 'status': 'completed', 'created_at': None, 'completed_at': None, 'archived_at': None, 'template': {'id': 1},
+             'submitters': [{'id': submission_id, 'email': email, 'slug': f"u{ submission_id }"}]}
+            for submission_id, email in [(1, "one@example.com"), (2, "two@example.com"), (3, "one@example.com")]
+        ]
+
+    def test_bulk_new_creates_and_associates(self):
+        """Bulk creation should link submitters to one person per email and skip existing submissions"""
+        DocusealSubmission.bulk_new(self.submissions_api)
+        DocusealSubmission.bulk_new(self.submissions_api)
+
+        self.assertEqual(DocusealSubmission.objects.count(), 3)
+        self.assertEqual(DocusealSubmitterSubmission.objects.count(), 3)
+        self.assertEqual(Person.objects.count(), 2)
+        self.assertEqual(PersonDocuseal.objects.filter(person__preferred_email__email="one@example.com").count(), 2)
+
+    def test_field_store_refresh_uses_bulk_writes(self):
+        """The field store refresh should match field titles loosely and store the values"""
+        DocusealSubmission.bulk_new(self.submissions_api)
+        submission_api = {'submitters': [{'values': [{'field': ' full name', 'value': 'First Person'}, {'field': 'Other', 'value': 'x'}]}]}
+        with mock.patch('docuseal.docuseal.get_submission', return_value=submission_api):
+            DocusealFieldStore.refresh()
+
+        self.assertEqual(DocusealFieldStore.objects.count(), 3)
+        self.assertEqual(Person.objects.get(preferred_email__email="two@example.com").name, "First Person")
+
+
+class PersonSearchTestCase(TestCase):
+    def setUp(self):
+        self.jose = Person.objects.create(name="José Smith")
+        PersonEmail.objects.create(person=self.jose, email="jsmith@example.com")
+        self.joanna = Person.objects.create(name="Joanna Smithers")
+        PersonEmail.objects.create(person=self.joanna, email="joanna@example.com")
+        self.other = Person.objects.create(name="Someone Else")
+        PersonEmail.objects.create(person=self.other, email="else@example.org")
+
+        template = DocusealTemplate.objects.create(template_id=1, folder_name="Waivers", name="Waiver", slug="waiver")
+        submission = DocusealSubmission.objects.create(submission_id=1, status="completed", slug="submission", template=template)
+        submitter = DocusealSubmitter.objects.create(submitter_id=1, email="else@example.org", slug="submitter")
+        DocusealSubmitterSubmission.objects.create(submission=submission, submitter=submitter)
+        PersonDocuseal.objects.create(person=self.other, submitter=submitter)
+        field = DocusealField.objects.create(field="Emergency Contact")
+        DocusealFieldStore.objects.create(submission=submission, field=field, value="Jo Smith")
+
+        PersonSearchToken.rebuild_all()
+
+    def test_prefix_search_is_ranked_and_accent_free(self):
+        """Every word should prefix-match a name, email or field token, with name matches ranked above field matches"""
+        self.assertEqual(list(Person.search("jo smith")), [self.jose, self.joanna, self.other])
+        self.assertEqual(list(Person.search("JOSE")), [self.jose])
+        self.assertEqual(list(Person.search("joanna@example.com")), [self.joanna])
+        self.assertEqual(list(Person.search("smithers example")), [self.joanna])
+        self.assertEqual(list(Person.search("nobody")), [])
+        self.assertEqual(list(Person.search("  ")), [])
+
+    def test_search_comes_from_one_query(self):
+        """The ranked people should be read in a single query, with the token scores as subqueries"""
+        with self.assertNumQueries(1):
+            results = list(Person.search("jo smi"))
+        self.assertEqual([p.search_rank for p in results], sorted([p.search_rank for p in results], reverse=True))
+
+    def test_prefix_search_is_limited(self):
+        """A prefix search should return only the best PERSON_SEARCH_LIMIT people"""
+        with mock.patch('subwaive.models.PERSON_SEARCH_LIMIT', 2):
+            self.assertEqual(list(Person.search("jo smith")), [self.jose, self.joanna])
+            self.assertEqual(Person.search("jo smith").exclude(id=self.jose.id).count(), 1)
+
+    def test_index_follows_merges_and_renames(self):
+        """Merging and renaming should keep the tokens in step with the person"""
+        self.jose.merge(self.joanna.id)
+        self.assertEqual(list(Person.search("joanna")), [self.jose])
+
+        self.client.force_login(User.objects.create_superuser("admin"))
+        name = DocusealFieldStore.objects.get()
+        self.client.get(reverse('set_docuseal_name', args=[self.jose.id, name.id]))
+        self.assertEqual(list(Person.search("jos")), [])
+        self.assertIn(self.jose, Person.search("jo smith"))
+
+        response = self.client.post(reverse('person_search'), {'search_term': "smith"})
+        self.assertContains(response, "Jo Smith")
+
+
+class FakeDocusealHandler(BaseHTTPRequestHandler):
+    """Serve submissions and submitters by id after a short delay, tracking how many requests overlap"""
+    # the docuseal client expects the connection to stay open after the response
+    protocol_version = 'HTTP/1.1'
+    lock = threading.Lock()
+    in_flight = 0
+    peak = 0
+    calls = []
+
+    def do_GET(self):
+        cls = FakeDocusealHandler
+        with cls.lock:
+            cls.in_flight += 1
+            cls.peak = max(cls.peak, cls.in_flight)
+            cls.calls.append(self.path)
+        time.sleep(0.05)
+        (kind, object_id) = self.path.split('?')[0].strip('/').split('/')
+        object_id = int(object_id)
+        if kind == 'submitters':
+            body = {'id': object_id, 'email': f"user{ object_id }@example.com", 'slug': f"u{ object_id }"}
+        else:
+            body = {'id': object_id, 'slug': f"s{ object_id }", 'status': 'completed', 'created_at': None, 'completed_at': None, 'archived_at': None, 'template': {'id': 1},
+                    'submitters': [{'submitter_id': object_id, 'values': [{'field': 'Full Name', 'value': f"Person { object_id }"}]}]}
+        with cls.lock:
+            cls.in_flight -= 1
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class DocusealFetchTestCase(TestCase):
+    def setUp(self):
+        FakeDocusealHandler.peak = 0
+        FakeDocusealHandler.calls = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeDocusealHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = docuseal.url
+        docuseal.url = f"http://127.0.0.1:{ self.server.server_port }"
+        DocusealTemplate.objects.create(template_id=1, folder_name="Waivers", name="Waiver", slug="waiver")
+        DocusealField.objects.create(field="Full Name")
+
+    def tearDown(self):
+        docuseal.url = self.url
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_fetch_all_is_concurrent_and_bounded(self):
+        """fetch_all should return every key once, overlapping calls without exceeding the pool size"""
+        results = fetch_all(docuseal.get_submitter, [1, 2, 3, 2, 4, 5, 6], concurrency=3)
+
+        self.assertEqual(list(results), [1, 2, 3, 4, 5, 6])
+        self.assertEqual(results[5]['email'], "user5@example.com")
+        self.assertEqual(len(FakeDocusealHandler.calls), 6)
+        self.assertGreater(FakeDocusealHandler.peak, 1)
+        self.assertLessEqual(FakeDocusealHandler.peak, 3)
+
+    def test_refresh_paths_use_the_pool(self):
+        """Submitter creation and the field store refresh should fetch from the API concurrently"""
+        submission = DocusealSubmission.objects.create(submission_id=7, status="completed", slug="s7", template_id=1)
+        with mock.patch('subwaive.models.DOCUSEAL_API_RATE_LIMIT', None):
+            submitters = DocusealSubmitter.create_if_needed_by_id_list([1, 2, 3])
+        self.assertEqual(sorted(submitters), [1, 2, 3])
+        for submitter in submitters.values():
+            DocusealSubmitterSubmission.objects.create(submission=submission, submitter=submitter)
+        self.assertGreater(FakeDocusealHandler.peak, 1)
+
+        FakeDocusealHandler.calls = []
+        DocusealSubmitter.create_if_needed_by_id_list([1, 2, 3])
+        DocusealFieldStore.refresh()
+
+        self.assertEqual(FakeDocusealHandler.calls, ['/submissions/7?'])
+        self.assertEqual(list(DocusealFieldStore.objects.values_list("value", flat=True)), ["Person 7"])
+
+
+class QRCacheTestCase(TestCase):
+    def setUp(self):
+        qr_cache.clear()
+
+    def test_repeat_renders_hit_the_cache(self):
+        """The same content, size and format should only be encoded once"""
+        svg = generate_qr_svg("https://example.com/", 10)
+        self.assertIn("<rect", svg)
+        self.assertEqual(generate_qr_svg("https://example.com/", 10), svg)
+        generate_qr_svg("https://example.com/", 16)
+        (bmp, qr_size) = generate_qr_bitmap("https://example.com/")
+        self.assertEqual(generate_qr_bitmap("https://example.com/"), (bmp, qr_size))
+        self.assertEqual(len(bmp), (qr_size + 7) // 8 * qr_size)
+
+        stats = qr_cache.get_stats()
+        self.assertEqual((stats['renders'], stats['hits']), (3, 2))
+        self.assertEqual(stats['hit_rate'], 0.4)
+
+    def test_modules_are_bit_packed(self):
+        """The module matrix should unpack to the QR code's modules and be far smaller than the bitmap"""
+        (modules, qr_size) = generate_qr_modules("https://example.com/")
+        self.assertEqual(int.from_bytes(modules[:2], "big"), qr_size)
+        self.assertEqual(len(modules), 2 + (qr_size * qr_size + 7) // 8)
+
+        qr = qrcode.QRCode(version=5, border=0)
+        qr.add_data("https://example.com/")
+        qr.make(fit=True)
+        bits = [bool(modules[2 + (i >> 3)] & (0x80 >> (i & 7))) for i in range(qr_size * qr_size)]
+        self.assertEqual([bits[row * qr_size:(row + 1) * qr_size] for row in range(qr_size)], qr.get_matrix())
+
+        (bmp, bitmap_size) = generate_qr_bitmap("https://example.com/")
+        self.assertLess(len(modules) * 20, len(bmp))
+
+    def test_lru_evicts_to_the_directory_tier(self):
+        """Entries evicted from memory should come back from the directory without re-rendering"""
+        with tempfile.TemporaryDirectory() as directory:
+            cache = QRCache(max_size=1, directory=directory)
+            cache.get("a", 10, "svg", lambda: b"A")
+            cache.get("b", 10, "svg", lambda: b"B")
+            self.assertEqual(cache.get("a", 10, "svg", lambda: b"stale"), b"A")
+
+            stats = cache.get_stats()
+            self.assertEqual((stats['entries'], stats['renders'], stats['disk_hits']), (1, 2, 1))
+
+    def test_link_pages_do_no_encoding_when_warm(self):
+        """A second load of a QR link page should be served entirely from the cache"""
+        self.client.force_login(User.objects.create_user("staff"))
+        category = QRCategory.objects.create(name="Wifi", is_sensitive=False)
+        QRCustom.objects.create(category=category, name="Guest", content="WIFI:T:WPA;S:guest;P:guest;;")
+        self.client.get(reverse('public_link_list'))
+        renders = qr_cache.get_stats()['renders']
+        self.client.get(reverse('public_link_list'))
+
+        self.assertEqual(renders, 2)
+        self.assertEqual(self.client.get(reverse('qr_cache_stats')).json()['renders'], 2)
+
+
+class WebhookQueueTestCase(TestCase):
+    def post_stripe(self, event_type, data):
+        body = {'id': 'evt_1', 'object': 'event', 'type': event_type, 'data': {'object': data}}
+        return self.client.post('/stripe/webhook/', json.dumps(body), content_type='application/json', HTTP_STRIPE_SIGNATURE='sig')
+
+    def test_webhooks_are_queued_without_api_calls(self):
+        """Webhooks should be stored and acknowledged without touching the APIs"""
+        with mock.patch('subwaive.models.StripeSubscription.create_or_update') as refresh_subscription:
+            response = self.post_stripe('invoice.paid', {'id': 'in_1', 'subscription': 'sub_1'})
+        self.assertEqual(response.status_code, 200)
+        refresh_subscription.assert_not_called()
+
+        with mock.patch('subwaive.docuseal.DOCUSEAL_ENDPOINT_SECRET', 'secret'), mock.patch('subwaive.models.DocusealSubmission.create_or_update') as refresh_submission:
+            payload = {'event_type': 'form.completed', 'data': {'submission_id': 9, 'email': 'new@example.com', 'template': {'id': 1}}}
+            response = self.client.post('/docuseal/webhook/', json.dumps(payload), content_type='application/json', HTTP_X_DOCUSEAL_SIGNATURE='secret')
+        self.assertEqual(response.status_code, 200)
+        refresh_submission.assert_not_called()
+
+        self.assertEqual(list(WebhookEvent.objects.values_list('source', 'object_type', 'object_id', 'status')),
+                         [('stripe', 'subscription', 'sub_1', 'pending'), ('docuseal', 'submission', '9', 'pending')])
+
+    def test_worker_refreshes_each_object_once(self):
+        """Ten events for one subscription should cause a single refresh"""
+        for i in range(10):
+            WebhookEvent.enqueue('stripe', 'invoice.paid', 'subscription', 'sub_1', {'id': f"in_{ i }"})
+        WebhookEvent.enqueue('stripe', 'payment_link.updated', 'payment_link', 'plink_1')
+
+        with mock.patch('subwaive.models.StripeSubscription.create_or_update') as refresh_subscription, mock.patch('subwaive.models.StripePaymentLink.create_or_update') as refresh_link:
+            call_command('process_webhooks', '--once')
+
+        refresh_subscription.assert_called_once_with('sub_1')
+        refresh_link.assert_called_once_with('plink_1')
+        self.assertFalse(WebhookEvent.objects.exclude(status=WebhookEvent.STATUS_DONE).exists())
+
+    def test_failed_events_are_retried_then_given_up(self):
+        """Errors should leave events queued until they run out of attempts"""
+        WebhookEvent.enqueue('stripe', 'payment_link.updated', 'payment_link', 'plink_1')
+
+        with mock.patch('subwaive.models.StripePaymentLink.create_or_update', side_effect=Exception("API down")) as refresh_link:
+            WebhookEvent.process_pending()
+            self.assertEqual(WebhookEvent.objects.get().status, WebhookEvent.STATUS_PENDING)
+            for i in range(10):
+                # the next attempt comes round once its delay has passed
+                WebhookEvent.objects.update(next_attempt_at=F('next_attempt_at') - datetime.timedelta(hours=2))
+                WebhookEvent.process_pending()
+
+        event = WebhookEvent.objects.get()
+        self.assertEqual(refresh_link.call_count, WEBHOOK_MAX_ATTEMPTS)
+        self.assertEqual((event.status, event.error), (WebhookEvent.STATUS_FAILED, "API down"))
+
+    def test_failed_events_back_off(self):
+        """A failure should hold an event back for a delay that doubles with each attempt"""
+        WebhookEvent.enqueue('stripe', 'payment_link.updated', 'payment_link', 'plink_1')
+
+        with mock.patch('subwaive.models.StripePaymentLink.create_or_update', side_effect=Exception("API down")) as refresh_link:
+            WebhookEvent.process_pending()
+            WebhookEvent.process_pending()
+            self.assertEqual(refresh_link.call_count, 1)
+            event = WebhookEvent.objects.get()
+            self.assertEqual(event.next_attempt_at - event.processed_at, WebhookEvent.get_retry_delay(1))
+
+            WebhookEvent.objects.update(next_attempt_at=event.processed_at)
+            WebhookEvent.process_pending()
+            self.assertEqual(refresh_link.call_count, 2)
+            event = WebhookEvent.objects.get()
+            self.assertEqual(event.next_attempt_at - event.processed_at, 2 * WebhookEvent.get_retry_delay(1))
+
+        with mock.patch('subwaive.models.StripePaymentLink.create_or_update') as refresh_link:
+            WebhookEvent.objects.update(next_attempt_at=event.processed_at)
+            WebhookEvent.process_pending()
+        self.assertEqual((WebhookEvent.objects.get().status, WebhookEvent.objects.get().next_attempt_at), (WebhookEvent.STATUS_DONE, None))
+
+    def test_claimed_events_are_left_to_their_worker(self):
+        """Events another worker has claimed should not be handled again until the claim runs out"""
+        WebhookEvent.enqueue('stripe', 'payment_link.updated', 'payment_link', 'plink_1')
+        self.assertEqual(len(WebhookEvent.claim()), 1)
+        self.assertEqual(WebhookEvent.claim(), [])
+        with mock.patch('subwaive.models.StripePaymentLink.create_or_update') as refresh_link:
+            self.assertEqual(WebhookEvent.process_pending(), 0)
+        refresh_link.assert_not_called()
+
+
+class StripeAPICacheTestCase(TestCase):
+    def setUp(self):
+        stripe_cache.clear()
+
+    def api_object(self, **values):
+        return stripe.StripeObject.construct_from(values, None)
+
+    def test_shared_objects_are_fetched_once(self):
+        """Prices of the same product should only retrieve the product once"""
+        prices = {
+            'price_1': self.api_object(id='price_1', nickname="Monthly", unit_amount=5000, product='prod_1', recurring=None),
+            'price_2': self.api_object(id='price_2', nickname="Yearly", unit_amount=50000, product='prod_1', recurring=None),
+        }
+        product = self.api_object(id='prod_1', name="Membership", description="")
+        with mock.patch('stripe.Price.retrieve', side_effect=lambda stripe_id, **kwargs: prices[stripe_id]) as retrieve_price, mock.patch('stripe.Product.retrieve', return_value=product) as retrieve_product:
+            StripePrice.create_or_update('price_1')
+            StripePrice.create_or_update('price_2')
+            StripePrice.create_or_update('price_1')
+
+        self.assertEqual(retrieve_price.call_count, 2)
+        retrieve_product.assert_called_once_with('prod_1')
+        self.assertEqual(StripePrice.objects.filter(product__stripe_id='prod_1').count(), 2)
+
+        stats = stripe_cache.get_stats()
+        self.assertEqual((stats['object_types']['product']['hits'], stats['object_types']['product']['misses']), (2, 1))
+        self.assertEqual((stats['hits'], stats['misses']), (3, 3))
+
+    def test_webhooks_invalidate_cached_objects(self):
+        """A webhook should make the next refresh of its object call the API again"""
+        with mock.patch('stripe.Customer.retrieve', return_value=self.api_object(id='cus_1', name="Old", email="a@example.com")) as retrieve:
+            StripeCustomer.create_or_update('cus_1')
+            StripeCustomer.create_or_update('cus_1')
+        retrieve.assert_called_once()
+
+        WebhookEvent.enqueue('stripe', 'customer.updated', 'customer', 'cus_1')
+        with mock.patch('stripe.Customer.retrieve', return_value=self.api_object(id='cus_1', name="New", email="a@example.com")) as retrieve:
+            WebhookEvent.process_pending()
+        retrieve.assert_called_once()
+        self.assertEqual(StripeCustomer.objects.get(stripe_id='cus_1').name, "New")
+        self.assertEqual(stripe_cache.get_stats()['object_types']['customer']['invalidations'], 1)
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'web'},
+        'worker': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'worker'},
+    })
+    def test_worker_drops_its_own_cached_copy(self):
+        """A webhook received by the web process should still make the worker, with a cache of its own, call the API"""
+        web_cache = APICache('stripe', {'customer': 60})
+        worker_cache = APICache('stripe', {'customer': 60}, alias='worker')
+        with mock.patch('subwaive.models.stripe_cache', worker_cache), mock.patch('stripe.Customer.retrieve', return_value=self.api_object(id='cus_1', name="Old", email="a@example.com")):
+            StripeCustomer.create_or_update('cus_1')
+
+        with mock.patch('subwaive.models.stripe_cache', web_cache):
+            WebhookEvent.enqueue('stripe', 'customer.updated', 'customer', 'cus_1')
+        with mock.patch('subwaive.models.stripe_cache', worker_cache), mock.patch('stripe.Customer.retrieve', return_value=self.api_object(id='cus_1', name="New", email="a@example.com")) as retrieve:
+            WebhookEvent.process_pending()
+        retrieve.assert_called_once()
+        self.assertEqual(StripeCustomer.objects.get(stripe_id='cus_1').name, "New")
+
+    def test_subscription_webhooks_drop_the_checkout_name(self):
+        """Invalidating a subscription should also forget the name taken from its checkout"""
+        cache = APICache('test', {'subscription': 60, 'subscription_name': 60}, {'subscription': ('subscription_name',)})
+        cache.get('subscription_name', 'sub_1', lambda: "Alex")
+        cache.invalidate('subscription', 'sub_1')
+        self.assertEqual(cache.get('subscription_name', 'sub_1', lambda: "Sam"), "Sam")
+
+    def test_zero_ttl_is_not_cached(self):
+        """Object types without a TTL should always call the API"""
+        cache = APICache('test', {'customer': 0})
+        fetch = mock.Mock(return_value="customer")
+        cache.get('customer', 'cus_1', fetch)
+        cache.get('customer', 'cus_1', fetch)
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_stats_view(self):
+        """The stats page should report counters as JSON"""
+        self.client.force_login(User.objects.create_user("staff"))
+        stripe_cache.get('product', 'prod_1', lambda: "product")
+        stripe_cache.get('product', 'prod_1', lambda: "product")
+        stats = self.client.get(reverse('stripe_cache_stats')).json()
+        self.assertEqual(stats['object_types']['product']['hit_rate'], 0.5)
+
+
+class StripeExpandedSyncTestCase(TestCase):
+    def setUp(self):
+        stripe_cache.clear()
+
+    def api_object(self, values):
+        return stripe.StripeObject.construct_from(values, None)
+
+    def api_list(self, *objects):
+        return self.api_object({'object': 'list', 'has_more': False, 'data': list(objects)})
+
+    def api_price(self, price_id, product_id):
+        return {'id': price_id, 'nickname': price_id, 'unit_amount': 100, 'recurring': None,
+                'product': {'id': product_id, 'object': 'product', 'name': "Membership", 'description': None}}
+
+    def api_subscription(self, subscription_id, customer_id, price_id, created):
+        return self.api_object({
+            'id': subscription_id, 'object': 'subscription', 'created': created, 'current_period_end': created + 1000, 'status': 'active',
+            'customer': {'id': customer_id, 'object': 'customer', 'name': customer_id, 'email': f"{ customer_id }@example.com"},
+            'items': {'object': 'list', 'has_more': False, 'data': [{'id': f"si_{ subscription_id }", 'price': self.api_price(price_id, 'prod_1')}]},
+        })
+
+    def test_subscription_graph_needs_no_retrieves(self):
+        """A subscription sync should take customers, prices and products from the expanded listing and names from one session listing"""
+        subscriptions = [self.api_subscription('sub_3', 'cus_2', 'price_2', 1700000300), self.api_subscription('sub_2', 'cus_1', 'price_1', 1700000200), self.api_subscription('sub_1', 'cus_1', 'price_1', 1700000100)]
+        sessions = [self.api_object({'id': 'cs_1', 'subscription': 'sub_1', 'custom_fields': [{'text': {'value': "Alex"}}]}), self.api_object({'id': 'cs_2', 'subscription': 'sub_2', 'custom_fields': []})]
+
+        def list_sessions(**kwargs):
+            return self.api_list() if 'subscription' in kwargs else mock.Mock(auto_paging_iter=mock.Mock(return_value=iter(sessions)))
+
+        with mock.patch('stripe.Subscription.list', return_value=mock.Mock(auto_paging_iter=mock.Mock(return_value=iter(subscriptions)))) as list_subscriptions, \
+             mock.patch('stripe.checkout.Session.list', side_effect=list_sessions) as list_sessions_mock, \
+             mock.patch('stripe.Customer.retrieve') as retrieve_customer, mock.patch('stripe.Price.retrieve') as retrieve_price, mock.patch('stripe.Product.retrieve') as retrieve_product:
+            counts = StripeSubscription.refresh()
+
+        self.assertEqual(counts['inserted'], 3)
+        self.assertIn('data.items.data.price.product', list_subscriptions.call_args.kwargs['expand'])
+        for retrieve in (retrieve_customer, retrieve_price, retrieve_product):
+            retrieve.assert_not_called()
+        # sessions are listed back to a day before the oldest new subscription, and sub_3 has no session so it is looked up on its own
+        self.assertEqual(list_sessions_mock.call_args_list[0].kwargs['created'], {'gte': 1700000100 - 86400})
+        self.assertEqual(list_sessions_mock.call_count, 2)
+        self.assertEqual(dict(StripeSubscription.objects.values_list('stripe_id', 'name')), {'sub_1': "Alex", 'sub_2': "self", 'sub_3': "self"})
+        self.assertEqual(StripeSubscriptionItem.objects.count(), 3)
+        self.assertEqual(StripeProduct.objects.get().description, "")
+        self.assertEqual(StripeCustomer.objects.count(), 2)
+
+    def test_payment_link_prices_come_from_one_listing(self):
+        """Payment link prices should come from the expanded listing unless a link has more line items than fit in it"""
+        StripePaymentLink.objects.create(stripe_id='plink_1', url="https://buy.stripe.com/1")
+        StripePaymentLink.objects.create(stripe_id='plink_2', url="https://buy.stripe.com/2")
+        payment_links = [
+            self.api_object({'id': 'plink_1', 'line_items': {'object': 'list', 'has_more': False, 'data': [{'id': 'li_1', 'price': self.api_price('price_1', 'prod_1')}]}}),
+            self.api_object({'id': 'plink_2', 'line_items': {'object': 'list', 'has_more': True, 'data': []}}),
+        ]
+        more_line_items = [self.api_object({'id': 'li_2', 'price': self.api_price('price_2', 'prod_1')})]
+
+        with mock.patch('stripe.PaymentLink.list', return_value=mock.Mock(auto_paging_iter=mock.Mock(return_value=iter(payment_links)))), \
+             mock.patch('stripe.PaymentLink.list_line_items', return_value=mock.Mock(auto_paging_iter=mock.Mock(return_value=iter(more_line_items)))) as list_line_items, \
+             mock.patch('stripe.Price.retrieve') as retrieve_price, mock.patch('stripe.Product.retrieve') as retrieve_product:
+            StripePaymentLinkPrice.refresh()
+
+        list_line_items.assert_called_once()
+        self.assertEqual(list_line_items.call_args.args[0], 'plink_2')
+        retrieve_price.assert_not_called()
+        retrieve_product.assert_not_called()
+        self.assertEqual(set(StripePaymentLinkPrice.objects.values_list('payment_link__stripe_id', 'price__stripe_id')), {('plink_1', 'price_1'), ('plink_2', 'price_2')})
+
+
+class SyncOrchestratorTestCase(TestCase):
+    def task(self, run, after=(), source='test'):
+        return {'source': source, 'model': Person, 'after': list(after), 'run': run}
+
+    def fail(self, new_only):
+        raise Exception("API down")
+
+    def test_tasks_run_after_their_dependencies(self):
+        """Tasks should run in dependency order, and a failure should skip what depends on it"""
+        order = []
+        tasks = {
+            'price': self.task(lambda new_only: order.append('price'), after=['product']),
+            'product': self.task(lambda new_only: order.append('product') or {'inserted': 2}),
+            'customer': self.task(self.fail, source='other'),
+            'subscription': self.task(lambda new_only: order.append('subscription'), after=['customer', 'price']),
+        }
+        summary = {result['task']: result for result in sync.run(tasks, workers=0)}
+
+        self.assertEqual(order, ['product', 'price'])
+        self.assertEqual({name: result['status'] for name, result in summary.items()},
+                         {'price': 'ok', 'product': 'ok', 'customer': 'error', 'subscription': 'skipped'})
+        self.assertEqual(summary['product']['counts'], {'inserted': 2})
+        self.assertEqual(summary['customer']['error'], "Exception: API down")
+        self.assertEqual(Log.objects.get(description="Sync").logging_level, logging.ERROR)
+
+    def test_only_selects_tasks_and_sources(self):
+        """--only should accept task names and sources, treating unselected dependencies as done"""
+        tasks = {'a': self.task(lambda new_only: None), 'b': self.task(lambda new_only: None, after=['a'], source='other')}
+        self.assertEqual([result['task'] for result in sync.run(tasks, only=['other'], workers=0)], ['b'])
+        with self.assertRaises(ValueError):
+            sync.run(tasks, only=['nothing'], workers=0)
+
+    def test_explicit_tasks_only_run_when_named(self):
+        """An explicit task such as the full eligibility rebuild should be left out unless --only names it"""
+        tasks = {'a': self.task(lambda new_only: None), 'everyone': dict(self.task(lambda new_only: None, after=['a']), explicit=True)}
+        self.assertEqual(sync.select(tasks), ['a'])
+        self.assertEqual(sync.select(tasks, only=['test']), ['a'])
+        self.assertEqual(sync.select(tasks, only=['everyone']), ['everyone'])
+        self.assertNotIn('eligibility', sync.select(sync.TASKS))
+
+    def test_workers_run_in_parallel_with_timeouts(self):
+        """Worker processes should run side by side, and a task past its timeout should be stopped"""
+        tasks = {
+            'slow': self.task(lambda new_only: time.sleep(30)),
+            'fast': self.task(lambda new_only: {'inserted': 1}, source='other'),
+            'after_slow': self.task(lambda new_only: None, after=['slow']),
+        }
+        start = time.monotonic()
+        summary = {result['task']: result for result in sync.run(tasks, workers=2, timeouts={'test': 1}, default_timeout=30)}
+
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual({name: result['status'] for name, result in summary.items()}, {'slow': 'timeout', 'fast': 'ok', 'after_slow': 'skipped'})
+        self.assertEqual(summary['fast']['counts'], {'inserted': 1})
+
+    def test_command_reports_a_summary(self):
+        """manage.py sync should print a row per task and fail when one does not finish"""
+        with mock.patch.dict(sync.TASKS, {'ok': self.task(lambda new_only: {'updated': 3})}, clear=True), mock.patch('builtins.print') as output:
+            call_command('sync', '--workers', '0', '--json')
+        self.assertEqual(json.loads(output.call_args.args[0])[0]['counts'], {'updated': 3})
+        with mock.patch.dict(sync.TASKS, {'bad': self.task(self.fail)}, clear=True), mock.patch('builtins.print'), self.assertRaises(CommandError):
+            call_command('sync', '--workers', '0')
+
+    def test_task_graph_is_complete(self):
+        """Every dependency of a real task should be a task"""
+        for name, task in sync.TASKS.items():
+            self.assertTrue(set(task['after']) <= set(sync.TASKS), name)
+
+
+class CalendarSyncTestCase(TestCase):
+    def make_event(self, uid, summary, days):
+        start = datetime.datetime.now(tz=pytz.utc).replace(microsecond=0) + datetime.timedelta(days=days)
+        event = icalendar.Event()
+        event.add('uid', uid)
+        event.add('summary', summary)
+        event.add('description', f"{ summary } description")
+        event.add('dtstart', start)
+        event.add('dtend', start + datetime.timedelta(hours=2))
+        return event
+
+    def sync(self, events):
+        with mock.patch('subwaive.models.CalendarEvent.get_event_list_from_calendar_url', return_value=events):
+            return CalendarEvent.sync()
+
+    def test_sync_writes_only_changes(self):
+        """A second sync of an unchanged calendar should write nothing, and changes should keep Event ids where possible"""
+        uid = "6f1c8b54-2a7e-4f0e-9c55-3a2b1f7d9e10"
+        other_uid = "0b8e7f1a-4c3d-4e5f-8a9b-1c2d3e4f5a6b"
+        weekly = [self.make_event(uid, "Open Shop", days) for days in [-7, 7, 14]]
+        one_off = self.make_event(other_uid, "Class", 3)
+
+        self.assertEqual(self.sync(weekly + [one_off]), {'inserted': 4, 'updated': 0, 'removed': 0})
+        self.assertEqual(Event.objects.count(), 3)
+        event_ids = set(Event.objects.values_list('id', flat=True))
+
+        self.assertEqual(self.sync(weekly + [one_off]), {'inserted': 0, 'updated': 0, 'removed': 0})
+        self.assertEqual(set(Event.objects.values_list('id', flat=True)), event_ids)
+
+        # the class is cancelled, but someone already checked in to next week's open shop
+        checked_in = Event.objects.get(calendar_event__recurrence_order=2)
+        PersonEvent.objects.create(person=Person.objects.create(name="Early Bird"), event=checked_in)
+        moved = [weekly[0], self.make_event(uid, "Open Shop", 8), weekly[2]]
+        self.assertEqual(self.sync(moved), {'inserted': 0, 'updated': 1, 'removed': 1})
+
+        self.assertFalse(Event.objects.filter(summary="Class").exists())
+        self.assertTrue(Event.objects.filter(id=checked_in.id).exists())
+        self.assertEqual(Event.objects.filter(summary="Open Shop").count(), 3)
+
+    def test_refresh_event_reuses_the_downloaded_calendar(self):
+        """Refreshing a single event should not download the calendar again"""
+        uid = "6f1c8b54-2a7e-4f0e-9c55-3a2b1f7d9e10"
+        self.sync([self.make_event(uid, "Open Shop", 7)])
+        calendar_event = CalendarEvent.objects.get()
+        calendar_event.summary = "Edited locally"
+        calendar_event.save()
+
+        with mock.patch('subwaive.models.CalendarEvent.get_event_list_from_calendar_url') as fetch:
+            calendar_event.refresh_event()
+        fetch.assert_not_called()
+        self.assertEqual(CalendarEvent.objects.get().summary, "Open Shop")
+
+
+class LogBufferTestCase(TestCase):
+    def test_buffered_entries_are_written_together(self):
+        """Entries should be held until the outermost block exits, then written in one insert"""
+        with self.assertNumQueries(2):
+            with Log.buffered():
+                Log.new(logging_level=logging.INFO, description="First")
+                with Log.buffered():
+                    Log.new(logging_level=logging.INFO, description="Second", json={'n': 2})
+                Log.new(logging_level=logging.NOTSET, description="Filtered")
+                self.assertEqual(Log.objects.count(), 0)
+        self.assertEqual(list(Log.objects.order_by('timestamp').values_list('description', flat=True)), ["First", "Second"])
+
+    def test_buffer_flushes_on_exceptions_and_thresholds(self):
+        """An exception or a full buffer should write what has been held so far"""
+        with self.assertRaises(ValueError):
+            with Log.buffered():
+                Log.new(logging_level=logging.ERROR, description="Failed", other_info=ValueError("boom"))
+                raise ValueError("boom")
+        self.assertEqual(Log.objects.get().other_info, "boom")
+
+        with mock.patch('subwaive.models.LOG_BUFFER_SIZE', 2), Log.buffered():
+            for i in range(3):
+                Log.new(logging_level=logging.INFO, description=f"Entry { i }")
+            self.assertEqual(Log.objects.count(), 3)
+        self.assertEqual(Log.objects.count(), 4)
+
+    def test_requests_are_buffered(self):
+        """Each request should be handled inside a buffer"""
+        self.client.force_login(User.objects.create_user("staff"))
+        with mock.patch('subwaive.models.LogBuffer.flush', wraps=LogBuffer.flush) as flush:
+            self.client.get(reverse('qr_cache_stats'))
+        flush.assert_called_once()
+
+
+class RecentMemberActivityTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        tz = pytz.timezone("America/New_York")
+        today = datetime.date.today()
+        # the most recent Monday and Wednesday, in the evening so the UTC date is a day later
+        monday = today - datetime.timedelta(days=today.weekday())
+        wednesday = monday - datetime.timedelta(days=5)
+        events = [Event.objects.create(summary=str(d), description="", start=tz.localize(datetime.datetime.combine(d, datetime.time(20))),
+            end=tz.localize(datetime.datetime.combine(d, datetime.time(22)))) for d in [monday, wednesday, monday - datetime.timedelta(days=400)]]
+
+        volunteer_template = DocusealTemplate.objects.create(template_id=1, folder_name="Volunteers", name="MakeFixHack-Volunteer-Agreement", slug="volunteer")
+        for i, name in enumerate(["Member", "Volunteer"]):
+            person = Person.objects.create(name=name)
+            for event in events:
+                person.check_in(event.id)
+            if name == "Volunteer":
+                submission = DocusealSubmission.objects.create(submission_id=i, status="completed", slug="submission", template=volunteer_template)
+                submitter = DocusealSubmitter.objects.create(submitter_id=i, email="volunteer@example.com", slug="submitter")
+                DocusealSubmitterSubmission.objects.create(submitter=submitter, submission=submission)
+                PersonDocuseal.objects.create(person=person, submitter=submitter)
+        self.client.force_login(User.objects.create_user(username="staff"))
+
+    def test_counts_are_grouped_by_local_weekday(self):
+        """Check-ins in the window should be counted by local day-of-week, leaving out excluded people"""
+        counts = PersonEvent.count_by_weekday(datetime.date.today() - datetime.timedelta(days=60), ["Volunteer-Agreement"])
+        self.assertEqual([(c['person__name'], c['weekday'], c['count']) for c in counts], [("Member", 0, 1), ("Member", 2, 1)])
+        counts = PersonEvent.count_by_weekday(datetime.date.today() - datetime.timedelta(days=365))
+        self.assertEqual(sum(c['count'] for c in counts), 4)
+
+    def test_report_is_one_query_and_cached(self):
+        """The report should be computed in one query and then served from the cache"""
+        url = reverse('recent_member_activity', args=[60])
+        self.client.get(url)
+        cache.clear()
+        # session, user, report
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.context['grid'], [["Member", 1, '', 1, '', '', '', '']])
+        self.assertEqual(response.context['dow']['Monday'], 1)
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+
+class AttendanceRollupTestCase(TestCase):
+    def setUp(self):
+        tz = pytz.timezone("America/New_York")
+        monday = datetime.date.today() - datetime.timedelta(days=datetime.date.today().weekday())
+        # a late event on a Sunday belongs to that week, even though it is Monday in UTC
+        self.events = [Event.objects.create(summary=f"Open Shop { d }", description="", start=tz.localize(datetime.datetime.combine(d, datetime.time(21))),
+            end=tz.localize(datetime.datetime.combine(d, datetime.time(23)))) for d in [monday - datetime.timedelta(days=7), monday - datetime.timedelta(days=1)]]
+        self.persons = [Person.objects.create(name=name) for name in ["First", "Second"]]
+        self.week = monday - datetime.timedelta(days=7)
+
+    def test_check_ins_update_rollups(self):
+        """Checking in and removing check-ins should keep the rollups current"""
+        for event in self.events:
+            self.persons[0].check_in(event.id)
+        self.persons[1].check_in(self.events[0].id)
+
+        self.assertEqual([(a.event_id, a.check_ins, a.people) for a in EventAttendance.objects.order_by('date')],
+            [(self.events[0].id, 2, 2), (self.events[1].id, 1, 1)])
+        self.assertEqual(EventAttendance.objects.get(event=self.events[1]).date, self.week + datetime.timedelta(days=6))
+        self.assertEqual(PersonWeekAttendance.objects.get(person=self.persons[0]).check_ins, 2)
+        self.assertEqual(PersonWeekAttendance.objects.get(person=self.persons[0]).week, self.week)
+
+        self.client.force_login(User.objects.create_user(username="staff"))
+        self.client.get(reverse('delete_member_check_in', args=[self.persons[1].id, self.events[0].id]))
+        self.assertEqual(EventAttendance.objects.get(event=self.events[0]).check_ins, 1)
+        self.assertFalse(PersonWeekAttendance.objects.filter(person=self.persons[1]).exists())
+
+    def test_merge_and_rebuild_match(self):
+        """Rollups kept current through a merge should match a full rebuild"""
+        self.persons[0].check_in(self.events[0].id)
+        self.persons[1].check_in(self.events[0].id)
+        self.persons[0].merge(self.persons[1].id)
+        current = list(EventAttendance.objects.values_list('event', 'check_ins', 'people')) + list(PersonWeekAttendance.objects.values_list('person', 'week', 'check_ins'))
+
+        call_command('rollup_attendance')
+        self.assertEqual(current, list(EventAttendance.objects.values_list('event', 'check_ins', 'people')) + list(PersonWeekAttendance.objects.values_list('person', 'week', 'check_ins')))
+        self.assertEqual(EventAttendance.objects.get().people, 1)
+        self.assertEqual(DailyMembership.objects.get().date, datetime.date.today())
+
+    def test_report_views_read_rollups(self):
+        """Trend pages should read the rollups without touching check-ins"""
+        for event in self.events:
+            self.persons[0].check_in(event.id)
+        DailyMembership.record()
+        self.client.force_login(User.objects.create_user(username="staff"))
+        for url_name in ['attendance_by_event', 'attendance_by_week', 'membership_by_day']:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(url_name, args=[365*5]))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.context['rows']), 1 if url_name != 'attendance_by_event' else 2)
+            self.assertFalse(any('subwaive_personevent' in q['sql'] for q in queries))
+
+        self.assertEqual(self.client.post(reverse('rollup_attendance_by_token'), headers={'X-Refresh-Token': 'wrong'}).status_code, 401)
+
+
+class SQLProfileTestCase(TestCase):
+    def test_templates_are_normalized(self):
+        """Statements differing only in their literals should share a template"""
+        self.assertEqual(
+            SQLProfileMiddleware.normalize('SELECT  "name" FROM person WHERE id = 12 AND name = \'Bob\''),
+            SQLProfileMiddleware.normalize('SELECT "name" FROM person WHERE id = %s AND name = \'Alice\''),
+        )
+        self.assertEqual(SQLProfileMiddleware.normalize('SELECT 1 WHERE id IN (%s, %s, %s)'), 'SELECT ? WHERE id IN (...)')
+
+    def test_repeated_templates_are_flagged(self):
+        """Only templates at or above the threshold should be reported, most frequent first"""
+        queries = [('SELECT * FROM a WHERE id = 1', 0.001)] * 3 + [('SELECT * FROM b WHERE id = 2', 0.002)] * 4 + [('SELECT * FROM c', 0.001)]
+        summary = SQLProfileMiddleware.summarize(queries, threshold=3)
+        self.assertEqual(summary['count'], 8)
+        self.assertEqual(summary['templates'], 3)
+        self.assertEqual([(r['sql'], r['count']) for r in summary['repeated']], [('SELECT * FROM b WHERE id = ?', 4), ('SELECT * FROM a WHERE id = ?', 3)])
+
+    def test_summary_is_reported(self):
+        """Requests should carry a header and a log entry when profiling is on, and neither when it is off"""
+        self.client.force_login(User.objects.create_user("staff"))
+        response = self.client.get(reverse('qr_cache_stats'))
+        self.assertNotIn(SQLProfileMiddleware.HEADER, response)
+        self.assertFalse(Log.objects.filter(description__startswith="SQL profile").exists())
+
+        with override_settings(SQL_PROFILE='log,header', SQL_PROFILE_THRESHOLD=1):
+            self.client.handler.load_middleware()
+            response = self.client.get(reverse('qr_cache_stats'))
+        self.assertRegex(response[SQLProfileMiddleware.HEADER], r'^queries=\d+; db_ms=[\d.]+; repeated=\d+$')
+        log = Log.objects.get(description=f"SQL profile GET { reverse('qr_cache_stats') }")
+        self.assertEqual(log.logging_level, logging.WARNING)
+        self.assertGreater(log.json['count'], 0)
+
+
+class BenchmarkTestCase(TestCase):
+    def test_every_benchmarked_view_renders(self):
+        """The synthetic dataset should render each benchmarked view, and a run should not regress against itself"""
+        results = benchmark.run(scale=1, repeat=1)
+
+        self.assertEqual({name: r['status'] for name, r in results.items() if r['status'] != 200}, {})
+        self.assertEqual(benchmark.compare(results, results), [])
+
+    def test_compare_flags_regressions(self):
+        """Extra queries, large slowdowns and memory growth should be reported"""
+        baseline = {'person_list': {'status': 200, 'queries': 6, 'seconds': 0.1, 'peak_kib': 400}}
+        results = {'person_list': {'status': 200, 'queries': 7, 'seconds': 0.3, 'peak_kib': 900}, 'new_view': {'status': 200, 'queries': 1, 'seconds': 0.1, 'peak_kib': 1}}
+
+        self.assertEqual(len(benchmark.compare(results, baseline)), 3)
+        self.assertEqual(benchmark.compare(baseline, baseline), [])
@@ -48,6 +48,7 @@ urlpatterns.extend([
     path('', link.public_link_list),
     path('links/public/', link.public_link_list, name='public_link_list'),
     path('links/internal/', link.sensitive_link_list, name='sensitive_link_list'),
+    path('links/qr-cache/', link.qr_cache_stats, name='qr_cache_stats'),
 ])
 
 # NFC
@@ -62,8 +63,11 @@ urlpatterns.extend([
     path('email/<int:email_id>/unmerge/', person.unmerge_people, name='unmerge_people'),
     path('email/<int:email_id>/prefer/', person.set_preferred_email, name='set_preferred_email'),
     path('person/search/', person.person_search, name='person_search'),
+    path('person/duplicates/', person.duplicate_people, name='duplicate_people'),
     path('person/all/', person.person_list, name='person_list'),
+    path('person/all/page/', person.roster_page, {'roster': 'all'}, name='person_list_page'),
     path('person/members/', person.member_list, name='member_list'),
+    path('person/members/page/', person.roster_page, {'roster': 'members'}, name='member_list_page'),
     path('person/members/email/', person.member_email_list, name='member_email_list'),
     path('person/<int:person_id>/', person.person_card, name='person_card'),
     path('person/<int:person_id>/docuseal/', person.person_docuseal, name='person_docuseal'),
@@ -100,9 +104,14 @@ urlpatterns.extend([
     path('stripe/refresh/payment-links/', stripe.refresh_product_and_price, name='refresh_product_and_price'),
     path('stripe/refresh/subscriptions/', stripe.refresh_subscription_and_customer, name='refresh_subscription_and_customer'),
     path('stripe/webhook/', stripe.receive_webhook, name='receive_webhook'),
+    path('stripe/api-cache/', stripe.stripe_cache_stats, name='stripe_cache_stats'),
 ])
 
 # Reports
 urlpatterns.extend([
     path('report/recent-checkins/<int:lag_days>/days/', report.recent_member_activity, name="recent_member_activity"),
+    path('report/attendance/events/<int:lag_days>/days/', report.attendance_by_event, name="attendance_by_event"),
+    path('report/attendance/weeks/<int:lag_days>/days/', report.attendance_by_week, name="attendance_by_week"),
+    path('report/attendance/members/<int:lag_days>/days/', report.membership_by_day, name="membership_by_day"),
+    path('report/attendance/rollup/by-token/', report.rollup_attendance_by_token, name="rollup_attendance_by_token"),
 ])
@@ -1,11 +1,17 @@
+import hashlib
+import os
 import secrets
+import threading
+
+from collections import OrderedDict
+from pathlib import Path
 
 from PIL import Image
 
 from django.contrib.auth.decorators import login_required
 from django.core import mail
 from django.shortcuts import render, redirect
-from subwaive.models import Log
+from subwaive.models import SyncState
 from subwaive.settings import EMAIL_FROM
 
 import qrcode
@@ -17,28 +23,150 @@ CONFIDENTIALITY_LEVEL_PUBLIC = 'PUBLIC'
 
 QR_SMALL = 10
 QR_LARGE = 16
+QR_BITMAP = 4
+
+# rendered QR codes are kept in memory, and on disk too if a directory is set
+QR_CACHE_SIZE = int(os.environ.get("QR_CACHE_SIZE", 1024))
+QR_CACHE_DIR = os.environ.get("QR_CACHE_DIR")
+
+
+class QRCache:
+    """ A content-addressed cache of rendered QR codes, keyed by (content, box size, format).
+    Lookups check an in-process LRU, then the optional directory, and only then render. """
+    def __init__(self, max_size=QR_CACHE_SIZE, directory=QR_CACHE_DIR):
+        self.max_size = max_size
+        self.directory = Path(directory) if directory else None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.renders = 0
+
+    def get_key(self, content, box_size, format):
+        """ return the hash identifying a rendered QR code """
+        return hashlib.sha256(f"{ format }\0{ box_size }\0{ content }".encode("utf-8")).hexdigest()
+
+    def get(self, content, box_size, format, render):
+        """ return the bytes of a QR code, calling render() only if no tier has them """
+        key = self.get_key(content, box_size, format)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+        value = self.read(key)
+        with self.lock:
+            if value is None:
+                self.renders += 1
+            else:
+                self.disk_hits += 1
+        if value is None:
+            value = render()
+            self.write(key, value)
+
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return value
+
+    def read(self, key):
+        """ return a rendered QR code from the directory, if there is one """
+        if self.directory:
+            try:
+                return (self.directory / key).read_bytes()
+            except OSError:
+                pass
+        return None
+
+    def write(self, key, value):
+        """ save a rendered QR code to the directory, if there is one. failures only cost a re-render later """
+        if self.directory:
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                temp_path = self.directory / f"{ key }.{ threading.get_ident() }.tmp"
+                temp_path.write_bytes(value)
+                os.replace(temp_path, self.directory / key)
+            except OSError:
+                pass
+
+    def clear(self):
+        """ empty the in-process tier and reset the counters """
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.disk_hits = 0
+            self.renders = 0
+
+    def get_stats(self):
+        """ return render counts and hit rates """
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.renders
+            return {
+                'entries': len(self.entries),
+                'max_size': self.max_size,
+                'directory': str(self.directory) if self.directory else None,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'renders': self.renders,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else None,
+            }
+
+qr_cache = QRCache()
+
+def render_qr_svg(content, box_size=QR_SMALL):
+    """ Render an SVG QR code encoding content """
+    img = qrcode.make(content, image_factory=qrcode.image.svg.SvgImage, box_size=box_size)
+    return img.to_string().decode("utf-8").replace('svg:rect','rect').encode("utf-8")
+
+def render_qr_bitmap(content):
+    """ Render a raw bitmap QR code encoding content, prefixed with its 2-byte width """
+    png = qrcode.make(content, version=5, box_size=QR_BITMAP)
+    return png.size[0].to_bytes(2, "big") + png.tobytes()
+
+def render_qr_modules(content):
+    """ Render a QR code's module matrix, without a quiet zone, prefixed with its 2-byte width.
+    Modules are packed 1 bit each, most significant bit first and row after row with no padding between rows, set for dark """
+    qr = qrcode.QRCode(version=5, border=0)
+    qr.add_data(content)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+    size = len(matrix)
+
+    packed = bytearray((size * size + 7) // 8)
+    for i, is_dark in enumerate(module for row in matrix for module in row):
+        if is_dark:
+            packed[i >> 3] |= 0x80 >> (i & 7)
+    return size.to_bytes(2, "big") + bytes(packed)
 
 def generate_qr_svg(content, box_size=QR_SMALL):
     """ Return an SVG QR code encoding content """
-    img = qrcode.make(content, image_factory=qrcode.image.svg.SvgImage, box_size=box_size)
-    svg = img.to_string().decode("utf-8").replace('svg:rect','rect')
+    svg = qr_cache.get(content, box_size, "svg", lambda: render_qr_svg(content, box_size))
 
-    return svg
+    return svg.decode("utf-8")
 
 def generate_qr_bitmap(content):
     """ Return a raw bitmap QR code encoding content """
-    png = qrcode.make(content, version=5, box_size=4)
+    bmp = qr_cache.get(content, QR_BITMAP, "bitmap", lambda: render_qr_bitmap(content))
+
+    return (bmp[2:], int.from_bytes(bmp[:2], "big"))
+
+def generate_qr_modules(content):
+    """ Return a QR code's bit-packed module matrix, including its 2-byte width header, and the width """
+    modules = qr_cache.get(content, 1, "modules", lambda: render_qr_modules(content))
 
-    return (png.tobytes(), png.size[0])
+    return (modules, int.from_bytes(modules[:2], "big"))
 
 
 @login_required
 def refresh(request, page_title, data_source, tiles, buttons=None):
     """ a page for initiating data refreshes """
+    sync_states = SyncState.get_by_object_type([d['description'] for tile in tiles for d in tile['log_descriptions']])
     for tile in tiles:
         for d in tile['log_descriptions']:
-            if 'last_refresh' in d.keys():
-                d['last_refresh'] = Log.get_last("Refresh "+d['description']).timestamp
+            d['sync_state'] = sync_states.get(d['description'])
         for b in tile['buttons']:
             b['url'] = redirect(b['url_name']).url
 